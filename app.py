@@ -4,6 +4,8 @@ YAE (Young AI Editor) - ホームページ
 import os
 import streamlit as st
 from dotenv import load_dotenv
+from session_store import sync_session, new_session_id
+from telemetry import set_page, start_metrics_server
 
 # 環境変数読み込み
 load_dotenv()
@@ -15,6 +17,15 @@ st.set_page_config(
     layout="wide"
 )
 
+# セッションの永続化（URLの ?sid= をキーに、再読み込みやサーバー再起動の後も作業内容を復元）
+if "sid" not in st.query_params:
+    st.query_params["sid"] = st.session_state.get("session_id") or new_session_id()
+sync_session(st.session_state, st.query_params["sid"])
+
+# LLM呼び出しの計測（ページ名を付けて記録し、/metrics を公開）
+set_page("home")
+start_metrics_server()
+
 # セッション状態の初期化
 if "survey_data" not in st.session_state:
     st.session_state.survey_data = ""
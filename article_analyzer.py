@@ -0,0 +1,278 @@
+"""
+記事の構造解析（わかりやすさ・SEO基礎のローカル判定）
+Markdownの記事を見出し・段落・文に分け、文の長さ・段落の長さ・漢字の割合・タイトルの長さ・見出しの階層を測って
+readability と seo_basics を0〜5点で判定する。同じ記事なら常に同じ結果になり、LLMは使わない
+"""
+import re
+import statistics
+from dataclasses import dataclass, field
+
+
+# 文の長さ（文字数）：これを超える文は長すぎる／平均の目安
+LONG_SENTENCE = 80
+TARGET_SENTENCE_MEAN = 60
+# 段落の長さ：これを超える段落は1段落1テーマになっていない可能性が高い
+LONG_PARAGRAPH = 200
+MAX_PARAGRAPH_SENTENCES = 5
+# 漢字の割合（漢字・ひらがな・カタカナのうち）の目安
+KANJI_RATIO_RANGE = (0.20, 0.40)
+# 検索結果で省略されずに表示されやすいタイトルの長さ
+TITLE_LENGTH_RANGE = (20, 40)
+MAX_HEADING_LENGTH = 30
+MIN_SECTIONS = 2
+# 同じ種類の指摘を表示する上限
+MAX_FINDINGS_PER_KIND = 5
+
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+LIST_RE = re.compile(r"^\s*(?:[-*+]\s+|[・•]|\d+[.)]\s+)")
+SKIPPED_LINE_RE = re.compile(r"^\s*(?:!\[|>|\||```|---|\*\*\*)")
+LINK_RE = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+MARKUP_RE = re.compile(r"[*_`~]|\s")
+KANJI_RE = re.compile(r"[㐀-䶿一-鿿々〆]")
+HIRAGANA_RE = re.compile(r"[ぁ-ゟ]")
+KATAKANA_RE = re.compile(r"[ァ-ヺー]")
+OPEN_BRACKETS = "「『（(【"
+CLOSE_BRACKETS = "」』）)】"
+TERMINATORS = "。！？!?"
+
+
+@dataclass
+class Heading:
+    level: int
+    text: str
+
+
+@dataclass
+class Paragraph:
+    text: str
+    sentences: list = field(default_factory=list)
+
+    @property
+    def length(self) -> int:
+        return text_length(self.text)
+
+
+@dataclass
+class AnalysisFinding:
+    """判定の根拠になった指摘1件（text は該当箇所の抜粋）"""
+    axis: str
+    message: str
+    text: str = ""
+
+
+@dataclass
+class ArticleAnalysis:
+    """構造解析の結果"""
+    readability: int = 5
+    seo_basics: int = 5
+    metrics: dict = field(default_factory=dict)
+    findings: list = field(default_factory=list)
+
+    @property
+    def scores(self) -> dict:
+        return {"readability": self.readability, "seo_basics": self.seo_basics}
+
+    def to_dict(self) -> dict:
+        return {
+            "scores": self.scores,
+            "metrics": self.metrics,
+            "findings": [vars(f) for f in self.findings],
+        }
+
+
+def text_length(text: str) -> int:
+    """記号・空白を除いた文字数"""
+    return len(MARKUP_RE.sub("", text))
+
+
+def _plain(text: str) -> str:
+    return LINK_RE.sub(r"\1", text)
+
+
+def _excerpt(text: str, length: int = 30) -> str:
+    text = text.strip()
+    return text if len(text) <= length else text[:length] + "…"
+
+
+def split_sentences(text: str) -> list:
+    """句点・感嘆符・疑問符で文に分ける（「」などの括弧内では分けない）"""
+    sentences = []
+    depth = 0
+    start = 0
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if ch in OPEN_BRACKETS:
+            depth += 1
+        elif ch in CLOSE_BRACKETS:
+            depth = max(0, depth - 1)
+        elif ch in TERMINATORS and depth == 0:
+            end = i + 1
+            while end < len(text) and text[end] in TERMINATORS + CLOSE_BRACKETS:
+                end += 1
+            sentence = text[start:end].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = i = end
+            continue
+        i += 1
+    rest = text[start:].strip()
+    if rest:
+        sentences.append(rest)
+    return sentences
+
+
+def parse_markdown(article: str):
+    """(見出しのリスト, 段落のリスト) に分ける（箇条書き・引用・画像・表は段落に含めない）"""
+    headings = []
+    paragraphs = []
+    current = []
+
+    def flush():
+        if current:
+            text = _plain("".join(current))
+            paragraphs.append(Paragraph(text, split_sentences(text)))
+            current.clear()
+
+    for line in article.splitlines():
+        stripped = line.strip()
+        match = HEADING_RE.match(stripped)
+        if match:
+            flush()
+            headings.append(Heading(len(match.group(1)), match.group(2).strip()))
+        elif not stripped or LIST_RE.match(stripped) or SKIPPED_LINE_RE.match(stripped):
+            flush()
+        else:
+            current.append(stripped)
+    flush()
+    return headings, paragraphs
+
+
+def _limited(findings: list, axis: str, label: str) -> list:
+    """同じ種類の指摘は上限までにし、残りは件数だけ伝える"""
+    if len(findings) <= MAX_FINDINGS_PER_KIND:
+        return findings
+    rest = len(findings) - MAX_FINDINGS_PER_KIND
+    return findings[:MAX_FINDINGS_PER_KIND] + [AnalysisFinding(axis, f"ほかに{label}が{rest}件あります")]
+
+
+def _readability(paragraphs: list, metrics: dict):
+    findings = []
+    penalty = 0.0
+    lengths = [text_length(s) for p in paragraphs for s in p.sentences]
+    body = "".join(p.text for p in paragraphs)
+
+    metrics["sentences"] = len(lengths)
+    metrics["paragraphs"] = len(paragraphs)
+    if lengths:
+        ordered = sorted(lengths)
+        metrics["sentence_mean"] = round(statistics.fmean(lengths), 1)
+        metrics["sentence_median"] = statistics.median(lengths)
+        metrics["sentence_p90"] = ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+        metrics["sentence_max"] = ordered[-1]
+
+    long_sentences = [
+        AnalysisFinding("readability", f"文が{text_length(s)}文字あります（{LONG_SENTENCE}文字以内が目安）。2つの文に分けられないか検討してください", _excerpt(s))
+        for p in paragraphs for s in p.sentences if text_length(s) > LONG_SENTENCE
+    ]
+    metrics["long_sentences"] = len(long_sentences)
+    penalty += min(2.0, 0.5 * len(long_sentences))
+    findings += _limited(long_sentences, "readability", "長い文")
+    if lengths and metrics["sentence_mean"] > TARGET_SENTENCE_MEAN:
+        penalty += 1.0
+        findings.append(AnalysisFinding(
+            "readability", f"文の長さの平均が{metrics['sentence_mean']:.0f}文字です（{TARGET_SENTENCE_MEAN}文字以内が目安）"))
+
+    long_paragraphs = [
+        AnalysisFinding("readability", f"段落が{p.length}文字・{len(p.sentences)}文あります。1段落1テーマになるよう分けることを検討してください", _excerpt(p.text))
+        for p in paragraphs if p.length > LONG_PARAGRAPH or len(p.sentences) > MAX_PARAGRAPH_SENTENCES
+    ]
+    metrics["paragraph_mean"] = round(statistics.fmean(p.length for p in paragraphs), 1) if paragraphs else 0
+    metrics["long_paragraphs"] = len(long_paragraphs)
+    penalty += min(1.5, 0.5 * len(long_paragraphs))
+    findings += _limited(long_paragraphs, "readability", "長い段落")
+
+    kanji = len(KANJI_RE.findall(body))
+    kana = len(HIRAGANA_RE.findall(body)) + len(KATAKANA_RE.findall(body))
+    if kanji + kana:
+        ratio = kanji / (kanji + kana)
+        metrics["kanji_ratio"] = round(ratio, 3)
+        low, high = KANJI_RATIO_RANGE
+        if ratio > high:
+            penalty += 1.0
+            findings.append(AnalysisFinding(
+                "readability", f"漢字の割合が{ratio:.0%}と高めです（{low:.0%}〜{high:.0%}が目安）。ひらがなにできる語がないか確認してください"))
+        elif ratio < low:
+            penalty += 1.0
+            findings.append(AnalysisFinding(
+                "readability", f"漢字の割合が{ratio:.0%}と低めです（{low:.0%}〜{high:.0%}が目安）。ひらがなが続いて読みにくい箇所がないか確認してください"))
+
+    if not lengths:
+        penalty = 5.0
+        findings.append(AnalysisFinding("readability", "本文の段落が見つかりませんでした"))
+    return max(0, round(5 - penalty)), findings
+
+
+def _seo(title: str, headings: list, metrics: dict):
+    findings = []
+    penalty = 0.0
+    title = (title or "").strip()
+    metrics["title_length"] = text_length(title)
+    low, high = TITLE_LENGTH_RANGE
+    if not title:
+        penalty += 2.0
+        findings.append(AnalysisFinding("seo_basics", "タイトルがありません"))
+    elif not low <= metrics["title_length"] <= high:
+        penalty += 1.0
+        findings.append(AnalysisFinding(
+            "seo_basics", f"タイトルが{metrics['title_length']}文字です（{low}〜{high}文字が目安）", title))
+
+    sections = [h for h in headings if h.level == 2]
+    metrics["headings"] = len(headings)
+    metrics["sections"] = len(sections)
+    if not sections:
+        penalty += 2.0
+        findings.append(AnalysisFinding("seo_basics", "見出し（##）がありません。結果・分析・まとめなどの見出しで構成してください"))
+    elif len(sections) < MIN_SECTIONS:
+        penalty += 1.0
+        findings.append(AnalysisFinding("seo_basics", f"見出し（##）が{len(sections)}つだけです（{MIN_SECTIONS}つ以上が目安）"))
+
+    if any(h.level == 1 for h in headings):
+        penalty += 1.0
+        findings.append(AnalysisFinding("seo_basics", "本文に大見出し（#）があります。タイトルと重複するため ## 以下を使ってください"))
+
+    skipped = []
+    previous = 1
+    for heading in headings:
+        if heading.level > previous + 1:
+            skipped.append(AnalysisFinding(
+                "seo_basics", f"見出しの階層が飛んでいます（{'#' * previous} の次に {'#' * heading.level}）", heading.text))
+        previous = heading.level
+    penalty += min(1.0, 0.5 * len(skipped))
+    findings += _limited(skipped, "seo_basics", "階層の飛び")
+
+    long_headings = [
+        AnalysisFinding("seo_basics", f"見出しが{text_length(h.text)}文字と長めです（{MAX_HEADING_LENGTH}文字以内が目安）", h.text)
+        for h in headings if text_length(h.text) > MAX_HEADING_LENGTH
+    ]
+    penalty += min(1.0, 0.5 * len(long_headings))
+    findings += _limited(long_headings, "seo_basics", "長い見出し")
+
+    seen = set()
+    for heading in headings:
+        if heading.text in seen:
+            penalty += 0.5
+            findings.append(AnalysisFinding("seo_basics", "同じ見出しが複数あります", heading.text))
+            break
+        seen.add(heading.text)
+    return max(0, round(5 - penalty)), findings
+
+
+def analyze_article(title: str, article: str) -> ArticleAnalysis:
+    """記事の構造を解析し、わかりやすさ・SEO基礎のスコアと指摘を返す"""
+    headings, paragraphs = parse_markdown(article or "")
+    analysis = ArticleAnalysis()
+    analysis.readability, readability_findings = _readability(paragraphs, analysis.metrics)
+    analysis.seo_basics, seo_findings = _seo(title, headings, analysis.metrics)
+    analysis.findings = readability_findings + seo_findings
+    return analysis
@@ -0,0 +1,255 @@
+"""
+記事のバージョン管理
+永続ロープ（変更不可の平衡木）で記事を保持し、版どうしで未変更部分を共有する
+"""
+import time
+from dataclasses import dataclass, field
+
+
+LEAF_SIZE = 256
+
+
+class _Leaf:
+    __slots__ = ("text", "length", "height")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.length = len(text)
+        self.height = 0
+
+
+class _Node:
+    __slots__ = ("left", "right", "length", "height")
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.length = left.length + right.length
+        self.height = max(left.height, right.height) + 1
+
+
+def _height(node) -> int:
+    return -1 if node is None else node.height
+
+
+def _make(left, right):
+    # 小さな葉どうしはまとめて断片化を防ぐ
+    if isinstance(left, _Leaf) and isinstance(right, _Leaf) and left.length + right.length <= LEAF_SIZE:
+        return _Leaf(left.text + right.text)
+    return _Node(left, right)
+
+
+def _balance(left, right):
+    """高さの差が2の2つの木を回転してつなぐ"""
+    if _height(left) > _height(right) + 1:
+        if _height(left.left) >= _height(left.right):
+            return _make(left.left, _make(left.right, right))
+        return _make(_make(left.left, left.right.left), _make(left.right.right, right))
+    if _height(right) > _height(left) + 1:
+        if _height(right.right) >= _height(right.left):
+            return _make(_make(left, right.left), right.right)
+        return _make(_make(left, right.left.left), _make(right.left.right, right.right))
+    return _make(left, right)
+
+
+def join(left, right):
+    """2つのロープを連結する（AVL結合、O(log n)）"""
+    if left is None or left.length == 0:
+        return right
+    if right is None or right.length == 0:
+        return left
+    if abs(left.height - right.height) <= 1:
+        return _make(left, right)
+    if left.height > right.height:
+        return _balance(left.left, join(left.right, right))
+    return _balance(join(left, right.left), right.right)
+
+
+def split(node, index: int):
+    """位置indexで2つのロープに分割する（元のロープは変更しない）"""
+    if node is None:
+        return None, None
+    if index <= 0:
+        return None, node
+    if index >= node.length:
+        return node, None
+    if isinstance(node, _Leaf):
+        return _Leaf(node.text[:index]), _Leaf(node.text[index:])
+    if index < node.left.length:
+        left, right = split(node.left, index)
+        return left, join(right, node.right)
+    left, right = split(node.right, index - node.left.length)
+    return join(node.left, left), right
+
+
+def from_text(text: str):
+    """テキストから平衡したロープを作る"""
+    leaves = [_Leaf(text[i:i + LEAF_SIZE]) for i in range(0, len(text), LEAF_SIZE)]
+    if not leaves:
+        return None
+    while len(leaves) > 1:
+        paired = [_Node(leaves[i], leaves[i + 1]) for i in range(0, len(leaves) - 1, 2)]
+        if len(leaves) % 2:
+            paired.append(leaves[-1])
+        leaves = paired
+    return leaves[0]
+
+
+def replace(node, start: int, end: int, text: str):
+    """[start, end) を text に置き換えた新しいロープ（未変更部分は共有）"""
+    left, rest = split(node, start)
+    _, right = split(rest, end - start)
+    return join(join(left, from_text(text)), right)
+
+
+def to_text(node) -> str:
+    if node is None:
+        return ""
+    parts = []
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, _Leaf):
+            parts.append(current.text)
+        else:
+            stack.append(current.right)
+            stack.append(current.left)
+    return "".join(parts)
+
+
+def _common_prefix_length(a: str, b: str) -> int:
+    """共通する先頭部分の長さ（二分探索でスライス比較）"""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+@dataclass
+class ArticleVersion:
+    """記事の1つの版"""
+    id: int
+    parent: int
+    label: str
+    rope: object
+    created: float = field(default_factory=time.time)
+    children: list = field(default_factory=list)
+
+    @property
+    def length(self) -> int:
+        return self.rope.length if self.rope else 0
+
+
+class ArticleStore:
+    """記事の版を木構造で管理する
+
+    commit で現在の版の子として新しい版を作る。過去の版に移動してから commit すると
+    別案（ブランチ）になる。undo / redo は親子の移動だけなので記事の長さによらず一定時間。
+    """
+
+    def __init__(self, text: str = "", label: str = "初版"):
+        self.versions = [ArticleVersion(0, None, label, from_text(text))]
+        self.current_id = 0
+        self._redo_target = {}
+        self._text_cache = (0, text)
+
+    @property
+    def current(self) -> ArticleVersion:
+        return self.versions[self.current_id]
+
+    @property
+    def text(self) -> str:
+        """現在の版の本文"""
+        if self._text_cache[0] != self.current_id:
+            self._text_cache = (self.current_id, to_text(self.current.rope))
+        return self._text_cache[1]
+
+    def text_of(self, version_id: int) -> str:
+        """指定した版の本文"""
+        if version_id == self.current_id:
+            return self.text
+        return to_text(self.versions[version_id].rope)
+
+    def commit(self, text: str, label: str = "") -> int:
+        """現在の版から変更した新しい版を作り、その版へ移動する"""
+        old = self.text
+        if text == old:
+            return self.current_id
+
+        # 変更範囲だけを差し替え、前後は共有する
+        prefix = _common_prefix_length(old, text)
+        suffix = _common_prefix_length(old[prefix:][::-1], text[prefix:][::-1])
+        rope = replace(self.current.rope, prefix, len(old) - suffix, text[prefix:len(text) - suffix])
+
+        version = ArticleVersion(len(self.versions), self.current_id, label or f"版{len(self.versions)}", rope)
+        self.versions.append(version)
+        self.current.children.append(version.id)
+        self._redo_target[self.current_id] = version.id
+        self.current_id = version.id
+        self._text_cache = (version.id, text)
+        return version.id
+
+    def can_undo(self) -> bool:
+        return self.current.parent is not None
+
+    def can_redo(self) -> bool:
+        return bool(self.current.children)
+
+    def undo(self) -> str:
+        """親の版へ戻る"""
+        if self.can_undo():
+            self._redo_target[self.current.parent] = self.current_id
+            self.current_id = self.current.parent
+        return self.text
+
+    def redo(self) -> str:
+        """直前に戻った版（なければ最新の子）へ進む"""
+        if self.can_redo():
+            self.current_id = self._redo_target.get(self.current_id, self.current.children[-1])
+        return self.text
+
+    def jump(self, version_id: int) -> str:
+        """指定した版へ移動する（その後の commit は別案になる）"""
+        if 0 <= version_id < len(self.versions):
+            self.current_id = version_id
+        return self.text
+
+    def lineage(self, version_id: int = None) -> list:
+        """初版から指定した版までの版IDの列"""
+        ids = []
+        current = self.current_id if version_id is None else version_id
+        while current is not None:
+            ids.append(current)
+            current = self.versions[current].parent
+        return ids[::-1]
+
+    def memory_usage(self) -> dict:
+        """全版で共有している葉の実サイズと、全文コピーした場合のサイズ"""
+        seen = set()
+        shared_chars = 0
+        nodes = 0
+        stack = [v.rope for v in self.versions if v.rope is not None]
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            nodes += 1
+            if isinstance(node, _Leaf):
+                shared_chars += node.length
+            else:
+                stack.append(node.left)
+                stack.append(node.right)
+        copy_chars = sum(v.length for v in self.versions)
+        return {
+            "versions": len(self.versions),
+            "nodes": nodes,
+            "stored_chars": shared_chars,
+            "full_copy_chars": copy_chars,
+            # Pythonの文字列は日本語で1文字あたり約2〜4バイト、ノードは約70バイト
+            "approx_bytes": shared_chars * 2 + nodes * 72,
+        }
@@ -0,0 +1,173 @@
+"""
+バッチ記事生成ランナー
+ディレクトリ内のアンケートデータをまとめて記事生成・評価し、JSONで出力する
+
+使い方:
+    python batch_runner.py enquete/ --output batch_output/ --concurrency 4
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from llm_gateway import DEFAULT_MODEL, acomplete_text, has_api_key
+from prompts import build_writer_messages, build_evaluator_messages
+from integrity import check_integrity
+from article_analyzer import analyze_article
+from evaluation import merge_local_scores
+from telemetry import percentile, set_page
+from survey_reduce import needs_map_reduce, areduce_survey
+from survey_compact import compact_survey
+
+
+def latency_summary(values) -> dict:
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 0.50), 3),
+        "p95": round(percentile(values, 0.95), 3),
+        "max": round(max(values), 3) if values else 0.0,
+    }
+
+
+async def process_survey(path: Path, args, semaphore: asyncio.Semaphore) -> dict:
+    """1件のアンケートを記事生成→評価する"""
+    survey_data = path.read_text(encoding="utf-8")
+    record = {"survey_file": str(path), "timings": {}}
+
+    async with semaphore:
+        try:
+            # 似た自由回答をまとめ、それでも大きなアンケートは設問ごとに並列で要約してから記事を生成する
+            compact = compact_survey(survey_data)
+            writer_input = compact.text
+            if compact.changed:
+                record["compact_tokens"] = {"original": compact.original_tokens, "compact": compact.compact_tokens}
+            if needs_map_reduce(writer_input):
+                reduced = await areduce_survey(writer_input, model=args.model, bypass_cache=args.bypass_cache)
+                writer_input = reduced.text
+                record["timings"]["map"] = reduced.map_time
+                record["reduced_tokens"] = {"original": reduced.original_tokens, "reduced": reduced.reduced_tokens}
+
+            started = time.perf_counter()
+            result = await acomplete_text(
+                build_writer_messages(writer_input),
+                model=args.model,
+                temperature=0.7,
+                response_format={"type": "json_object"},
+                bypass_cache=args.bypass_cache,
+            )
+            record["timings"]["generation"] = time.perf_counter() - started
+            article = json.loads(result)
+            record["article"] = article
+
+            if not args.no_evaluate:
+                started = time.perf_counter()
+                titles = article.get("title_candidates") or [""]
+                body = article.get("article_body", "")
+                integrity_report = check_integrity(survey_data, body)
+                analysis = analyze_article(titles[0], body)
+                local_scores = {**analysis.scores, "data_integrity": integrity_report.score}
+                result = await acomplete_text(
+                    build_evaluator_messages(survey_data, titles[0], body, local_axes=tuple(local_scores)),
+                    model=args.model,
+                    temperature=0.3,
+                    response_format={"type": "json_object"},
+                    bypass_cache=args.bypass_cache,
+                )
+                record["timings"]["evaluation"] = time.perf_counter() - started
+                evaluation = merge_local_scores(json.loads(result), local_scores)
+                evaluation["integrity"] = integrity_report.to_dict()
+                evaluation["analysis"] = analysis.to_dict()
+                record["evaluation"] = evaluation
+
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+
+    output_path = args.output / f"{path.stem}.json"
+    output_path.write_text(json.dumps(record, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    status = "❌" if "error" in record else "✅"
+    print(f"{status} {path.name}", file=sys.stderr)
+    return record
+
+
+async def run_batch(args) -> dict:
+    """ディレクトリ内の全アンケートを並行処理し、サマリーを返す"""
+    paths = sorted(args.input.glob(args.pattern))
+    args.output.mkdir(parents=True, exist_ok=True)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    started = time.perf_counter()
+    records = await asyncio.gather(*(process_survey(p, args, semaphore) for p in paths))
+    elapsed = time.perf_counter() - started
+
+    succeeded = [r for r in records if "error" not in r]
+    summary = {
+        "total": len(records),
+        "succeeded": len(succeeded),
+        "failed": len(records) - len(succeeded),
+        "concurrency": args.concurrency,
+        "wall_time_sec": round(elapsed, 3),
+        "throughput_per_min": round(len(records) / elapsed * 60, 2) if elapsed > 0 else 0.0,
+        "latency_sec": {
+            stage: latency_summary([r["timings"][stage] for r in records if stage in r["timings"]])
+            for stage in ("map", "generation", "evaluation")
+        },
+        "errors": {r["survey_file"]: r["error"] for r in records if "error" in r},
+    }
+    if succeeded and not args.no_evaluate:
+        totals = [r["evaluation"].get("total_score") for r in succeeded]
+        totals = [t for t in totals if isinstance(t, (int, float))]
+        if totals:
+            summary["average_total_score"] = round(statistics.mean(totals), 2)
+
+    (args.output / "summary.json").write_text(
+        json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8"
+    )
+    return summary
+
+
+def positive_int(value: str) -> int:
+    """1以上の整数（argparse の type に使う）"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"1以上の整数を指定してください: {value}")
+    return number
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="アンケートデータから記事をまとめて生成・評価します")
+    parser.add_argument("input", type=Path, help="アンケートデータのディレクトリ")
+    parser.add_argument("-o", "--output", type=Path, default=Path("batch_output"), help="出力先ディレクトリ")
+    parser.add_argument("-c", "--concurrency", type=positive_int, default=4, help="同時実行数")
+    parser.add_argument("--pattern", default="*.md", help="対象ファイルのパターン")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="使用するモデル")
+    parser.add_argument("--no-evaluate", action="store_true", help="評価を行わず記事生成のみ")
+    parser.add_argument("--bypass-cache", action="store_true", help="キャッシュを使わずに呼び出す")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    load_dotenv()
+    args = parse_args(argv)
+
+    if not has_api_key():
+        print("⚠️ OPENAI_API_KEYが設定されていません。.envファイルを確認してください。", file=sys.stderr)
+        return 1
+    if not args.input.is_dir():
+        print(f"⚠️ ディレクトリが見つかりません: {args.input}", file=sys.stderr)
+        return 1
+
+    # 計測ログ（logs/llm_calls.jsonl）にバッチの呼び出しとして記録する
+    set_page("batch")
+    summary = asyncio.run(run_batch(args))
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 0 if summary["failed"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,4 @@
+"""
+オフラインのベンチマーク
+OpenAI互換のモックサーバーに向けてアプリを動かし、APIの料金やネットワークの揺らぎなしに性能を測る
+"""
@@ -0,0 +1,447 @@
+"""
+ベンチマーク用のOpenAI互換モックサーバー
+chat.completions（ストリーミング・JSONモード・stream_options.include_usage）に応答する。
+最初のトークンまでの時間とトークン速度はプロファイルで指定し、応答はプロンプトの種類
+（記事生成・自由回答の要約・一括評価・軸ごとの評価・編集操作・チャット）に合わせた定型文を返す。
+
+使い方:
+    python -m bench.mock_server --profile realistic --port 8089
+    OPENAI_API_KEY=mock OPENAI_BASE_URL=http://127.0.0.1:8089/v1 streamlit run app.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+@dataclass
+class Profile:
+    """応答速度のプロファイル"""
+    ttft: float
+    tokens_per_sec: float
+    jitter: float = 0.2
+    error_rate: float = 0.0
+
+
+# ttft: 最初のトークンまでの秒数、tokens_per_sec: 出力速度（0で待たない）、
+# jitter: 待ち時間の揺らぎ（比率）、error_rate: 429/500を返す割合
+PROFILES = {
+    "instant": Profile(ttft=0.0, tokens_per_sec=0, jitter=0.0),
+    "fast": Profile(ttft=0.15, tokens_per_sec=400),
+    "realistic": Profile(ttft=0.6, tokens_per_sec=80),
+    "slow": Profile(ttft=1.5, tokens_per_sec=30),
+    "flaky": Profile(ttft=0.6, tokens_per_sec=80, error_rate=0.1),
+}
+
+# ストリーミングで1チャンクに含める文字数（日本語は概ね1文字1トークン）
+CHUNK_CHARS = 4
+# これ以上の長さの前置き（システムプロンプト）を2回目以降はキャッシュ済みとして数える
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+SENTENCE_RE = re.compile(r"[^。！？\n]+[。！？]")
+
+
+def estimate_tokens(messages) -> int:
+    return sum(len(m.get("content") or "") + 4 for m in messages)
+
+
+def classify(messages) -> str:
+    """システムプロンプトから応答の種類を判定する"""
+    system = next((m.get("content") or "" for m in messages if m.get("role") == "system"), "")
+    if "「AIライター」" in system:
+        return "writer"
+    if "「アンケート集計アシスタント」" in system:
+        return "survey_map"
+    if "今回の評価軸" in system:
+        return "axis_evaluator"
+    if "AI編集者（評価専門）" in system:
+        return "evaluator"
+    if "【編集操作】" in system:
+        return "edit_ops"
+    if system:
+        return "chat"
+    return "other"
+
+
+def _sentences(text: str) -> list:
+    return [s.strip() for s in SENTENCE_RE.findall(text) if not s.strip().startswith("#")]
+
+
+def _section(text: str, header: str) -> str:
+    """header 以降の本文（参考情報やユーザーメッセージの一部）"""
+    index = text.find(header)
+    return text[index + len(header):] if index >= 0 else ""
+
+
+def writer_response(survey_data: str) -> dict:
+    """WRITER_PROMPT の出力形式に合わせた記事"""
+    heading = re.search(r"^#\s*(.+)$", survey_data, re.M)
+    topic = heading.group(1).split("：")[-1].strip() if heading else "10代の意識調査"
+    questions = re.findall(r"^###\s*Q\d+[:：]\s*(.+)\n+A\d+[:：]\s*(.+)$", survey_data, re.M)
+    quotes = re.findall(r"^・(「.+?」)", survey_data, re.M)
+
+    sections = []
+    for question, answer in questions[:6]:
+        sections.append(
+            f"## {question.strip()}\n\n"
+            f"この質問に対する回答は「{answer.strip()}」という結果になりました。"
+            "回答の傾向からは、毎日の過ごし方や使えるお金の違いが選び方に表れているようです。"
+        )
+    if quotes:
+        sections.append("## 自由回答\n\n" + "\n".join(f"- {q}" for q in quotes[:3]))
+    # 入力ごとに本文を変え、別のアンケートの評価が同じリクエストにならないようにする
+    survey_id = hashlib.sha256(survey_data.encode("utf-8")).hexdigest()[:6]
+    sections.append(
+        "## まとめ\n\n"
+        f"今回の調査では、{topic}について10代のさまざまな考え方が見えてきました。"
+        "あなたはどのように感じましたか。\n\n"
+        f"（調査番号: {survey_id}）"
+    )
+    return {
+        "title_candidates": [
+            f"【調査】{topic}の実態",
+            f"10代に聞いた{topic}",
+            f"{topic}、高校生のリアルな声",
+        ],
+        "lead": f"10代を対象に、{topic}についてのアンケートを行いました。",
+        "article_body": "\n\n".join(sections),
+        "structure": ["導入", "結果（数値＋グラフ）", "分析（背景や理由）", "自由回答（2〜3件）", "まとめ（今後の示唆）"],
+        "summary": f"{topic}について、10代の回答から見えた傾向をまとめました。",
+    }
+
+
+def survey_map_response(chunk: str) -> dict:
+    """SURVEY_MAP_PROMPT の出力形式に合わせた設問ごとの要約（先頭の回答を代表として引用）"""
+    summaries = {}
+    for block in re.split(r"\n(?=#+\s*Q\d+)", chunk):
+        match = re.match(r"#+\s*Q(\d+)", block.strip())
+        if match is None:
+            continue
+        quotes = re.findall(r"^・(「.+?」)", block, re.M)
+        lines = [f"・{quote}（同様の回答 約{len(quotes) // 3 + 1}件）" for quote in quotes[:3]]
+        summaries[f"Q{match.group(1)}"] = "\n".join(["似た理由を挙げる回答が多く見られました。", *lines])
+    return {"summaries": summaries}
+
+
+def _proposal(article: str) -> list:
+    """記事中の文をそのまま引用した改善提案"""
+    sentences = _sentences(article)
+    if not sentences:
+        return []
+    before = sentences[min(1, len(sentences) - 1)]
+    if before.endswith("ようです。"):
+        after = before[:-len("ようです。")] + "と言えそうです。"
+    elif before.endswith("です。"):
+        after = before[:-len("です。")] + "ようです。"
+    else:
+        after = before[:-1] + "ようです。"
+    return [{"category": "文体", "before": before, "after": after, "reason": "断定を避けた表現にするため"}]
+
+
+def evaluator_response(system: str, user: str, axis_mode: bool) -> dict:
+    """EVALUATOR_PROMPT / AXIS_EVALUATOR_PROMPT の出力形式に合わせた評価"""
+    if axis_mode:
+        axes = re.findall(r'"(\w+)": 4', system)
+    else:
+        axes = ["naturalness_teen", "readability", "structure", "bias_assertion",
+                "ethics_safety", "seo_basics", "brand_fit", "data_integrity"]
+    scores = {axis: 4 for axis in axes}
+    article = _section(user, "タイトル: ")
+    strengths = ["アンケートの数値を正確に引用できています"]
+    weaknesses = ["一部の文に断定的な表現があります"]
+    if axis_mode:
+        return {"scores": scores, "strengths": strengths, "weaknesses": weaknesses, "proposals": _proposal(article)}
+    return {
+        "scores": scores,
+        "total_score": sum(scores.values()),
+        "summary": {"strengths": strengths, "weaknesses": weaknesses},
+        "proposals": _proposal(article),
+    }
+
+
+def edit_ops_response(messages) -> dict:
+    """EDIT_OPS_PROMPT の出力形式に合わせた編集操作"""
+    header = "現在の記事（最新版）:"
+    reference = next((m["content"] for m in messages if header in (m.get("content") or "")), "")
+    sentences = _sentences(_section(reference, header))
+    if not sentences:
+        return {"message": "修正する箇所を具体的に教えてください。", "operations": []}
+    target = sentences[0]
+    return {
+        "message": "導入の一文を、10代の読者に伝わりやすい表現に整えました。",
+        "operations": [{"op": "replace", "find": target, "replace": target[:-1] + "（調査より）。"}],
+    }
+
+
+def chat_response(user: str) -> str:
+    return (
+        f"ご指示「{user[:30]}」について確認しました。\n\n"
+        "全体としてデータの引用が正確で、読みやすい構成になっています。"
+        "気になる点として、導入の一文が少し長いため、2文に分けると読みやすくなりそうです。"
+        "また、まとめで読者への問いかけを加えると、記事の印象が強くなります。"
+        "どちらの方向で修正するのがよいでしょうか？"
+    )
+
+
+def build_response(messages) -> tuple:
+    """(種類, 応答本文) を返す"""
+    kind = classify(messages)
+    system = next((m.get("content") or "" for m in messages if m.get("role") == "system"), "")
+    user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+    if kind == "writer":
+        content = json.dumps(writer_response(user), ensure_ascii=False)
+    elif kind == "survey_map":
+        content = json.dumps(survey_map_response(user), ensure_ascii=False)
+    elif kind in ("evaluator", "axis_evaluator"):
+        content = json.dumps(evaluator_response(system, user, kind == "axis_evaluator"), ensure_ascii=False)
+    elif kind == "edit_ops":
+        content = json.dumps(edit_ops_response(messages), ensure_ascii=False)
+    elif kind == "chat":
+        content = chat_response(user)
+    else:
+        content = "了解しました。"
+    return kind, content
+
+
+class MockState:
+    """モックサーバーの設定と統計（ハンドラのスレッド間で共有）"""
+
+    def __init__(self, profile: Profile, seed: int = 0):
+        self.profile = profile
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._seen_prefixes = set()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.by_kind = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def delay(self, seconds: float) -> float:
+        """揺らぎを加えた待ち時間"""
+        if seconds <= 0:
+            return 0.0
+        with self._lock:
+            factor = 1 + self._random.uniform(-self.profile.jitter, self.profile.jitter)
+        return seconds * factor
+
+    def failure_status(self) -> int:
+        """エラーを返す場合はそのステータスコード（429/500）、返さない場合は0"""
+        if self.profile.error_rate <= 0:
+            return 0
+        with self._lock:
+            if self._random.random() >= self.profile.error_rate:
+                return 0
+            return self._random.choice((429, 500))
+
+    def begin(self, kind: str):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.by_kind[kind] = self.by_kind.get(kind, 0) + 1
+
+    def end(self, prompt_tokens: int, completion_tokens: int, error: bool = False):
+        with self._lock:
+            self.in_flight -= 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            if error:
+                self.errors += 1
+
+    def cached_tokens(self, messages, prompt_tokens: int) -> int:
+        """先頭のシステムプロンプトが2回目以降ならキャッシュ済みとして数える（128トークン単位）"""
+        if prompt_tokens < PROMPT_CACHE_MIN_TOKENS or not messages:
+            return 0
+        prefix = messages[0].get("content") or ""
+        with self._lock:
+            seen = prefix in self._seen_prefixes
+            self._seen_prefixes.add(prefix)
+        return len(prefix) // 128 * 128 if seen else 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "by_kind": dict(self.by_kind),
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+            }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: MockState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.state.stats())
+        else:
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        messages = request.get("messages", [])
+        kind, content = build_response(messages)
+        prompt_tokens = estimate_tokens(messages)
+
+        state = self.state
+        state.begin(kind)
+        completion_tokens = 0
+        failed = False
+        try:
+            status = state.failure_status()
+            if status:
+                failed = True
+                time.sleep(state.delay(state.profile.ttft / 2))
+                self._send_json(
+                    status,
+                    {"error": {"message": "mock error", "type": "rate_limit_error" if status == 429 else "server_error"}},
+                    headers={"Retry-After": "0.2"} if status == 429 else None,
+                )
+                return
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(content),
+                "total_tokens": prompt_tokens + len(content),
+                "prompt_tokens_details": {"cached_tokens": state.cached_tokens(messages, prompt_tokens)},
+            }
+            if request.get("stream"):
+                completion_tokens = self._stream(request, content, usage)
+            else:
+                profile = state.profile
+                seconds = profile.ttft + (len(content) / profile.tokens_per_sec if profile.tokens_per_sec else 0)
+                time.sleep(state.delay(seconds))
+                self._send_json(200, {
+                    "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "mock"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": usage,
+                })
+                completion_tokens = len(content)
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントが途中で接続を閉じた（生成の中止）
+            self.close_connection = True
+        finally:
+            state.end(prompt_tokens, completion_tokens, failed)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, request: dict, content: str, usage: dict) -> int:
+        """SSEで差分を送る。送った出力トークン数を返す"""
+        state = self.state
+        include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+        base = {
+            "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+        }
+
+        def event(choices, **extra):
+            body = {**base, "choices": choices, **extra}
+            if include_usage and "usage" not in extra:
+                body["usage"] = None
+            return f"data: {json.dumps(body, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        time.sleep(state.delay(state.profile.ttft))
+        self._write_chunk(event([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]))
+        sent = 0
+        per_chunk = CHUNK_CHARS / state.profile.tokens_per_sec if state.profile.tokens_per_sec else 0
+        for start in range(0, len(content), CHUNK_CHARS):
+            piece = content[start:start + CHUNK_CHARS]
+            if per_chunk:
+                time.sleep(state.delay(per_chunk))
+            self._write_chunk(event([{"index": 0, "delta": {"content": piece}, "finish_reason": None}]))
+            sent += len(piece)
+        self._write_chunk(event([{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if include_usage:
+            self._write_chunk(event([], usage=usage))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+        return sent
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 接続プールの接続がクライアント側で閉じられただけの場合は出力しない
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+def start_mock_server(profile="realistic", host: str = "127.0.0.1", port: int = 0, seed: int = 0):
+    """モックサーバーをバックグラウンドで起動し (server, base_url) を返す（port=0 で空きポート）"""
+    if isinstance(profile, str):
+        profile = PROFILES[profile]
+    state = MockState(profile, seed=seed)
+    handler = type("BoundMockHandler", (MockHandler,), {"state": state})
+    server = MockHTTPServer((host, port), handler)
+    server.state = state
+    threading.Thread(target=server.serve_forever, name="yae-mock-openai", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI互換のモックサーバー")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic", help="応答速度のプロファイル")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--seed", type=int, default=0, help="揺らぎとエラーの乱数シード")
+    args = parser.parse_args(argv)
+
+    server, base_url = start_mock_server(args.profile, args.host, args.port, args.seed)
+    print(f"モックサーバーを起動しました: OPENAI_BASE_URL={base_url}（プロファイル: {args.profile}）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
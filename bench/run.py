@@ -0,0 +1,285 @@
+"""
+エンドツーエンドのベンチマーク
+モックサーバーに向けて、記事生成→記事評価→記事改善の3ページを Streamlit の AppTest で操作する。
+N人の編集者を同時に動かし、ステップごとのレイテンシ・再実行回数と全体のスループットを報告する。
+
+使い方:
+    python -m bench.run --editors 8 --profile realistic
+    python -m bench.run --editors 4 --profile flaky --output bench_output/result.json
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from bench.mock_server import PROFILES, start_mock_server
+
+
+ROOT = Path(__file__).resolve().parent.parent
+PAGE_GENERATE = ROOT / "pages" / "1_📝_記事生成.py"
+PAGE_EVALUATE = ROOT / "pages" / "2_⭐_記事評価.py"
+PAGE_IMPROVE = ROOT / "pages" / "3_✏️_記事改善.py"
+STEPS = ("generate", "evaluate", "improve")
+# AppTest は実行のたびにプロセス共通の Runtime を差し替えるため、スクリプトの実行は同時に1つに限る
+# （LLM呼び出しはバックグラウンドジョブなので、スクリプトの実行中も並行して進む）
+_script_lock = threading.Lock()
+
+CHAT_PROMPTS = [
+    "導入をもう少し短くしてください",
+    "まとめに読者への問いかけを加えてください",
+    "見出しを10代に伝わりやすい表現にしてください",
+]
+
+
+class BenchmarkError(Exception):
+    """ページでエラーが表示された・期限内に終わらなかった"""
+
+
+class Editor:
+    """1人の編集者の操作（3ページを順に使う）"""
+
+    def __init__(self, index: int, survey_data: str, args):
+        from streamlit.testing.v1 import AppTest
+
+        self._app_test = AppTest
+        self.index = index
+        self.survey_data = survey_data
+        self.args = args
+        self.sid = f"bench-{index}-{uuid.uuid4().hex[:8]}"
+        self.steps = {}
+
+    def _run(self, at, fn) -> float:
+        """スクリプトを1回実行し、実行にかかった時間（ロック待ちを除く）を返す"""
+        with _script_lock:
+            started = time.perf_counter()
+            fn(at)
+            return time.perf_counter() - started
+
+    def _open(self, page: Path):
+        at = self._app_test.from_file(str(page), default_timeout=self.args.timeout)
+        # 同じセッションIDで開くと、前のページの結果がセッションストアから復元される
+        at.query_params["sid"] = self.sid
+        return at
+
+    def _drive(self, step: str, at, action, pending, error_key: str):
+        """action で処理を始め、pending が偽になるまでフラグメントと同じ間隔で再実行する"""
+        from job_runner import JOB_POLL_INTERVAL
+
+        started = time.perf_counter()
+        script_time = 0.0
+        reruns = 0
+
+        def run(fn):
+            nonlocal script_time, reruns
+            script_time += self._run(at, fn)
+            reruns += 1
+            if at.exception:
+                raise BenchmarkError(f"{step}: {at.exception[0].message}")
+
+        run(action)
+        while pending(at):
+            if time.perf_counter() - started > self.args.timeout:
+                raise BenchmarkError(f"{step}: {self.args.timeout}秒以内に終わりませんでした")
+            time.sleep(JOB_POLL_INTERVAL)
+            run(lambda at: at.run())
+        if at.session_state[error_key]:
+            raise BenchmarkError(f"{step}: {at.session_state[error_key]}")
+        self.steps.setdefault(step, []).append({
+            "latency": time.perf_counter() - started,
+            "reruns": reruns,
+            "script_time": script_time,
+        })
+
+    def generate(self):
+        at = self._open(PAGE_GENERATE)
+        at.session_state["survey_data"] = self.survey_data
+        self._run(at, lambda at: at.run())
+        at.toggle[0].set_value(self.args.stream)
+
+        def action(at):
+            next(b for b in at.button if b.label == "🚀 記事を生成").click().run()
+
+        self._drive("generate", at, action, lambda at: at.session_state["generation_job"], "generation_error")
+        if not at.session_state["generated_article"]:
+            raise BenchmarkError("generate: 記事が生成されませんでした")
+
+    def evaluate(self):
+        at = self._open(PAGE_EVALUATE)
+        self._run(at, lambda at: at.run())
+        at.radio[0].set_value(self.args.eval_mode)
+
+        def action(at):
+            next(b for b in at.button if b.label == "🚀 記事を評価").click().run()
+
+        self._drive("evaluate", at, action, lambda at: at.session_state["evaluation_job"], "evaluation_error")
+        if not at.session_state["evaluation_result"]:
+            raise BenchmarkError("evaluate: 評価結果がありません")
+
+    def improve(self):
+        at = self._open(PAGE_IMPROVE)
+        self._run(at, lambda at: at.run())
+        for turn in range(self.args.chat_turns):
+            prompt = CHAT_PROMPTS[turn % len(CHAT_PROMPTS)]
+            self._drive(
+                "improve", at, lambda at: at.chat_input[0].set_value(prompt).run(),
+                lambda at: at.session_state["chat_job"], "chat_error"
+            )
+
+    def run(self) -> dict:
+        started = time.perf_counter()
+        error = ""
+        try:
+            self.generate()
+            self.evaluate()
+            self.improve()
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        return {"editor": self.index, "total": time.perf_counter() - started, "error": error, "steps": self.steps}
+
+
+def summarize(results: list, wall_time: float, mock_stats: dict) -> dict:
+    from llm_gateway import request_flights
+    from telemetry import get_telemetry, percentile, summarize_calls
+
+    completed = [r for r in results if not r["error"]]
+    steps = {}
+    for step in STEPS:
+        runs = [run for r in results for run in r["steps"].get(step, [])]
+        if not runs:
+            continue
+        latencies = [run["latency"] for run in runs]
+        steps[step] = {
+            "count": len(runs),
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "max": max(latencies),
+            "reruns": statistics.mean(run["reruns"] for run in runs),
+            "script_time": statistics.mean(run["script_time"] for run in runs),
+        }
+    totals = [r["total"] for r in completed]
+    llm = summarize_calls(get_telemetry().recent())
+    return {
+        "editors": len(results),
+        "completed": len(completed),
+        "errors": [f"編集者{r['editor']}: {r['error']}" for r in results if r["error"]],
+        "wall_time": wall_time,
+        "e2e_p50": percentile(totals, 0.50),
+        "e2e_p95": percentile(totals, 0.95),
+        "throughput_per_min": len(completed) / wall_time * 60 if wall_time else 0.0,
+        "steps": steps,
+        "llm": {key: llm[key] for key in ("calls", "upstream", "cache_hits", "coalesced", "errors", "retries", "p50", "p95")},
+        "flights": request_flights.stats(),
+        "mock": mock_stats,
+    }
+
+
+def format_report(summary: dict, args) -> str:
+    step_labels = {"generate": "記事生成", "evaluate": "記事評価", "improve": "記事改善"}
+    lines = [
+        f"編集者 {summary['editors']}人（完了 {summary['completed']}人）・プロファイル {args.profile}・"
+        f"評価モード {args.eval_mode}・ストリーミング {'あり' if args.stream else 'なし'}",
+        f"経過時間 {summary['wall_time']:.1f}秒・スループット {summary['throughput_per_min']:.1f}人/分・"
+        f"1人あたり p50 {summary['e2e_p50']:.2f}秒 / p95 {summary['e2e_p95']:.2f}秒",
+        "",
+        f"{'ステップ':<8}{'回数':>6}{'p50(秒)':>10}{'p95(秒)':>10}{'最大(秒)':>10}{'再実行':>8}{'描画(秒)':>10}",
+    ]
+    for step, stats in summary["steps"].items():
+        lines.append(
+            f"{step_labels[step]:<8}{stats['count']:>6}{stats['p50']:>10.2f}{stats['p95']:>10.2f}"
+            f"{stats['max']:>10.2f}{stats['reruns']:>8.1f}{stats['script_time']:>10.2f}"
+        )
+    llm = summary["llm"]
+    mock = summary["mock"]
+    lines += [
+        "",
+        f"LLM呼び出し {llm['calls']}回（上流 {llm['upstream']}・キャッシュ {llm['cache_hits']}・"
+        f"合流 {llm['coalesced']}・エラー {llm['errors']}・リトライ {llm['retries']}）"
+        f" p50 {llm['p50']:.2f}秒 / p95 {llm['p95']:.2f}秒",
+        f"モックサーバー: リクエスト {mock['requests']}回・最大同時 {mock['max_in_flight']}・"
+        f"入力 {mock['prompt_tokens']}トークン・出力 {mock['completion_tokens']}トークン",
+    ]
+    lines += [f"⚠️ {error}" for error in summary["errors"]]
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="モックサーバーを使ったエンドツーエンドのベンチマーク")
+    parser.add_argument("--editors", type=int, default=4, help="同時に操作する編集者の数")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic", help="モックサーバーの応答速度")
+    parser.add_argument("--eval-mode", choices=("parallel", "incremental", "single"), default="parallel")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="記事生成をストリーミングしない")
+    parser.add_argument("--chat-turns", type=int, default=1, help="記事改善ページでの指示の回数")
+    parser.add_argument("--shared-survey", action="store_true",
+                        help="全員に同じアンケートを渡す（キャッシュと同時リクエストの合流が効く状況）")
+    parser.add_argument("--timeout", type=float, default=300.0, help="1ステップの期限（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="結果をJSONで保存するパス")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    os.chdir(ROOT)
+
+    # アプリのモジュールは環境変数を読み込み時に参照するため、設定してから読み込む。
+    # キャッシュ・セッション・計測ログは毎回空の一時ディレクトリを使う
+    workdir = Path(tempfile.mkdtemp(prefix="yae-bench-"))
+    server, base_url = start_mock_server(args.profile, seed=args.seed)
+    os.environ.update({
+        "OPENAI_API_KEY": "mock",
+        "OPENAI_BASE_URL": base_url,
+        "YAE_CACHE_DIR": str(workdir / "responses"),
+        "YAE_SESSION_DB": str(workdir / "sessions.db"),
+        "YAE_TELEMETRY_DIR": str(workdir / "logs"),
+        "YAE_METRICS_PORT": "0",
+    })
+
+    # AppTest をスクリプト外のスレッドから操作すると出る警告を抑える（Streamlitのバージョンでモジュール名が異なる）
+    for name in ("streamlit.runtime.scriptrunner_utils.script_run_context",
+                 "streamlit.runtime.scriptrunner.script_run_context"):
+        logging.getLogger(name).addFilter(lambda record: "missing ScriptRunContext" not in record.getMessage())
+
+    surveys = [path.read_text(encoding="utf-8") for path in sorted((ROOT / "enquete").glob("*.md"))]
+    editors = []
+    for i in range(args.editors):
+        survey_data = surveys[i % len(surveys)]
+        if not args.shared_survey:
+            # 編集者ごとに内容を変え、キャッシュや合流が効かない状態で測る
+            survey_data += f"\n\n<!-- bench editor {i} -->\n"
+        editors.append(Editor(i, survey_data, args))
+
+    results = [None] * len(editors)
+
+    def worker(i):
+        results[i] = editors[i].run()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), name=f"yae-bench-{i}") for i in range(len(editors))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - started
+
+    summary = summarize(results, wall_time, server.state.stats())
+    server.shutdown()
+    print(format_report(summary, args))
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(
+            json.dumps({"args": {k: str(v) for k, v in vars(args).items()}, "summary": summary, "editors": results},
+                       ensure_ascii=False, indent=2),
+            encoding="utf-8",
+        )
+    return 0 if summary["completed"] == len(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,359 @@
+"""
+アンケート結果のグラフ描画
+パース済みの選択肢と割合（A1: 選択肢 67.1%、…）から設問ごとに円グラフ・棒グラフを作る。
+SVGは標準ライブラリだけで描画し、PNGは matplotlib がインストールされている場合のみ出力する。
+描画結果は内容のハッシュをキーにキャッシュし、再実行や再エクスポートで同じグラフを描き直さない
+"""
+import base64
+import hashlib
+import html
+import importlib.util
+import io
+import json
+import math
+import os
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from survey_parser import normalize
+
+
+CHART_DIR = Path(os.getenv("YAE_CHART_DIR", ".cache/charts"))
+# メモリ上に保持する描画結果の数
+MEMORY_ENTRIES = 256
+# 描画方法を変えたら上げる（古いキャッシュを使わないため）
+RENDER_VERSION = 1
+
+CHART_KINDS = {"pie": "円グラフ", "bar": "棒グラフ"}
+# 円グラフにする選択肢数の上限と、合計を100%とみなす範囲（四捨五入の誤差を許容）
+PIE_MAX_OPTIONS = 6
+PIE_TOTAL_RANGE = (99.0, 101.0)
+
+WIDTH = 640
+PALETTE = ["#4E79A7", "#F28E2B", "#E15759", "#76B7B2", "#59A14F",
+           "#EDC948", "#B07AA1", "#FF9DA7", "#9C755F", "#BAB0AC"]
+FONT_FAMILY = "'Hiragino Sans','Noto Sans JP','Yu Gothic',sans-serif"
+PNG_FONTS = ["Hiragino Sans", "Noto Sans CJK JP", "Noto Sans JP", "IPAexGothic", "Yu Gothic"]
+
+
+@dataclass(frozen=True)
+class Chart:
+    """設問1つ分のグラフ"""
+    question: int
+    kind: str
+    title: str
+    labels: tuple
+    values: tuple
+    caption: str = ""
+
+    @property
+    def key(self) -> str:
+        """描画内容のハッシュ（キャプションは画像に含めないためキーに入れない）"""
+        payload = json.dumps([RENDER_VERSION, self.kind, self.title, self.labels, self.values], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+
+    @property
+    def filename(self) -> str:
+        return f"q{self.question}_{self.kind}"
+
+
+def format_percent(value: float) -> str:
+    return f"{value:g}%"
+
+
+def choose_kind(options) -> str:
+    """合計が100%の少数の選択肢（単一回答）は円グラフ、それ以外（複数回答など）は棒グラフ"""
+    total = sum(option.percent for option in options)
+    if 2 <= len(options) <= PIE_MAX_OPTIONS and PIE_TOTAL_RANGE[0] <= total <= PIE_TOTAL_RANGE[1]:
+        return "pie"
+    return "bar"
+
+
+def build_charts(survey, kinds=None) -> list:
+    """選択肢と割合のある設問ごとにグラフを作る
+
+    kinds は {"設問番号": "pie" / "bar"} で、指定のない設問は choose_kind() で決める。
+    """
+    kinds = kinds or {}
+    charts = []
+    for question in survey.questions:
+        if not question.options:
+            continue
+        kind = kinds.get(str(question.number)) or choose_kind(question.options)
+        caption = f"図{len(charts) + 1}: Q{question.number}. {question.text}"
+        if survey.respondents:
+            caption += f"（有効回答数 {survey.respondents:,}名）"
+        charts.append(Chart(
+            question=question.number,
+            kind=kind,
+            title=f"Q{question.number}. {question.text}",
+            labels=tuple(option.label for option in question.options),
+            values=tuple(option.percent for option in question.options),
+            caption=caption,
+        ))
+    return charts
+
+
+def _truncate(text: str, length: int) -> str:
+    return text if len(text) <= length else text[:length - 1] + "…"
+
+
+def _svg(height: int, title: str, body: list) -> str:
+    return "\n".join([
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{WIDTH}" height="{height}" '
+        f'viewBox="0 0 {WIDTH} {height}" role="img" font-family="{FONT_FAMILY}">',
+        f"<title>{html.escape(title)}</title>",
+        f'<rect width="{WIDTH}" height="{height}" fill="#ffffff"/>',
+        f'<text x="16" y="30" font-size="16" font-weight="bold" fill="#333333">{html.escape(_truncate(title, 38))}</text>',
+        *body,
+        "</svg>",
+    ])
+
+
+def _render_pie(chart: Chart) -> str:
+    cx, cy, r = 170, 175, 120
+    height = max(310, 80 + 28 * len(chart.values))
+    total = sum(chart.values) or 1
+    body = []
+    angle = -math.pi / 2
+    for i, value in enumerate(chart.values):
+        color = PALETTE[i % len(PALETTE)]
+        sweep = 2 * math.pi * value / total
+        if sweep >= 2 * math.pi - 1e-9:
+            body.append(f'<circle cx="{cx}" cy="{cy}" r="{r}" fill="{color}"/>')
+        elif sweep > 0:
+            x1, y1 = cx + r * math.cos(angle), cy + r * math.sin(angle)
+            x2, y2 = cx + r * math.cos(angle + sweep), cy + r * math.sin(angle + sweep)
+            large = 1 if sweep > math.pi else 0
+            body.append(
+                f'<path d="M{cx},{cy} L{x1:.2f},{y1:.2f} A{r},{r} 0 {large} 1 {x2:.2f},{y2:.2f} Z" '
+                f'fill="{color}" stroke="#ffffff" stroke-width="1.5"/>'
+            )
+        # 小さすぎる扇形には割合を書かない（凡例に記載）
+        if value / total >= 0.06:
+            middle = angle + sweep / 2
+            tx, ty = cx + r * 0.62 * math.cos(middle), cy + r * 0.62 * math.sin(middle)
+            body.append(
+                f'<text x="{tx:.1f}" y="{ty + 5:.1f}" font-size="14" font-weight="bold" fill="#ffffff" '
+                f'text-anchor="middle">{format_percent(value)}</text>'
+            )
+        angle += sweep
+
+    for i, (label, value) in enumerate(zip(chart.labels, chart.values)):
+        y = 80 + 28 * i
+        body.append(f'<rect x="330" y="{y - 12}" width="14" height="14" fill="{PALETTE[i % len(PALETTE)]}"/>')
+        body.append(f'<text x="352" y="{y}" font-size="14" fill="#333333">{html.escape(_truncate(label, 14))}</text>')
+        body.append(f'<text x="{WIDTH - 20}" y="{y}" font-size="14" fill="#333333" text-anchor="end">{format_percent(value)}</text>')
+    return _svg(height, chart.title, body)
+
+
+def _render_bar(chart: Chart) -> str:
+    label_width, bar_left, bar_right = 190, 200, WIDTH - 80
+    row_height, bar_height, top = 34, 20, 56
+    height = top + row_height * len(chart.values) + 16
+    scale = max(10, math.ceil(max(chart.values, default=0) / 10) * 10)
+    body = []
+    for i, (label, value) in enumerate(zip(chart.labels, chart.values)):
+        y = top + row_height * i
+        width = (bar_right - bar_left) * value / scale
+        body.append(
+            f'<text x="{label_width}" y="{y + bar_height / 2 + 5:.1f}" font-size="14" fill="#333333" '
+            f'text-anchor="end">{html.escape(_truncate(label, 13))}</text>'
+        )
+        body.append(f'<rect x="{bar_left}" y="{y}" width="{width:.2f}" height="{bar_height}" fill="{PALETTE[0]}"/>')
+        body.append(
+            f'<text x="{bar_left + width + 6:.2f}" y="{y + bar_height / 2 + 5:.1f}" font-size="14" '
+            f'fill="#333333">{format_percent(value)}</text>'
+        )
+    body.append(f'<line x1="{bar_left}" y1="{top - 6}" x2="{bar_left}" y2="{height - 16}" stroke="#999999"/>')
+    return _svg(height, chart.title, body)
+
+
+def render_svg(chart: Chart) -> str:
+    """グラフをSVGで描画する（標準ライブラリのみ）"""
+    return _render_pie(chart) if chart.kind == "pie" else _render_bar(chart)
+
+
+def png_available() -> bool:
+    return importlib.util.find_spec("matplotlib") is not None
+
+
+def render_png(chart: Chart) -> bytes:
+    """グラフをPNGで描画する（matplotlib が必要）"""
+    import matplotlib
+    from matplotlib import font_manager
+    from matplotlib.figure import Figure
+
+    installed = {font.name for font in font_manager.fontManager.ttflist}
+    families = [name for name in PNG_FONTS if name in installed] + ["sans-serif"]
+    values = list(chart.values)
+    with matplotlib.rc_context({"font.family": families}):
+        figure = Figure(figsize=(6.4, max(3.2, 0.9 + 0.38 * len(values))), dpi=150)
+        ax = figure.subplots()
+        if chart.kind == "pie":
+            ax.pie(values, colors=PALETTE[:len(values)], startangle=90, counterclock=False,
+                   wedgeprops={"linewidth": 1.5, "edgecolor": "white"})
+            ax.legend([f"{label} {format_percent(value)}" for label, value in zip(chart.labels, values)],
+                      loc="center left", bbox_to_anchor=(1.0, 0.5), frameon=False)
+            ax.set_aspect("equal")
+        else:
+            positions = range(len(values))
+            bars = ax.barh(positions, values, color=PALETTE[0])
+            ax.set_yticks(list(positions), [_truncate(label, 13) for label in chart.labels])
+            ax.invert_yaxis()
+            ax.bar_label(bars, labels=[format_percent(value) for value in values], padding=3)
+            ax.set_xlim(0, max(10, math.ceil(max(values) / 10) * 10) * 1.12)
+            ax.set_xticks([])
+            for side in ("top", "right", "bottom"):
+                ax.spines[side].set_visible(False)
+        ax.set_title(_truncate(chart.title, 38), loc="left", fontweight="bold")
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format="png", bbox_inches="tight", facecolor="white")
+    return buffer.getvalue()
+
+
+RENDERERS = {
+    "svg": lambda chart: render_svg(chart).encode("utf-8"),
+    "png": render_png,
+}
+
+
+class ChartCache:
+    """描画結果のキャッシュ（メモリ＋ディスク、キーは描画内容のハッシュ）
+
+    エントリは `<dir>/<key>.<形式>` に保存し、プロセスを再起動しても描き直さない。
+    """
+
+    def __init__(self, directory=CHART_DIR, memory_entries=MEMORY_ENTRIES):
+        self.directory = Path(directory)
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.renders = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chart: Chart, fmt: str = "svg") -> bytes:
+        """描画結果を返す（キャッシュになければ描画して保存する）"""
+        name = f"{chart.key}.{fmt}"
+        with self._lock:
+            data = self._memory.get(name)
+            if data is not None:
+                self._memory.move_to_end(name)
+                self.hits += 1
+                return data
+
+        path = self.directory / name
+        try:
+            data = path.read_bytes()
+            rendered = False
+        except OSError:
+            data = RENDERERS[fmt](chart)
+            rendered = True
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                temp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+                temp.write_bytes(data)
+                os.replace(temp, path)
+            except OSError:
+                pass
+
+        with self._lock:
+            if rendered:
+                self.renders += 1
+            else:
+                self.hits += 1
+            self._memory[name] = data
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+        return data
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "renders": self.renders, "entries": len(self._memory)}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_chart_cache() -> ChartCache:
+    """プロセス共通のキャッシュを取得"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ChartCache()
+    return _cache
+
+
+def chart_svg(chart: Chart) -> str:
+    return get_chart_cache().get(chart, "svg").decode("utf-8")
+
+
+def chart_png(chart: Chart) -> bytes:
+    return get_chart_cache().get(chart, "png")
+
+
+def chart_data_uri(chart: Chart) -> str:
+    """Markdownにそのまま埋め込めるSVGのdata URI"""
+    return "data:image/svg+xml;base64," + base64.b64encode(get_chart_cache().get(chart, "svg")).decode("ascii")
+
+
+def _anchor_block(blocks: list, chart: Chart):
+    """設問の割合を最初に引用した段落（なければ設問文を含む段落）の位置"""
+    percents = {text for value in chart.values for text in (format_percent(value), f"{value:.1f}%")}
+    for i, block in enumerate(blocks):
+        if not block.startswith("#") and any(text in block for text in percents):
+            return i
+    question_text = chart.title.split(". ", 1)[-1]
+    for i, block in enumerate(blocks):
+        if question_text and question_text in block:
+            return i
+    return None
+
+
+def insert_charts(article: str, charts: list, image_ref=chart_data_uri) -> str:
+    """記事中で各設問の結果を引用した段落の後にグラフを挿入したMarkdownを返す
+
+    image_ref(chart) は画像の参照先（既定はdata URI）。挿入先が見つからないグラフは末尾に置く。
+    """
+    blocks = re.split(r"\n\s*\n", article.strip())
+    normalized = [normalize(block) for block in blocks]
+    after = {}
+    tail = []
+    for chart in charts:
+        figure = f"![{chart.caption}]({image_ref(chart)})\n\n*{chart.caption}*"
+        index = _anchor_block(normalized, chart)
+        (tail if index is None else after.setdefault(index, [])).append(figure)
+
+    parts = []
+    for i, block in enumerate(blocks):
+        parts.append(block)
+        parts.extend(after.get(i, []))
+    parts.extend(tail)
+    return "\n\n".join(parts)
+
+
+def bundle_zip(markdown: str, charts: list) -> bytes:
+    """記事（article.md）と charts/ 以下のグラフ画像をまとめたZIP
+
+    記事中の画像は charts/<ファイル名>.svg を参照する。PNGは matplotlib がある場合のみ同梱する。
+    """
+    with_png = png_available()
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("article.md", markdown)
+        for chart in charts:
+            archive.writestr(f"charts/{chart.filename}.svg", get_chart_cache().get(chart, "svg"))
+            if with_png:
+                archive.writestr(f"charts/{chart.filename}.png", chart_png(chart))
+    return buffer.getvalue()
+
+
+def chart_path(chart: Chart) -> str:
+    """bundle_zip() の記事から参照する画像のパス"""
+    return f"charts/{chart.filename}.svg"
@@ -0,0 +1,117 @@
+"""
+編集者チャットのコンテキスト管理
+トークン予算内に収まるよう、固定の前置き（プロンプト・アンケート・最新記事）と
+直近の会話を残し、古い会話は要約して送る
+"""
+from dataclasses import dataclass
+
+
+CONTEXT_TOKEN_BUDGET = 8000
+SUMMARY_TOKEN_BUDGET = 600
+MIN_RECENT_MESSAGES = 2
+
+
+def estimate_text_tokens(text: str) -> int:
+    """テキストのトークン数を概算（日本語は概ね1文字1トークン）"""
+    return len(text or "") + 4
+
+
+@dataclass
+class ContextStats:
+    """1ターン分のプロンプト構成"""
+    prompt_tokens: int
+    prefix_tokens: int
+    recent_messages: int
+    summarized_messages: int
+
+
+def _summary_line(message: dict) -> str:
+    """古い会話1件を1行に要約（先頭部分のみ残す）"""
+    role = "ライター" if message["role"] == "user" else "編集者"
+    text = " ".join(message["content"].split())
+    limit = 80 if message["role"] == "user" else 50
+    return f"- {role}: {text[:limit]}{'…' if len(text) > limit else ''}"
+
+
+class ChatContextManager:
+    """トークン予算付きでチャットのメッセージ列を組み立てる
+
+    メッセージ列は常に
+      1. システムプロンプト
+      2. 参考情報（アンケート・評価サマリー・最新の記事）
+      3. 古い会話の要約（あれば）
+      4. 直近の会話
+      5. 今回の指示
+    の順になる。1〜2はターンをまたいで変わらないため、APIのプロンプトキャッシュが効く。
+    """
+
+    def __init__(self, system_prompt: str, budget: int = CONTEXT_TOKEN_BUDGET,
+                 summary_budget: int = SUMMARY_TOKEN_BUDGET):
+        self.system_prompt = system_prompt
+        self.budget = budget
+        self.summary_budget = summary_budget
+
+    def build_prefix(self, survey_data: str, article: str, evaluation_summary) -> list:
+        """ターンをまたいで共通の前置き"""
+        reference = f"""【参考情報】
+
+アンケートデータ:
+{survey_data}
+
+評価結果:
+{evaluation_summary}
+
+現在の記事（最新版）:
+{article}
+"""
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "system", "content": reference},
+        ]
+
+    def build(self, survey_data: str, article: str, evaluation_summary, history, user_message: str):
+        """送信するメッセージ列と構成の統計を返す
+
+        history には今回の指示を含めない。
+        """
+        prefix = self.build_prefix(survey_data, article, evaluation_summary)
+        prefix_tokens = sum(estimate_text_tokens(m["content"]) for m in prefix)
+        current = {"role": "user", "content": user_message}
+        remaining = self.budget - prefix_tokens - estimate_text_tokens(user_message) - self.summary_budget
+
+        # 新しい会話から予算内に収まるだけ残す
+        recent = []
+        for message in reversed(history):
+            cost = estimate_text_tokens(message["content"])
+            if len(recent) >= MIN_RECENT_MESSAGES and cost > remaining:
+                break
+            recent.append(message)
+            remaining -= cost
+        recent.reverse()
+        older = history[:len(history) - len(recent)]
+
+        summary = []
+        if older:
+            lines = []
+            used = 0
+            for message in reversed(older):
+                line = _summary_line(message)
+                if used + estimate_text_tokens(line) > self.summary_budget:
+                    break
+                lines.append(line)
+                used += estimate_text_tokens(line)
+            lines.reverse()
+            omitted = len(older) - len(lines)
+            header = "【これまでの会話の要約】"
+            if omitted:
+                header += f"（さらに前の{omitted}件は省略）"
+            summary = [{"role": "system", "content": header + "\n" + "\n".join(lines)}]
+
+        messages = prefix + summary + [{"role": m["role"], "content": m["content"]} for m in recent] + [current]
+        stats = ContextStats(
+            prompt_tokens=sum(estimate_text_tokens(m["content"]) for m in messages),
+            prefix_tokens=prefix_tokens,
+            recent_messages=len(recent),
+            summarized_messages=len(older),
+        )
+        return messages, stats
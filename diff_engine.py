@@ -0,0 +1,223 @@
+"""
+記事の差分ハイライト
+文単位（。！？）で差分を取り、書き換えられた文だけを文字単位で比較する。
+差分はMyers法（中央スネークによる分割統治、線形メモリ）で求める。
+"""
+import html
+import math
+import re
+import time
+
+
+EQUAL = "="
+DELETE = "-"
+INSERT = "+"
+
+SENTENCE_RE = re.compile(r"[^。！？!?\n]*(?:[。！？!?]+[」』）)]*|\n|$)")
+
+# 文字単位で比較する書き換えブロックの上限（文字数）
+CHAR_DIFF_LIMIT = 400
+# 書き換え前後でこれより共通部分が少なければ、文ごと差し替えとして表示
+MIN_CHAR_SIMILARITY = 0.3
+# 1回の差分表示で文字単位の比較にかける時間の上限（秒）。超えた分は文ごと差し替えとして表示
+CHAR_DIFF_TIME_BUDGET = 0.02
+
+
+def split_sentences(text: str) -> list:
+    """文（句点・感嘆符・疑問符・改行まで）に分割する。連結すると元に戻る"""
+    return [m.group(0) for m in SENTENCE_RE.finditer(text) if m.group(0)]
+
+
+def _common_prefix(a, b) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _common_suffix(a, b) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[-i - 1] == b[-i - 1]:
+        i += 1
+    return i
+
+
+def diff_sequences(a, b, max_edits: int = None, deadline: float = None) -> list:
+    """2つの列（文字列または文のリスト）の差分を (操作, 部分列) のリストで返す
+
+    max_edits を指定すると、編集数がそれを超える区間は探索を打ち切り丸ごと差し替えとする。
+    deadline（time.perf_counter() の値）を過ぎた場合も、残りの区間は丸ごと差し替えとする。
+    """
+    if a == b:
+        return [(EQUAL, a)] if a else []
+
+    prefix = _common_prefix(a, b)
+    head = a[:prefix]
+    a, b = a[prefix:], b[prefix:]
+    suffix = _common_suffix(a, b)
+    tail = a[len(a) - suffix:]
+    a, b = a[:len(a) - suffix], b[:len(b) - suffix]
+
+    if not a:
+        body = [(INSERT, b)]
+    elif not b:
+        body = [(DELETE, a)]
+    else:
+        body = _bisect(a, b, max_edits, deadline)
+
+    result = []
+    if head:
+        result.append((EQUAL, head))
+    result.extend(body)
+    if tail:
+        result.append((EQUAL, tail))
+    return _merge(result)
+
+
+def _bisect(a, b, max_edits, deadline) -> list:
+    """中央スネークを見つけて2つの部分問題に分割する"""
+    n, m = len(a), len(b)
+    max_d = (n + m + 1) // 2
+    offset = max_d
+    size = 2 * max_d + 2
+    forward = [-1] * size
+    backward = [-1] * size
+    forward[offset + 1] = 0
+    backward[offset + 1] = 0
+    delta = n - m
+    odd = delta % 2 != 0
+    k1_start = k1_end = k2_start = k2_end = 0
+
+    depth = max_d if max_edits is None else min(max_d, max_edits // 2 + 1)
+
+    for d in range(depth):
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+        # 前方向の探索
+        for k1 in range(-d + k1_start, d + 1 - k1_end, 2):
+            i = offset + k1
+            if k1 == -d or (k1 != d and forward[i - 1] < forward[i + 1]):
+                x1 = forward[i + 1]
+            else:
+                x1 = forward[i - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[x1] == b[y1]:
+                x1 += 1
+                y1 += 1
+            forward[i] = x1
+            if x1 > n:
+                k1_end += 2
+            elif y1 > m:
+                k1_start += 2
+            elif odd:
+                j = offset + delta - k1
+                if 0 <= j < size and backward[j] != -1 and x1 >= n - backward[j]:
+                    return _split(a, b, x1, y1, max_edits, deadline)
+
+        # 後ろ方向の探索
+        for k2 in range(-d + k2_start, d + 1 - k2_end, 2):
+            j = offset + k2
+            if k2 == -d or (k2 != d and backward[j - 1] < backward[j + 1]):
+                x2 = backward[j + 1]
+            else:
+                x2 = backward[j - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[-x2 - 1] == b[-y2 - 1]:
+                x2 += 1
+                y2 += 1
+            backward[j] = x2
+            if x2 > n:
+                k2_end += 2
+            elif y2 > m:
+                k2_start += 2
+            elif not odd:
+                i = offset + delta - k2
+                if 0 <= i < size and forward[i] != -1:
+                    x1 = forward[i]
+                    y1 = offset + x1 - i
+                    if x1 >= n - x2:
+                        return _split(a, b, x1, y1, max_edits, deadline)
+
+    return [(DELETE, a), (INSERT, b)]
+
+
+def _split(a, b, x: int, y: int, max_edits, deadline) -> list:
+    return diff_sequences(a[:x], b[:y], max_edits, deadline) + diff_sequences(a[x:], b[y:], max_edits, deadline)
+
+
+def _merge(ops) -> list:
+    """隣り合う同じ操作をまとめる"""
+    merged = []
+    for op, part in ops:
+        if not part:
+            continue
+        if merged and merged[-1][0] == op:
+            merged[-1] = (op, merged[-1][1] + part)
+        else:
+            merged.append((op, part))
+    return merged
+
+
+def _similarity(ops) -> float:
+    equal = sum(len(part) for op, part in ops if op == EQUAL)
+    total = max(sum(len(part) for op, part in ops if op != INSERT),
+                sum(len(part) for op, part in ops if op != DELETE), 1)
+    return equal / total
+
+
+def _char_diff(old: str, new: str, deadline: float) -> list:
+    """書き換えられた文どうしを文字単位で比較（似ていなければ、または時間切れなら丸ごと差し替え）"""
+    if len(old) + len(new) <= CHAR_DIFF_LIMIT and time.perf_counter() < deadline:
+        # 共通部分が閾値に届かないほど編集が多ければ途中で打ち切る
+        common = math.ceil(MIN_CHAR_SIMILARITY * max(len(old), len(new)))
+        ops = diff_sequences(old, new, max_edits=len(old) + len(new) - 2 * common, deadline=deadline)
+        if _similarity(ops) >= MIN_CHAR_SIMILARITY:
+            return ops
+    return [(DELETE, old), (INSERT, new)]
+
+
+def diff_text(old: str, new: str) -> list:
+    """記事の差分を文字列単位の (操作, テキスト) のリストで返す"""
+    sentence_ops = diff_sequences(split_sentences(old), split_sentences(new))
+    deadline = time.perf_counter() + CHAR_DIFF_TIME_BUDGET
+
+    result = []
+    i = 0
+    while i < len(sentence_ops):
+        op, sentences = sentence_ops[i]
+        if op == DELETE and i + 1 < len(sentence_ops) and sentence_ops[i + 1][0] == INSERT:
+            inserted = sentence_ops[i + 1][1]
+            if len(sentences) == len(inserted):
+                # 同じ数の文が書き換えられた場合は1文ずつ比較
+                for old_sentence, new_sentence in zip(sentences, inserted):
+                    result.extend(_char_diff(old_sentence, new_sentence, deadline))
+            else:
+                result.extend(_char_diff("".join(sentences), "".join(inserted), deadline))
+            i += 2
+            continue
+        result.append((op, "".join(sentences)))
+        i += 1
+    return _merge(result)
+
+
+def diff_stats(ops) -> dict:
+    return {
+        "inserted": sum(len(part) for op, part in ops if op == INSERT),
+        "deleted": sum(len(part) for op, part in ops if op == DELETE),
+    }
+
+
+def render_diff_html(ops) -> str:
+    """差分をインラインのハイライト付きHTMLにする"""
+    parts = []
+    for op, text in ops:
+        escaped = html.escape(text)
+        if op == INSERT:
+            parts.append(f'<ins style="background:#ccffd8;text-decoration:none">{escaped}</ins>')
+        elif op == DELETE:
+            parts.append(f'<del style="background:#ffd7d5;color:#82071e">{escaped}</del>')
+        else:
+            parts.append(escaped)
+    return '<div style="white-space:pre-wrap;line-height:1.8">' + "".join(parts) + "</div>"
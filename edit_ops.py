@@ -0,0 +1,221 @@
+"""
+記事の編集操作
+LLMが返す差分形式の編集操作（置換・見出し後への挿入・段落削除）を検証し、記事に適用する。
+評価ページの改善提案（修正前→修正後）もLLMを介さずここで記事に反映する。
+"""
+import json
+import re
+import unicodedata
+from dataclasses import dataclass, field
+
+
+OPERATION_FIELDS = {
+    "replace": ("find", "replace"),
+    "insert_after_heading": ("heading", "text"),
+    "delete_paragraph": ("find",),
+}
+
+HEADING_LINE_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*$", re.MULTILINE)
+PARAGRAPH_SPLIT_RE = re.compile(r"\n\s*\n")
+
+
+class EditError(ValueError):
+    """編集操作を適用できない"""
+
+
+@dataclass
+class EditResult:
+    """編集操作の適用結果"""
+    article: str
+    message: str = ""
+    applied: list = field(default_factory=list)
+    failed: list = field(default_factory=list)
+
+
+def parse_edit_response(text: str) -> tuple:
+    """LLMの応答JSONから (メッセージ, 操作リスト) を取り出す"""
+    data = json.loads(text)
+    operations = data.get("operations", [])
+    if not isinstance(operations, list):
+        raise EditError("operations は配列である必要があります")
+    return data.get("message", ""), operations
+
+
+def validate_operation(operation) -> None:
+    """操作の形式を検証する"""
+    if not isinstance(operation, dict):
+        raise EditError("操作の形式が不正です")
+    op = operation.get("op")
+    if op not in OPERATION_FIELDS:
+        raise EditError(f"未対応の操作です: {op}")
+    for name in OPERATION_FIELDS[op]:
+        if not isinstance(operation.get(name), str):
+            raise EditError(f"{op} には {name} が必要です")
+    if op != "insert_after_heading" and not operation["find"]:
+        raise EditError(f"{op} の find が空です")
+
+
+def _find_unique(article: str, needle: str) -> int:
+    index = article.find(needle)
+    if index < 0:
+        raise EditError(f"記事中に見つかりません: 「{needle[:30]}」")
+    if article.find(needle, index + 1) >= 0:
+        raise EditError(f"記事中に複数あり特定できません: 「{needle[:30]}」")
+    return index
+
+
+def _apply_replace(article: str, operation) -> str:
+    index = _find_unique(article, operation["find"])
+    return article[:index] + operation["replace"] + article[index + len(operation["find"]):]
+
+
+def _apply_insert_after_heading(article: str, operation) -> str:
+    heading = operation["heading"].lstrip("#").strip()
+    matches = [m for m in HEADING_LINE_RE.finditer(article) if m.group(2) == heading]
+    if not matches:
+        raise EditError(f"見出しが見つかりません: 「{heading}」")
+    if len(matches) > 1:
+        raise EditError(f"同じ見出しが複数あります: 「{heading}」")
+
+    # 見出し直下のセクション末尾（次の見出しの直前）に挿入
+    next_heading = HEADING_LINE_RE.search(article, matches[0].end())
+    position = next_heading.start() if next_heading else len(article)
+    before = article[:position].rstrip("\n")
+    after = article[position:]
+    text = operation["text"].strip("\n")
+    return before + "\n\n" + text + ("\n\n" + after if after else "\n")
+
+
+def _apply_delete_paragraph(article: str, operation) -> str:
+    index = _find_unique(article, operation["find"])
+    # find を含む段落の範囲を求める
+    start = 0
+    for m in PARAGRAPH_SPLIT_RE.finditer(article, 0, index):
+        start = m.end()
+    end_match = PARAGRAPH_SPLIT_RE.search(article, index)
+    end = end_match.start() if end_match else len(article)
+    if end_match:
+        return article[:start] + article[end_match.end():]
+    return article[:start].rstrip("\n") + ("\n" if start else "") + article[end:]
+
+
+APPLIERS = {
+    "replace": _apply_replace,
+    "insert_after_heading": _apply_insert_after_heading,
+    "delete_paragraph": _apply_delete_paragraph,
+}
+
+
+def apply_operations(article: str, operations) -> EditResult:
+    """操作を順に適用する（失敗した操作は飛ばして記録する）"""
+    result = EditResult(article)
+    for operation in operations:
+        try:
+            validate_operation(operation)
+            result.article = APPLIERS[operation["op"]](result.article, operation)
+            result.applied.append(operation)
+        except EditError as e:
+            result.failed.append((operation, str(e)))
+    return result
+
+
+def describe_operation(operation) -> str:
+    """操作の内容を1行で表す（チャット表示用）"""
+    if not isinstance(operation, dict):
+        return str(operation)
+    op = operation.get("op")
+    get = lambda name: str(operation.get(name, ""))[:40]
+    if op == "replace":
+        return f"置換: 「{get('find')}」→「{get('replace')}」"
+    if op == "insert_after_heading":
+        return f"追加: 「{get('heading')}」の末尾に「{get('text')}」"
+    if op == "delete_paragraph":
+        return f"削除: 「{get('find')}」を含む段落"
+    return str(operation)
+
+
+# 改善提案の照合で無視する文字（空白・句読点・記号）。〜は「前後の文」を表す省略記号として扱う
+IGNORED_CHARS = set(" \t\r\n\u3000、。，．,.・！？!?「」『』（）()【】［］[]〈〉《》\"'“”‘’…:：;；")
+WILDCARDS = "〜～~"
+
+
+def is_applicable_proposal(proposal) -> bool:
+    """修正前・修正後の組を持ち、記事に直接反映できる提案か"""
+    return (isinstance(proposal, dict)
+            and isinstance(proposal.get("before"), str) and proposal["before"].strip(WILDCARDS + " ")
+            and isinstance(proposal.get("after"), str))
+
+
+def _normalize_with_map(text: str) -> tuple:
+    """全角半角をそろえて空白・句読点を除いた文字列と、各文字の元の位置"""
+    chars = []
+    positions = []
+    for index, ch in enumerate(text):
+        for normalized in unicodedata.normalize("NFKC", ch).lower():
+            if normalized not in IGNORED_CHARS and normalized not in WILDCARDS:
+                chars.append(normalized)
+                positions.append(index)
+    return "".join(chars), positions
+
+
+def locate_text(article: str, needle: str) -> tuple:
+    """記事中の needle の範囲 (開始, 終了) を返す
+
+    完全一致を優先し、見つからなければ全角半角・空白・句読点の違いを無視して照合する。
+    """
+    index = article.find(needle)
+    if index >= 0:
+        if article.find(needle, index + 1) >= 0:
+            raise EditError(f"記事中に複数あり特定できません: 「{needle[:30]}」")
+        return index, index + len(needle)
+
+    normalized_needle, _ = _normalize_with_map(needle)
+    if not normalized_needle:
+        raise EditError(f"照合できる文字がありません: 「{needle[:30]}」")
+    normalized_article, positions = _normalize_with_map(article)
+    index = normalized_article.find(normalized_needle)
+    if index < 0:
+        raise EditError(f"記事中に見つかりません: 「{needle[:30]}」")
+    if normalized_article.find(normalized_needle, index + 1) >= 0:
+        raise EditError(f"記事中に複数あり特定できません: 「{needle[:30]}」")
+    return positions[index], positions[index + len(normalized_needle) - 1] + 1
+
+
+def _strip_wildcards(before: str, after: str) -> tuple:
+    """「〜と考えているようです」のような前後の省略記号を修正前・修正後の両方から外す"""
+    before = before.strip()
+    after = after.strip()
+    if before[:1] in WILDCARDS:
+        before = before.lstrip(WILDCARDS)
+        after = after.lstrip(WILDCARDS)
+    if before[-1:] in WILDCARDS:
+        before = before.rstrip(WILDCARDS)
+        after = after.rstrip(WILDCARDS)
+    return before, after
+
+
+def apply_proposal(article: str, proposal) -> str:
+    """改善提案1件を記事に反映する"""
+    if not is_applicable_proposal(proposal):
+        raise EditError("修正前・修正後の組がない提案は反映できません")
+    before, after = _strip_wildcards(proposal["before"], proposal["after"])
+    if any(w in before for w in WILDCARDS):
+        # 文の途中が省略された提案は、修正後の対応箇所を特定できない
+        raise EditError(f"途中が省略された表現は反映できません: 「{before[:30]}」")
+    start, end = locate_text(article, before)
+    # 句読点を無視して照合した場合、修正後の文末記号が記事側と重複しないようにする
+    if after and after[-1] in "。！？!?" and article[end:end + 1] == after[-1]:
+        end += 1
+    return article[:start] + after + article[end:]
+
+
+def apply_proposals(article: str, proposals) -> EditResult:
+    """改善提案を順に反映する（反映できなかった提案は理由とともに記録する）"""
+    result = EditResult(article)
+    for proposal in proposals:
+        try:
+            result.article = apply_proposal(result.article, proposal)
+            result.applied.append(proposal)
+        except EditError as e:
+            result.failed.append((proposal, str(e)))
+    return result
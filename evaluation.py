@@ -0,0 +1,347 @@
+"""
+記事評価の共通処理
+軸グループごとの並列評価と、LLMの評価結果・ローカル判定の結果の統合。
+評価はバックグラウンドジョブとして実行し、記事生成直後の先行評価にも使う
+"""
+import contextvars
+import hashlib
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from integrity import check_integrity
+from llm_gateway import complete_text
+from prompts import AXIS_GROUPS, build_axis_evaluator_messages, build_evaluator_messages
+from survey_compact import compact_survey
+
+
+# 評価軸（表示順）
+SCORE_LABELS = {
+    "naturalness_teen": "10代自然さ",
+    "readability": "わかりやすさ",
+    "structure": "記事構成",
+    "bias_assertion": "偏り・断定",
+    "ethics_safety": "倫理・配慮",
+    "seo_basics": "SEO基礎",
+    "brand_fit": "ブランド整合",
+    "data_integrity": "データ整合性",
+}
+
+
+def merge_local_scores(evaluation_result: dict, local_scores: dict) -> dict:
+    """ローカル判定のスコアを評価結果に反映し、総合スコアを再計算する"""
+    scores = dict(evaluation_result.get("scores", {}))
+    scores.update(local_scores)
+    # 評価軸の順に並べ直す
+    ordered = {key: scores[key] for key in SCORE_LABELS if key in scores}
+    ordered.update({key: value for key, value in scores.items() if key not in ordered})
+
+    merged = dict(evaluation_result)
+    merged["scores"] = ordered
+    merged["total_score"] = sum(v for v in ordered.values() if isinstance(v, (int, float)))
+    return merged
+
+
+def merge_group_results(group_results) -> dict:
+    """軸グループごとの評価結果を evaluation_result の形式にまとめる"""
+    merged = {"scores": {}, "summary": {"strengths": [], "weaknesses": []}, "proposals": []}
+    for result in group_results:
+        merged["scores"].update(result.get("scores", {}))
+        merged["summary"]["strengths"].extend(result.get("strengths", []))
+        merged["summary"]["weaknesses"].extend(result.get("weaknesses", []))
+        merged["proposals"].extend(result.get("proposals", []))
+    return merge_local_scores(merged, {})
+
+
+def evaluate_parallel(survey_data: str, title: str, article: str, local_axes=(),
+                      model="gpt-4o-mini", bypass_cache=False, on_group_done=None) -> dict:
+    """軸グループごとに並行してLLM評価を行い、1つの評価結果にまとめる
+
+    on_group_done(グループ名, 結果, 経過秒) は完了順に呼び出し元のスレッドで呼ばれる。
+    結果の "timings" にグループごとの所要時間と全体の経過時間を記録する。
+    """
+    groups = {}
+    for name, axes in AXIS_GROUPS.items():
+        axes = [axis for axis in axes if axis not in local_axes]
+        if axes:
+            groups[name] = axes
+
+    def evaluate_group(axes):
+        result = complete_text(
+            build_axis_evaluator_messages(axes, survey_data, title, article),
+            model=model,
+            temperature=0.3,
+            response_format={"type": "json_object"},
+            bypass_cache=bypass_cache,
+            expected_output_tokens=600,
+        )
+        return json.loads(result)
+
+    started = time.perf_counter()
+    results = {}
+    timings = {}
+    with ThreadPoolExecutor(max_workers=len(groups) or 1) as executor:
+        # 計測用のページ名を引き継ぐため、呼び出し元のコンテキストで実行する
+        futures = {
+            executor.submit(contextvars.copy_context().run, evaluate_group, axes): name
+            for name, axes in groups.items()
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            results[name] = future.result()
+            timings[name] = time.perf_counter() - started
+            if on_group_done:
+                on_group_done(name, results[name], timings[name])
+
+    # 元のグループ順で統合
+    merged = merge_group_results(results[name] for name in groups)
+    merged["timings"] = {"groups": timings, "wall_time": time.perf_counter() - started}
+    return merged
+
+
+# セクション単位で評価する軸と、記事の構成（見出し・冒頭文）で評価する軸
+SECTION_AXES = ["naturalness_teen", "readability", "bias_assertion", "ethics_safety", "brand_fit", "data_integrity"]
+OUTLINE_AXES = ["structure", "seo_basics"]
+
+HEADING_RE = re.compile(r"^#{1,6}\s+.+$", re.MULTILINE)
+MIN_SECTION_CHARS = 40
+MAX_CACHED_SECTIONS = 500
+
+
+def split_sections(article: str) -> list:
+    """記事を見出し単位のセクションに分割する（短すぎるセクションは次に結合）"""
+    starts = [m.start() for m in HEADING_RE.finditer(article)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    bounds = starts + [len(article)]
+
+    sections = []
+    carry = ""
+    for start, end in zip(bounds, bounds[1:]):
+        text = carry + article[start:end]
+        if len(text.strip()) < MIN_SECTION_CHARS and end < len(article):
+            carry = text
+            continue
+        carry = ""
+        if text.strip():
+            sections.append(text.strip())
+    if carry.strip():
+        sections.append(carry.strip())
+    return sections
+
+
+def build_outline(article: str) -> str:
+    """見出しと各段落の冒頭文だけを抜き出した構成"""
+    lines = []
+    for paragraph in re.split(r"\n\s*\n", article):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if HEADING_RE.match(paragraph.splitlines()[0]):
+            lines.append(paragraph.splitlines()[0])
+            paragraph = "\n".join(paragraph.splitlines()[1:]).strip()
+            if not paragraph:
+                continue
+        first_sentence = re.split(r"(?<=[。！？])", paragraph, maxsplit=1)[0]
+        lines.append(f"- {first_sentence[:80]}")
+    return "\n".join(lines)
+
+
+def _content_key(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _weighted_scores(results_with_weight) -> dict:
+    """セクションの文字数で重み付けした軸ごとの平均スコア"""
+    totals, weights = {}, {}
+    for result, weight in results_with_weight:
+        for key, value in result.get("scores", {}).items():
+            if isinstance(value, (int, float)):
+                totals[key] = totals.get(key, 0) + value * weight
+                weights[key] = weights.get(key, 0) + weight
+    return {key: round(totals[key] / weights[key]) for key in totals if weights[key]}
+
+
+def _unique(items, limit: int) -> list:
+    seen, result = set(), []
+    for item in items:
+        marker = json.dumps(item, ensure_ascii=False, sort_keys=True)
+        if marker not in seen:
+            seen.add(marker)
+            result.append(item)
+    return result[:limit]
+
+
+def evaluate_incremental(survey_data: str, title: str, article: str, section_cache: dict,
+                         local_axes=(), model="gpt-4o-mini", bypass_cache=False,
+                         on_section_done=None) -> dict:
+    """変更のあったセクションだけを再評価し、未変更セクションの結果と統合する
+
+    section_cache はセクション内容のハッシュ → 評価結果の辞書（呼び出し側で保持し、ここでは読むだけ）。
+    新しく評価したセクションの結果は戻り値の section_results に入れて返すため、
+    呼び出し側のスレッドで store_section_results を使ってキャッシュに取り込む。
+    セクションごとにアンケートを送らないよう、データ整合性は常にローカル検査で判定する。
+    on_section_done(完了数, 再評価数) は完了順に呼び出し元のスレッドで呼ばれる。
+    """
+    section_axes = [axis for axis in SECTION_AXES if axis not in local_axes and axis != "data_integrity"]
+    outline_axes = [axis for axis in OUTLINE_AXES if axis not in local_axes]
+
+    jobs = {}
+    weights = {}
+    for section in split_sections(article):
+        key = _content_key(model, ",".join(section_axes), title, section)
+        weights[key] = weights.get(key, 0) + len(section)
+        jobs[key] = (section_axes, "", section, "記事の一部（セクション）")
+
+    outline = build_outline(article)
+    outline_key = _content_key(model, ",".join(outline_axes), title, outline)
+    if outline_axes:
+        jobs[outline_key] = (outline_axes, "", outline, "記事の構成（見出しと各段落の冒頭文）")
+
+    pending = {key: job for key, job in jobs.items() if bypass_cache or key not in section_cache}
+
+    def evaluate_job(job):
+        axes, survey, text, label = job
+        result = complete_text(
+            build_axis_evaluator_messages(axes, survey, title, text, label=label),
+            model=model,
+            temperature=0.3,
+            response_format={"type": "json_object"},
+            bypass_cache=bypass_cache,
+            expected_output_tokens=600,
+        )
+        return json.loads(result)
+
+    started = time.perf_counter()
+    new_results = {}
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(8, len(pending))) as executor:
+            futures = {
+                executor.submit(contextvars.copy_context().run, evaluate_job, job): key
+                for key, job in pending.items()
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                new_results[futures[future]] = future.result()
+                if on_section_done:
+                    on_section_done(done, len(pending))
+
+    def result_for(key):
+        return new_results[key] if key in new_results else section_cache[key]
+
+    section_results = [(result_for(key), weight) for key, weight in weights.items()]
+    scores = _weighted_scores(section_results)
+    all_results = [result for result, _ in section_results]
+    if outline_axes:
+        outline_result = result_for(outline_key)
+        scores.update({k: v for k, v in outline_result.get("scores", {}).items() if k in outline_axes})
+        all_results.append(outline_result)
+
+    merged = merge_local_scores({
+        "scores": scores,
+        "summary": {
+            "strengths": _unique((s for r in all_results for s in r.get("strengths", [])), 5),
+            "weaknesses": _unique((w for r in all_results for w in r.get("weaknesses", [])), 5),
+        },
+        "proposals": _unique((p for r in all_results for p in r.get("proposals", [])), 10),
+    }, {})
+    if "data_integrity" not in local_axes:
+        integrity_report = check_integrity(survey_data, article)
+        merged = merge_local_scores(merged, {"data_integrity": integrity_report.score})
+        merged["integrity"] = integrity_report.to_dict()
+    merged["timings"] = {"wall_time": time.perf_counter() - started}
+    merged["incremental"] = {"sections": len(jobs), "rescored": len(pending), "reused": len(jobs) - len(pending)}
+    merged["section_results"] = new_results
+    merged["section_keys"] = list(jobs)
+    return merged
+
+
+def store_section_results(section_cache: dict, evaluation_result: dict):
+    """差分評価で新しく評価したセクションの結果をキャッシュに取り込む（セッション状態を持つスレッドで呼ぶ）"""
+    section_cache.update(evaluation_result.pop("section_results", {}))
+    current = set(evaluation_result.pop("section_keys", ()))
+    # 古いキャッシュを削除（挿入順に古いものから。今の記事のセクションは残す）
+    for key in list(section_cache)[:max(0, len(section_cache) - MAX_CACHED_SECTIONS)]:
+        if key not in current:
+            del section_cache[key]
+
+
+# 評価モード（キー → 表示名）
+EVAL_MODES = {
+    "parallel": "⚡ 軸ごとに並列評価",
+    "incremental": "🧩 変更箇所だけ再評価",
+    "single": "📄 一括評価",
+}
+
+
+def evaluation_settings(mode: str, local_axes=(), bypass_cache=False) -> dict:
+    """評価結果を左右する設定（先行評価の結果を使えるかの判定に使う）"""
+    return {"mode": mode, "local_axes": sorted(local_axes), "bypass_cache": bool(bypass_cache)}
+
+
+def evaluation_key(survey_data: str, title: str, article: str) -> str:
+    """評価対象（アンケート・タイトル・本文）を識別するハッシュ"""
+    return _content_key(survey_data or "", title or "", article or "")
+
+
+def evaluate_article(job, mode: str, survey_data: str, title: str, article: str, section_cache=None,
+                     local_scores=None, integrity=None, model="gpt-4o-mini", bypass_cache=False,
+                     analysis=None) -> dict:
+    """評価モードに応じて記事を評価する（job_runner のジョブとして実行）
+
+    local_scores はローカル判定済みの軸のスコア、integrity はデータ整合性の検査結果、
+    analysis はわかりやすさ・SEO基礎の構造解析の結果（いずれも辞書）。
+    進捗は job.report で mode・scores（軸 → (点数, 経過秒)）・sections_done/sections_total を報告する。
+    """
+    local_scores = local_scores or {}
+    local_axes = tuple(local_scores)
+    # 評価に送るアンケートは似た自由回答をまとめたもの（評価結果の識別には元のアンケートを使う）
+    prompt_survey = compact_survey(survey_data or "").text
+    job.report(mode=mode, scores={key: (value, None) for key, value in local_scores.items()})
+
+    if mode == "incremental":
+        def report_sections(done, total):
+            job.check_cancelled()
+            job.report(sections_done=done, sections_total=total)
+
+        evaluation_result = evaluate_incremental(
+            survey_data or "", title, article, section_cache if section_cache is not None else {},
+            local_axes=local_axes, model=model, bypass_cache=bypass_cache,
+            on_section_done=report_sections
+        )
+    elif mode == "parallel":
+        def report_scores(name, result, elapsed):
+            job.check_cancelled()
+            scores = dict(job.progress.get("scores", {}))
+            scores.update({key: (value, elapsed) for key, value in result.get("scores", {}).items()})
+            job.report(scores=scores)
+
+        evaluation_result = evaluate_parallel(
+            prompt_survey, title, article, local_axes=local_axes, model=model,
+            bypass_cache=bypass_cache, on_group_done=report_scores
+        )
+    else:
+        started = time.perf_counter()
+        result = complete_text(
+            build_evaluator_messages(prompt_survey, title, article, local_axes=local_axes),
+            model=model,
+            temperature=0.3,
+            response_format={"type": "json_object"},
+            bypass_cache=bypass_cache,
+        )
+        evaluation_result = json.loads(result)
+        evaluation_result["timings"] = {"wall_time": time.perf_counter() - started}
+
+    # ローカル検査の結果を反映
+    if local_scores:
+        evaluation_result = merge_local_scores(evaluation_result, local_scores)
+    if integrity:
+        evaluation_result["integrity"] = integrity
+    if analysis:
+        evaluation_result["analysis"] = analysis
+    evaluation_result["key"] = evaluation_key(survey_data, title, article)
+    return evaluation_result
@@ -0,0 +1,220 @@
+"""
+データ整合性チェッカー
+記事中の数値・割合・「約7割」などの概数を抽出し、アンケートデータと照合する
+"""
+import re
+from dataclasses import dataclass, field
+
+from survey_parser import normalize, parse_survey
+
+
+KANJI_DIGITS = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10}
+APPROX_PREFIX = r"(約|およそ|ほぼ|おおよそ|実に)?"
+
+PERCENT_RE = re.compile(APPROX_PREFIX + r"(\d+(?:\.\d+)?)\s*%")
+WARI_RE = re.compile(APPROX_PREFIX + r"([0-9一二三四五六七八九十]+)割(強|弱|以上|近く)?")
+ONE_IN_RE = re.compile(APPROX_PREFIX + r"(\d+)人に(?:1|一)人")
+HALF_RE = re.compile(r"(半数|半分)(以上|近く|弱|強)?")
+COUNT_RE = re.compile(r"(\d[\d,]*)\s*(名|人)(?!に(?:1|一)人)")
+
+# 完全一致とみなす誤差（%ポイント）
+EXACT_TOLERANCE = 0.05
+APPROX_TOLERANCE = 1.0
+
+SENTENCE_SPLIT_RE = re.compile(r"[^。！？!?\n]+[。！？!?]?")
+
+
+@dataclass
+class IntegrityFinding:
+    """記事中の数値1件の照合結果"""
+    text: str
+    start: int
+    end: int
+    value: float
+    status: str  # "ok" / "mismatch" / "unverified"
+    message: str = ""
+
+
+@dataclass
+class IntegrityReport:
+    """データ整合性チェックの結果"""
+    findings: list = field(default_factory=list)
+    score: int = 5
+
+    @property
+    def mismatches(self):
+        return [f for f in self.findings if f.status == "mismatch"]
+
+    @property
+    def unverified(self):
+        return [f for f in self.findings if f.status == "unverified"]
+
+    def to_dict(self) -> dict:
+        return {
+            "score": self.score,
+            "findings": [f.__dict__ for f in self.findings if f.status != "ok"],
+            "checked": len(self.findings),
+        }
+
+
+def _kanji_or_int(text: str) -> int:
+    if text.isdigit():
+        return int(text)
+    if text == "十":
+        return 10
+    return KANJI_DIGITS.get(text, 0)
+
+
+def _sentence_at(sentences, position: int):
+    """位置を含む文とその開始位置"""
+    for start, end, sentence in sentences:
+        if start <= position < end:
+            return start, sentence
+    return position, ""
+
+
+def _nearest_options(table, sentence: str, offset: int) -> list:
+    """文中で数値の直前（なければ直後）に書かれた選択肢（同じ名前の選択肢が複数の設問にあればすべて）"""
+    best, best_distance = [], None
+    for question, option in table.all_options():
+        if not option.label:
+            continue
+        index = sentence.rfind(option.label, 0, offset)
+        if index >= 0:
+            distance = offset - index
+        else:
+            index = sentence.find(option.label, offset)
+            if index < 0:
+                continue
+            distance = len(sentence) + index - offset
+        if best_distance is None or distance < best_distance:
+            best, best_distance = [(question, option)], distance
+        elif distance == best_distance:
+            best.append((question, option))
+    return best
+
+
+def _candidate_values(table) -> list:
+    """記事に登場しうる割合（各選択肢・補数・同一設問内の2項目の和）"""
+    values = []
+    for question in table.questions:
+        percents = [o.percent for o in question.options]
+        for option in question.options:
+            values.append((option.percent, f"Q{question.number}「{option.label}」"))
+            values.append((round(100 - option.percent, 1), f"Q{question.number}「{option.label}」以外"))
+        for i in range(len(percents)):
+            for j in range(i + 1, len(percents)):
+                values.append((round(percents[i] + percents[j], 1),
+                               f"Q{question.number}の上位2項目の合計"))
+    return values
+
+
+def _named_values(question, option, sentence: str) -> list:
+    """文中で名前が挙がった選択肢について、記事に登場しうる割合
+
+    補数は「〜以外」と書かれている場合だけ、合計は同じ設問の選択肢が文中に複数ある場合だけ候補にする。
+    """
+    label = f"Q{question.number}「{option.label}」"
+    values = [(option.percent, f"{label}{option.percent}%")]
+    if option.label + "以外" in sentence:
+        values.append((round(100 - option.percent, 1), label + "以外"))
+    for other in question.options:
+        if other is not option and other.label and other.label in sentence:
+            values.append((round(option.percent + other.percent, 1), f"{label}と「{other.label}」の合計"))
+    return values
+
+
+def _extract_numbers(article: str):
+    """記事から (開始, 終了, 表記, 下限, 上限, 値, 種類) を抽出"""
+    for m in PERCENT_RE.finditer(article):
+        value = float(m.group(2))
+        tolerance = APPROX_TOLERANCE if m.group(1) else EXACT_TOLERANCE
+        yield m.start(), m.end(), m.group(0), value - tolerance, value + tolerance, value, "percent"
+
+    for m in WARI_RE.finditer(article):
+        value = _kanji_or_int(m.group(2)) * 10
+        if not value:
+            continue
+        suffix = m.group(3)
+        if suffix in ("強", "以上"):
+            low, high = value, value + 5
+        elif suffix in ("弱", "近く"):
+            low, high = value - 5, value
+        else:
+            low, high = value - 5, value + 5
+        yield m.start(), m.end(), m.group(0), low, high, value, "approx"
+
+    for m in ONE_IN_RE.finditer(article):
+        n = int(m.group(2))
+        if n <= 1:
+            continue
+        value = 100 / n
+        yield m.start(), m.end(), m.group(0), 100 / (n + 0.5), 100 / (n - 0.5), value, "approx"
+
+    for m in HALF_RE.finditer(article):
+        suffix = m.group(2)
+        if suffix in ("以上", "強"):
+            low, high = 50, 60
+        elif suffix in ("近く", "弱"):
+            low, high = 40, 50
+        else:
+            low, high = 45, 55
+        yield m.start(), m.end(), m.group(0), low, high, 50, "approx"
+
+
+def check_integrity(survey_text: str, article: str) -> IntegrityReport:
+    """アンケートデータと記事の数値を照合する"""
+    table = parse_survey(survey_text)
+    article = normalize(article)
+    report = IntegrityReport()
+
+    if not table.questions and table.respondents is None:
+        return report
+
+    sentences = [(m.start(), m.end(), m.group(0)) for m in SENTENCE_SPLIT_RE.finditer(article)]
+    candidates = _candidate_values(table)
+
+    for start, end, text, low, high, value, _kind in _extract_numbers(article):
+        sentence_start, sentence = _sentence_at(sentences, start)
+
+        # 同じ文に選択肢名があれば、その選択肢の値（「〜以外」・文中の選択肢どうしの合計を含む）とだけ照合
+        nearest = _nearest_options(table, sentence, start - sentence_start)
+        if nearest:
+            matched = [
+                label for q, o in nearest for percent, label in _named_values(q, o, sentence)
+                if low <= percent <= high
+            ]
+            if matched:
+                report.findings.append(IntegrityFinding(text, start, end, value, "ok", f"{matched[0]}と一致"))
+            else:
+                q, o = nearest[0]
+                report.findings.append(IntegrityFinding(
+                    text, start, end, value, "mismatch", f"アンケートではQ{q.number}「{o.label}」は{o.percent}%です"))
+            continue
+
+        # 選択肢名がない文は、記事に登場しうる割合のいずれかと照合
+        matched = [label for percent, label in candidates if low <= percent <= high]
+        if matched:
+            report.findings.append(IntegrityFinding(text, start, end, value, "ok", f"{matched[0]}と一致"))
+        else:
+            report.findings.append(IntegrityFinding(
+                text, start, end, value, "unverified", "アンケートデータに該当する数値がありません"))
+
+    # 回答者数
+    if table.respondents:
+        for m in COUNT_RE.finditer(article):
+            count = int(m.group(1).replace(",", ""))
+            if count < 100:
+                continue
+            if count == table.respondents:
+                report.findings.append(IntegrityFinding(
+                    m.group(0), m.start(), m.end(), count, "ok", "有効回答数と一致"))
+            else:
+                report.findings.append(IntegrityFinding(
+                    m.group(0), m.start(), m.end(), count, "mismatch",
+                    f"有効回答数は{table.respondents}名です"))
+
+    report.findings.sort(key=lambda f: f.start)
+    penalty = len(report.mismatches) + 0.5 * len(report.unverified)
+    report.score = max(0, round(5 - penalty))
+    return report
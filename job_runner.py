@@ -0,0 +1,162 @@
+"""
+バックグラウンドジョブ
+LLM呼び出しをプロセス共通のスレッドプールで実行し、Streamlitの再実行やページ移動をまたいで結果を保持する。
+ページはジョブIDだけを session_state に持ち、フラグメントで定期的に進捗と結果を取りに来る。
+"""
+import contextvars
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+
+JOB_WORKERS = int(os.getenv("YAE_JOB_WORKERS", "8"))
+# 完了したジョブを保持する時間（秒）
+JOB_TTL = float(os.getenv("YAE_JOB_TTL", "1800"))
+# ページが進捗を確認する間隔（秒）
+JOB_POLL_INTERVAL = 0.5
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    """ジョブが中止された"""
+
+
+@dataclass
+class Job:
+    """バックグラウンドで実行中（または実行済み）の処理1件"""
+    id: str
+    kind: str
+    label: str = ""
+    status: str = PENDING
+    progress: dict = field(default_factory=dict)
+    result: object = None
+    error: str = ""
+    created: float = field(default_factory=time.time)
+    started: float = None
+    finished: float = None
+    future: object = None
+    _cancel: threading.Event = field(default_factory=threading.Event)
+
+    def report(self, **progress):
+        """進捗を更新する（辞書ごと差し替えるので読み出し側はロック不要）"""
+        self.progress = {**self.progress, **progress}
+
+    def check_cancelled(self):
+        """中止が要求されていれば JobCancelled を送出する（処理の区切りで呼ぶ）"""
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def active(self) -> bool:
+        return self.status in (PENDING, RUNNING)
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+
+class JobRunner:
+    """スクリプトの実行とは独立したスレッドプールでジョブを実行する
+
+    ジョブ関数は第1引数に Job を受け取り、report で進捗を報告し、
+    check_cancelled で中止要求に応じる。戻り値が Job.result になる。
+    """
+
+    def __init__(self, max_workers: int = JOB_WORKERS, ttl: float = JOB_TTL):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="yae-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.ttl = ttl
+
+    def submit(self, kind: str, fn, *args, label: str = "", **kwargs) -> str:
+        """ジョブを登録してIDを返す"""
+        job = Job(id=uuid.uuid4().hex, kind=kind, label=label)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        # 呼び出し元のコンテキスト（計測用のページ名など）を引き継ぐ
+        context = contextvars.copy_context()
+        job.future = self._executor.submit(context.run, self._run, job, fn, args, kwargs)
+        return job.id
+
+    def _run(self, job: Job, fn, args, kwargs):
+        if job.cancel_requested:
+            job.status = CANCELLED
+            job.finished = time.time()
+            return
+        job.started = time.time()
+        job.status = RUNNING
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+            job.status = FAILED
+        finally:
+            job.finished = time.time()
+
+    def get(self, job_id) -> Job:
+        """ジョブを取得（存在しない・期限切れなら None）"""
+        if not job_id:
+            return None
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id) -> bool:
+        """ジョブの中止を要求する（実行中の処理は次の区切りで止まる）"""
+        job = self.get(job_id)
+        if job is None or not job.active:
+            return False
+        job._cancel.set()
+        if job.future is not None and job.future.cancel():
+            job.status = CANCELLED
+            job.finished = time.time()
+        return True
+
+    def _prune(self):
+        """保持期間を過ぎた完了済みジョブを捨てる"""
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if not job.active and job.finished and now - job.finished > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "active": sum(1 for job in jobs if job.active),
+            "total": len(jobs),
+        }
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner() -> JobRunner:
+    """プロセス全体で共有するジョブランナーを取得"""
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = JobRunner()
+    return _runner
@@ -0,0 +1,193 @@
+"""
+ストリーミングJSONパーサー
+LLMから逐次届く不完全なJSONを少しずつ読み込み、途中経過のオブジェクトを返す
+"""
+
+
+_LITERALS = {"true": True, "false": False, "null": None}
+
+
+class IncrementalJSONParser:
+    """チャンク単位で受け取ったJSONを逐次パースする寛容なパーサー
+
+    feed() のたびに新しく届いた文字だけを処理するため、全体の処理量は
+    受信した文字数に比例する。文字列は閉じていなくても途中まで値に反映される。
+    """
+
+    def __init__(self):
+        self.root = None
+        self.done = False
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._unicode = None
+        self._chars = []
+        self._string_is_key = False
+        self._string_target = None
+        self._scalar = []
+
+    # ---- 公開API ----
+
+    def feed(self, chunk: str):
+        """チャンクを追加して、現時点のルートオブジェクトを返す"""
+        for ch in chunk:
+            if self.done:
+                break
+            self._consume(ch)
+
+        # 途中の文字列値を反映
+        if self._in_string and self._string_target is not None:
+            self._assign(self._string_target, "".join(self._chars))
+
+        return self.snapshot()
+
+    def snapshot(self):
+        """現時点でのパース結果（ルートが未確定の場合は空dict）"""
+        return self.root if self.root is not None else {}
+
+    # ---- 内部処理 ----
+
+    def _consume(self, ch):
+        if self._in_string:
+            self._consume_string(ch)
+            return
+
+        if self._scalar:
+            if ch.isalnum() or ch in "+-.":
+                self._scalar.append(ch)
+                return
+            self._finish_scalar()
+
+        if ch in " \t\r\n":
+            return
+
+        if not self._stack:
+            # ルート開始前のコードフェンス等は読み飛ばす
+            if ch == "{":
+                self.root = {}
+                self._stack.append({"value": self.root, "key": None, "expect": "key"})
+            elif ch == "[":
+                self.root = []
+                self._stack.append({"value": self.root, "key": None, "expect": "value"})
+            return
+
+        frame = self._stack[-1]
+        container = frame["value"]
+
+        if ch in "}]":
+            self._stack.pop()
+            if not self._stack:
+                self.done = True
+            return
+
+        if ch == ",":
+            frame["expect"] = "key" if isinstance(container, dict) else "value"
+            return
+
+        if ch == ":":
+            frame["expect"] = "value"
+            return
+
+        if ch == '"':
+            self._in_string = True
+            self._chars = []
+            if isinstance(container, dict) and frame["expect"] == "key":
+                self._string_is_key = True
+                self._string_target = None
+            else:
+                self._string_is_key = False
+                self._string_target = self._place(frame, "")
+            return
+
+        if ch == "{":
+            child = {}
+            self._place(frame, child)
+            self._stack.append({"value": child, "key": None, "expect": "key"})
+            return
+
+        if ch == "[":
+            child = []
+            self._place(frame, child)
+            self._stack.append({"value": child, "key": None, "expect": "value"})
+            return
+
+        # 数値・リテラル
+        self._scalar.append(ch)
+
+    def _consume_string(self, ch):
+        if self._unicode is not None:
+            self._unicode.append(ch)
+            if len(self._unicode) == 4:
+                try:
+                    self._chars.append(chr(int("".join(self._unicode), 16)))
+                except ValueError:
+                    pass
+                self._unicode = None
+            return
+
+        if self._escape:
+            self._escape = False
+            if ch == "u":
+                self._unicode = []
+            else:
+                self._chars.append({"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}.get(ch, ch))
+            return
+
+        if ch == "\\":
+            self._escape = True
+            return
+
+        if ch != '"':
+            self._chars.append(ch)
+            return
+
+        # 文字列終了
+        self._in_string = False
+        text = "".join(self._chars)
+        self._chars = []
+        frame = self._stack[-1]
+        if self._string_is_key:
+            frame["key"] = text
+            frame["expect"] = "colon"
+        else:
+            self._assign(self._string_target, text)
+            frame["expect"] = "comma"
+        self._string_target = None
+
+    def _finish_scalar(self):
+        token = "".join(self._scalar)
+        self._scalar = []
+        if token in _LITERALS:
+            value = _LITERALS[token]
+        else:
+            try:
+                value = int(token)
+            except ValueError:
+                try:
+                    value = float(token)
+                except ValueError:
+                    return
+        if self._stack:
+            self._place(self._stack[-1], value)
+
+    def _place(self, frame, value):
+        """コンテナに値を配置し、後から更新できるよう位置を返す"""
+        container = frame["value"]
+        frame["expect"] = "comma"
+        if isinstance(container, dict):
+            key = frame["key"]
+            container[key] = value
+            return (container, key)
+        container.append(value)
+        return (container, len(container) - 1)
+
+    @staticmethod
+    def _assign(target, value):
+        container, key = target
+        container[key] = value
+
+
+def parse_partial_json(text: str):
+    """不完全なJSON文字列を一括でパースする（途中までの値を返す）"""
+    parser = IncrementalJSONParser()
+    return parser.feed(text)
@@ -0,0 +1,153 @@
+"""
+禁止表現の校正エンジン
+Aho–Corasick法で禁止語リストを一括照合し、文末表現は正規表現で検出する
+"""
+import json
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+
+
+RULES_DIR = Path(__file__).parent / "lint_rules"
+
+
+@dataclass
+class LintMatch:
+    """検出した表現1件"""
+    start: int
+    end: int
+    text: str
+    category: str
+    axis: str
+    suggestion: str
+    message: str
+
+
+class AhoCorasick:
+    """複数パターンを1回の走査で照合するオートマトン"""
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for pattern_id, pattern in enumerate(patterns):
+            self._add(pattern, pattern_id)
+        self._lengths = [len(p) for p in patterns]
+        self._build()
+
+    def _add(self, pattern: str, pattern_id: int):
+        node = 0
+        for ch in pattern:
+            next_node = self._goto[node].get(ch)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][ch] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append(pattern_id)
+
+    def _build(self):
+        """幅優先で失敗リンクを張る"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def finditer(self, text: str):
+        """(開始位置, 終了位置, パターン番号) を順に返す"""
+        goto, fail, output, lengths = self._goto, self._fail, self._output, self._lengths
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for pattern_id in output[node]:
+                yield i + 1 - lengths[pattern_id], i + 1, pattern_id
+
+
+class LintEngine:
+    """禁止語リストと正規表現ルールで記事を校正する"""
+
+    def __init__(self, rule_sets):
+        self._terms = []
+        self._patterns = []
+        for rule_set in rule_sets:
+            meta = (rule_set["category"], rule_set.get("axis", ""), rule_set.get("message", ""))
+            for term, suggestion in rule_set.get("terms", {}).items():
+                self._terms.append((term, suggestion) + meta)
+            for rule in rule_set.get("patterns", []):
+                message = rule.get("message", meta[2])
+                self._patterns.append(
+                    (re.compile(rule["regex"]), rule.get("suggestion", ""), meta[0], meta[1], message)
+                )
+        self._automaton = AhoCorasick([t[0] for t in self._terms])
+
+    @property
+    def term_count(self) -> int:
+        return len(self._terms)
+
+    def lint(self, text: str) -> list:
+        """記事を走査し、重なりを除いた検出結果を位置順に返す"""
+        matches = []
+        for start, end, term_id in self._automaton.finditer(text):
+            term, suggestion, category, axis, message = self._terms[term_id]
+            matches.append(LintMatch(start, end, term, category, axis, suggestion, message))
+
+        for regex, suggestion, category, axis, message in self._patterns:
+            for m in regex.finditer(text):
+                matches.append(LintMatch(m.start(), m.end(), m.group(0), category, axis, suggestion, message))
+
+        # 同じ箇所に重なる検出は長いものを優先
+        matches.sort(key=lambda m: (m.start, -(m.end - m.start)))
+        result = []
+        last_end = -1
+        for match in matches:
+            if match.start >= last_end:
+                result.append(match)
+                last_end = match.end
+        return result
+
+
+def load_rule_sets(directory=RULES_DIR) -> list:
+    """ルールディレクトリ内のJSONをすべて読み込む"""
+    rule_sets = []
+    for path in sorted(Path(directory).glob("*.json")):
+        with open(path, "r", encoding="utf-8") as f:
+            rule_sets.append(json.load(f))
+    return rule_sets
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_lint_engine() -> LintEngine:
+    """プロセス全体で共有する校正エンジンを取得（オートマトンは初回のみ構築）"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = LintEngine(load_rule_sets())
+    return _engine
+
+
+def lint_article(text: str) -> list:
+    """記事の禁止表現を検出する"""
+    return get_lint_engine().lint(text)
+
+
+def context_snippet(text: str, match: LintMatch, width: int = 15) -> str:
+    """検出箇所の前後を含む抜粋"""
+    before = text[max(0, match.start - width):match.start]
+    after = text[match.end:match.end + width]
+    return f"…{before}**{match.text}**{after}…".replace("\n", " ")
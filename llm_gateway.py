@@ -0,0 +1,425 @@
+"""
+LLMゲートウェイ
+全ページ共通のOpenAIクライアント（接続プール・タイムアウト・リトライ・レート制限・同一リクエストの合流・計測）
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APIStatusError
+
+from response_cache import get_response_cache, make_cache_key
+from single_flight import SingleFlight
+from telemetry import CallRecord
+
+
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# 接続プール設定
+MAX_CONNECTIONS = int(os.getenv("YAE_MAX_CONNECTIONS", "32"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("YAE_MAX_KEEPALIVE_CONNECTIONS", "16"))
+KEEPALIVE_EXPIRY = 60.0
+
+# タイムアウト設定（秒）
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 60.0
+# ストリーミングで次の差分を待つ上限。受信者がいなくなったストリームも、止まっていれば長くてもこの時間で閉じる
+STREAM_READ_TIMEOUT = float(os.getenv("YAE_STREAM_READ_TIMEOUT", "20"))
+DEFAULT_DEADLINE = float(os.getenv("YAE_LLM_DEADLINE", "120"))
+
+# リトライ設定
+MAX_RETRIES = int(os.getenv("YAE_LLM_MAX_RETRIES", "4"))
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 20.0
+
+# APIキーあたりのクォータ（プロセス全体で共有）
+REQUESTS_PER_MINUTE = float(os.getenv("YAE_RPM_LIMIT", "500"))
+TOKENS_PER_MINUTE = float(os.getenv("YAE_TPM_LIMIT", "200000"))
+EXPECTED_OUTPUT_TOKENS = 1500
+
+
+class GatewayError(Exception):
+    """ゲートウェイの設定エラー"""
+
+
+class DeadlineExceeded(GatewayError):
+    """呼び出しの期限切れ"""
+
+
+class TokenBucket:
+    """スレッドセーフなトークンバケット"""
+
+    def __init__(self, rate_per_sec: float, capacity: float):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """amountを予約し、利用可能になるまでの待ち時間（秒）を返す"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def release(self, amount: float):
+        """予約した分を返却"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + min(amount, self.capacity))
+
+    def acquire(self, amount: float = 1.0, deadline: float = None):
+        """amountが利用可能になるまで待つ"""
+        wait = self.reserve(amount)
+        if deadline is not None and time.monotonic() + wait > deadline:
+            self.release(amount)
+            raise DeadlineExceeded("レート制限の待ち時間が期限を超えました")
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, amount: float = 1.0, deadline: float = None):
+        """acquire() のasyncio版（イベントループをブロックしない）"""
+        wait = self.reserve(amount)
+        if deadline is not None and time.monotonic() + wait > deadline:
+            self.release(amount)
+            raise DeadlineExceeded("レート制限の待ち時間が期限を超えました")
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+# RPM / TPM のリミッター（1分間の上限をバケット容量とする）
+request_limiter = TokenBucket(REQUESTS_PER_MINUTE / 60.0, REQUESTS_PER_MINUTE)
+token_limiter = TokenBucket(TOKENS_PER_MINUTE / 60.0, TOKENS_PER_MINUTE)
+
+
+# 同じ内容の同時呼び出しを1回にまとめる（セッションをまたいでプロセス全体で共有）
+request_flights = SingleFlight()
+
+
+_client = None
+_async_client = None
+_client_lock = threading.Lock()
+
+
+def has_api_key() -> bool:
+    """APIキーが設定されているか"""
+    return bool(os.getenv("OPENAI_API_KEY"))
+
+
+def _require_api_key() -> str:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise GatewayError("OPENAI_API_KEYが設定されていません")
+    return api_key
+
+
+def _pool_settings() -> dict:
+    return {
+        "limits": httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+    }
+
+
+def get_client() -> OpenAI:
+    """プロセス全体で共有するOpenAIクライアントを取得"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                api_key = _require_api_key()
+                # リトライはゲートウェイ側で行うためSDKのリトライは無効化
+                _client = OpenAI(api_key=api_key, http_client=httpx.Client(**_pool_settings()),
+                                 max_retries=0)
+    return _client
+
+
+def get_async_client() -> AsyncOpenAI:
+    """バッチ処理用の非同期クライアントを取得（1つのイベントループ内で使用する）"""
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                api_key = _require_api_key()
+                _async_client = AsyncOpenAI(api_key=api_key,
+                                            http_client=httpx.AsyncClient(**_pool_settings()),
+                                            max_retries=0)
+    return _async_client
+
+
+def estimate_tokens(messages) -> int:
+    """メッセージのトークン数を概算（日本語は概ね1文字1トークン）"""
+    return sum(len(m.get("content") or "") + 4 for m in messages)
+
+
+def _is_retryable(error) -> bool:
+    if isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def _backoff_delay(error, attempt: int) -> float:
+    """Retry-Afterがあれば優先し、なければフルジッター付き指数バックオフ"""
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+
+def _request_params(messages, model, temperature, response_format, stream) -> dict:
+    params = {"model": model, "messages": messages, "temperature": temperature}
+    if response_format:
+        params["response_format"] = response_format
+    if stream:
+        params["stream"] = True
+        # 最後のチャンクでトークン数を受け取る
+        params["stream_options"] = {"include_usage": True}
+    return params
+
+
+def chat_completion(messages, model=DEFAULT_MODEL, temperature=0.7, response_format=None,
+                    stream=False, deadline=None, expected_output_tokens=EXPECTED_OUTPUT_TOKENS, record=None):
+    """chat.completions.create をタイムアウト・リトライ・レート制限付きで呼び出す
+
+    stream=True の場合はストリームを返す（リトライは接続確立までが対象）。
+    record（CallRecord）を渡すとリトライ回数を記録する。
+    """
+    client = get_client()
+    expires_at = time.monotonic() + (deadline or DEFAULT_DEADLINE)
+    params = _request_params(messages, model, temperature, response_format, stream)
+
+    request_limiter.acquire(1, deadline=expires_at)
+    token_limiter.acquire(estimate_tokens(messages) + expected_output_tokens, deadline=expires_at)
+
+    attempt = 0
+    while True:
+        remaining = expires_at - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("LLM呼び出しが期限内に完了しませんでした")
+        try:
+            read_timeout = STREAM_READ_TIMEOUT if stream else READ_TIMEOUT
+            return client.chat.completions.create(timeout=min(remaining, read_timeout), **params)
+        except Exception as e:
+            if not _is_retryable(e) or attempt >= MAX_RETRIES:
+                raise
+            delay = _backoff_delay(e, attempt)
+            if time.monotonic() + delay >= expires_at:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            if record is not None:
+                record.retries = attempt
+
+
+async def achat_completion(messages, model=DEFAULT_MODEL, temperature=0.7, response_format=None,
+                           deadline=None, expected_output_tokens=EXPECTED_OUTPUT_TOKENS, record=None):
+    """chat_completion() のasyncio版（ストリーミングなし）"""
+    client = get_async_client()
+    expires_at = time.monotonic() + (deadline or DEFAULT_DEADLINE)
+    params = _request_params(messages, model, temperature, response_format, False)
+
+    await request_limiter.acquire_async(1, deadline=expires_at)
+    await token_limiter.acquire_async(estimate_tokens(messages) + expected_output_tokens,
+                                      deadline=expires_at)
+
+    attempt = 0
+    while True:
+        remaining = expires_at - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("LLM呼び出しが期限内に完了しませんでした")
+        try:
+            return await client.chat.completions.create(timeout=min(remaining, READ_TIMEOUT), **params)
+        except Exception as e:
+            if not _is_retryable(e) or attempt >= MAX_RETRIES:
+                raise
+            delay = _backoff_delay(e, attempt)
+            if time.monotonic() + delay >= expires_at:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            if record is not None:
+                record.retries = attempt
+
+
+def _is_cacheable(content: str, finish_reason, response_format=None) -> bool:
+    """キャッシュしてよい応答か（最後まで生成された空でない応答。JSONモードならJSONとして読めること）"""
+    if finish_reason != "stop" or not content.strip():
+        return False
+    if (response_format or {}).get("type") == "json_object":
+        try:
+            json.loads(content)
+        except ValueError:
+            return False
+    return True
+
+
+def complete_text(messages, model=DEFAULT_MODEL, temperature=0.7, response_format=None,
+                  use_cache=True, bypass_cache=False, **kwargs) -> str:
+    """応答本文を取得（use_cache=True ならディスクキャッシュを利用）
+
+    bypass_cache=True の場合はキャッシュを読まずに呼び出し、結果で上書きする。
+    """
+    record = CallRecord(model=model, kind="complete")
+    cache = get_response_cache() if use_cache else None
+    key = make_cache_key(model, messages, temperature=temperature, response_format=response_format)
+    if cache is not None and not bypass_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            record.finish("cache_hit")
+            return cached
+
+    def call():
+        record.upstream = True
+        response = chat_completion(messages, model=model, temperature=temperature,
+                                   response_format=response_format, record=record, **kwargs)
+        record.set_usage(getattr(response, "usage", None))
+        choice = response.choices[0]
+        content = choice.message.content or ""
+        if cache is not None and _is_cacheable(content, choice.finish_reason, response_format):
+            cache.set(key, content)
+        return content
+
+    # 同じリクエストが実行中なら、その結果を待って共有する（キャッシュを使わない呼び出しは合流させない）
+    try:
+        content = call() if bypass_cache else request_flights.do(key, call)
+    except Exception as e:
+        record.finish("error", e)
+        raise
+    record.finish("ok" if record.upstream else "coalesced")
+    return content
+
+
+def _iter_deltas(stream, cache, key, record=None, response_format=None):
+    """ストリームから本文の差分を取り出す（最後まで受信できた応答のみキャッシュ）"""
+    parts = []
+    finish_reason = None
+    try:
+        for chunk in stream:
+            if record is not None and getattr(chunk, "usage", None) is not None:
+                record.set_usage(chunk.usage)
+            if not chunk.choices:
+                continue
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+    finally:
+        stream.close()
+
+    content = "".join(parts)
+    if cache is not None and _is_cacheable(content, finish_reason, response_format):
+        cache.set(key, content)
+
+
+class _DeltaStream:
+    """上流のストリームから本文の差分を取り出すイテレーター（受信を始める前でも close() で接続を閉じる）"""
+
+    def __init__(self, stream, cache, key, record=None, response_format=None):
+        self._stream = stream
+        self._deltas = _iter_deltas(stream, cache, key, record, response_format)
+
+    def __iter__(self):
+        return self._deltas
+
+    def close(self):
+        self._deltas.close()
+        self._stream.close()
+
+
+def stream_text(messages, model=DEFAULT_MODEL, temperature=0.7, response_format=None,
+                use_cache=False, bypass_cache=False, **kwargs):
+    """応答本文の差分を順に返すジェネレーター
+
+    キャッシュヒット時は全文を一度に返す。同じリクエストを受信中の呼び出しがあれば、
+    受信済みの部分から同じ内容を返す。受信している全員が close() すると
+    上流のHTTP接続も閉じる。最後まで受信できた応答のみキャッシュする。
+    """
+    record = CallRecord(model=model, kind="stream")
+    cache = get_response_cache() if use_cache else None
+    key = make_cache_key(model, messages, temperature=temperature, response_format=response_format)
+    if cache is not None and not bypass_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            record.mark_first_token()
+            record.finish("cache_hit")
+            yield cached
+            return
+
+    def open_stream():
+        record.upstream = True
+        stream = chat_completion(messages, model=model, temperature=temperature,
+                                 response_format=response_format, stream=True, record=record, **kwargs)
+        return _DeltaStream(stream, cache, key, record, response_format)
+
+    def own_stream():
+        # キャッシュを使わない呼び出しは、受信中の同じリクエストに合流させず自分で受信する
+        stream = open_stream()
+        try:
+            yield from stream
+        finally:
+            stream.close()
+
+    status, error = "cancelled", None
+    try:
+        deltas = own_stream() if bypass_cache else request_flights.stream(key, open_stream)
+        for delta in deltas:
+            record.mark_first_token()
+            yield delta
+        status = "ok" if record.upstream else "coalesced"
+    except Exception as e:
+        status, error = "error", e
+        raise
+    finally:
+        # 途中で close() された場合は cancelled として記録する
+        record.finish(status, error)
+
+
+async def acomplete_text(messages, model=DEFAULT_MODEL, temperature=0.7, response_format=None,
+                         use_cache=True, bypass_cache=False, **kwargs) -> str:
+    """complete_text() のasyncio版"""
+    record = CallRecord(model=model, kind="complete")
+    cache = get_response_cache() if use_cache else None
+    key = make_cache_key(model, messages, temperature=temperature, response_format=response_format)
+    if cache is not None and not bypass_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            record.finish("cache_hit")
+            return cached
+
+    record.upstream = True
+    try:
+        response = await achat_completion(messages, model=model, temperature=temperature,
+                                          response_format=response_format, record=record, **kwargs)
+    except Exception as e:
+        record.finish("error", e)
+        raise
+    record.set_usage(getattr(response, "usage", None))
+    record.finish("ok")
+    choice = response.choices[0]
+    content = choice.message.content or ""
+    if cache is not None and _is_cacheable(content, choice.finish_reason, response_format):
+        cache.set(key, content)
+    return content
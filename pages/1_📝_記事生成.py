@@ -2,13 +2,27 @@
 記事生成ページ - ライター機能
 アンケートデータから記事草稿を生成
 """
-import os
+import copy
 import json
+import time
 from pathlib import Path
 import streamlit as st
-from openai import OpenAI
 from dotenv import load_dotenv
-from prompts import get_writer_prompt
+from session_store import sync_session, save_session, new_session_id
+from telemetry import set_page, start_metrics_server
+from prompts import build_writer_messages
+from llm_gateway import complete_text, stream_text, has_api_key, request_flights
+from response_cache import get_response_cache, format_cache_stats
+from single_flight import format_flight_stats
+from json_stream import IncrementalJSONParser
+from job_runner import get_job_runner, JOB_POLL_INTERVAL, DONE, FAILED, CANCELLED
+from integrity import check_integrity
+from article_analyzer import analyze_article
+from evaluation import evaluate_article, evaluation_key, evaluation_settings
+from survey_reduce import needs_map_reduce, reduce_survey
+from survey_compact import compact_survey
+from survey_parser import parse_survey
+from chart_engine import CHART_KINDS, build_charts, chart_svg, get_chart_cache
 
 # 環境変数読み込み
 load_dotenv()
@@ -20,16 +34,19 @@ st.set_page_config(
     layout="wide"
 )
 
-# OpenAI クライアント初期化
-@st.cache_resource
-def get_openai_client():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        st.error("⚠️ OPENAI_API_KEYが設定されていません。.envファイルを確認してください。")
-        st.stop()
-    return OpenAI(api_key=api_key)
+# セッションの永続化（URLの ?sid= をキーに、再読み込みやサーバー再起動の後も作業内容を復元）
+if "sid" not in st.query_params:
+    st.query_params["sid"] = st.session_state.get("session_id") or new_session_id()
+sync_session(st.session_state, st.query_params["sid"])
 
-client = get_openai_client()
+# LLM呼び出しの計測（ページ名を付けて記録し、/metrics を公開）
+set_page("generate")
+start_metrics_server()
+
+# APIキー確認（クライアントはLLMゲートウェイで共有）
+if not has_api_key():
+    st.error("⚠️ OPENAI_API_KEYが設定されていません。.envファイルを確認してください。")
+    st.stop()
 
 
 # サンプルデータ読み込み
@@ -56,6 +73,194 @@ if "generated_article" not in st.session_state:
 if "article_data" not in st.session_state:
     st.session_state.article_data = {}
 
+if "generation_metrics" not in st.session_state:
+    st.session_state.generation_metrics = {}
+
+# 実行中の生成ジョブ（スクリプトが再実行されても処理はバックグラウンドで続く）
+if "generation_job" not in st.session_state:
+    st.session_state.generation_job = None
+
+if "generation_error" not in st.session_state:
+    st.session_state.generation_error = ""
+
+# 先行評価（生成が終わった記事の評価をすぐにバックグラウンドで始める）
+if "prefetch_mode" not in st.session_state:
+    st.session_state.prefetch_mode = False
+
+if "prefetch_evaluation" not in st.session_state:
+    st.session_state.prefetch_evaluation = None
+
+# 設問ごとのグラフの種類（{"設問番号": "pie" / "bar"}、指定のない設問は自動）
+if "chart_kinds" not in st.session_state:
+    st.session_state.chart_kinds = {}
+
+
+def render_partial_article(placeholders, article_data):
+    """ストリーミング中の記事データを各プレースホルダーに描画"""
+    titles = [t for t in article_data.get("title_candidates", []) if isinstance(t, str) and t]
+    if titles:
+        placeholders["titles"].markdown(
+            "**📌 タイトル候補**\n\n" + "\n".join(f"{i}. {t}" for i, t in enumerate(titles, 1))
+        )
+    if article_data.get("lead"):
+        placeholders["lead"].markdown(f"**🎯 リード文**\n\n{article_data['lead']}")
+    if article_data.get("article_body"):
+        placeholders["body"].markdown(f"**📰 記事本文**\n\n{article_data['article_body']}")
+
+
+def generate_article_job(job, survey_data, stream_mode, bypass_cache):
+    """記事を生成する（バックグラウンドで実行）"""
+    started = time.perf_counter()
+    metrics = {}
+
+    # 似た自由回答は代表的な回答と件数にまとめて送る
+    survey_data = compact_survey(survey_data).text
+
+    # 大きなアンケートは設問ごとに自由回答を並列に要約し、縮約版から記事を生成する
+    if needs_map_reduce(survey_data):
+        def report_map(done, total):
+            job.check_cancelled()
+            job.report(map_done=done, map_total=total)
+
+        reduced = reduce_survey(survey_data, bypass_cache=bypass_cache, on_progress=report_map)
+        survey_data = reduced.text
+        metrics["map"] = time.perf_counter() - started
+        job.check_cancelled()
+    messages = build_writer_messages(survey_data)
+
+    if not stream_mode:
+        # OpenAI APIを呼び出し
+        result = complete_text(
+            model="gpt-4o-mini",
+            messages=messages,
+            temperature=0.7,
+            response_format={"type": "json_object"},
+            bypass_cache=bypass_cache
+        )
+        metrics["total"] = time.perf_counter() - started
+        return {"article_data": json.loads(result), "metrics": metrics}
+
+    parser = IncrementalJSONParser()
+    last_report = 0.0
+
+    # OpenAI APIをストリーミングで呼び出し
+    stream = stream_text(
+        model="gpt-4o-mini",
+        messages=messages,
+        temperature=0.7,
+        response_format={"type": "json_object"},
+        use_cache=True,
+        bypass_cache=bypass_cache
+    )
+    try:
+        for delta in stream:
+            job.check_cancelled()
+            now = time.perf_counter()
+            metrics.setdefault("ttft", now - started)
+            partial = parser.feed(delta)
+            if partial.get("title_candidates"):
+                metrics.setdefault("time_to_first_title", now - started)
+
+            # 報告回数を抑えるため0.1秒ごとに途中経過をコピーして渡す
+            if now - last_report >= 0.1:
+                job.report(partial=copy.deepcopy(partial))
+                last_report = now
+    finally:
+        # 中止・エラー時もHTTP接続を閉じて生成を打ち切る
+        stream.close()
+
+    metrics["total"] = time.perf_counter() - started
+    if not parser.done:
+        raise ValueError("記事データのJSONが途中で終了しました")
+    return {"article_data": parser.snapshot(), "metrics": metrics}
+
+
+def cancel_prefetch_evaluation():
+    """先行評価を中止する"""
+    if st.session_state.prefetch_evaluation:
+        get_job_runner().cancel(st.session_state.prefetch_evaluation["job"])
+        st.session_state.prefetch_evaluation = None
+
+
+def start_prefetch_evaluation():
+    """生成した記事の評価を評価ページの既定設定（並列評価・データ整合性とわかりやすさ・SEO基礎はローカル判定）で先に始める"""
+    cancel_prefetch_evaluation()
+    survey_data = st.session_state.survey_data
+    article = st.session_state.generated_article
+    title = st.session_state.article_data.get('title_candidates', [''])[0]
+    integrity_report = check_integrity(survey_data, article) if survey_data else None
+    analysis = analyze_article(title, article)
+    local_scores = dict(analysis.scores)
+    if integrity_report:
+        local_scores["data_integrity"] = integrity_report.score
+    job_id = get_job_runner().submit(
+        "prefetch",
+        evaluate_article,
+        "parallel",
+        survey_data,
+        title,
+        article,
+        local_scores=local_scores,
+        integrity=integrity_report.to_dict() if integrity_report else None,
+        analysis=analysis.to_dict(),
+        label="先行評価"
+    )
+    # 評価ページでは記事がこのキーと一致し、評価の設定も同じ場合だけ結果を使う
+    st.session_state.prefetch_evaluation = {
+        "key": evaluation_key(survey_data, title, article),
+        "settings": evaluation_settings("parallel", local_scores),
+        "job": job_id,
+    }
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def show_generation_progress():
+    """生成ジョブの進捗を表示し、完了したら結果を取り込む"""
+    runner = get_job_runner()
+    job = runner.get(st.session_state.generation_job)
+    if job is None:
+        st.session_state.generation_job = None
+        st.rerun()
+
+    if job.status == DONE:
+        # セッション状態に保存
+        st.session_state.article_data = job.result["article_data"]
+        st.session_state.generated_article = job.result["article_data"].get("article_body", "")
+        st.session_state.generation_metrics = job.result["metrics"]
+        st.session_state.generation_job = None
+        if st.session_state.prefetch_mode and st.session_state.generated_article:
+            start_prefetch_evaluation()
+        # フラグメントの再実行ではページ先頭の同期が走らないため、ここで保存する
+        save_session(st.session_state)
+        st.rerun()
+    if job.status in (FAILED, CANCELLED):
+        st.session_state.generation_error = job.error if job.status == FAILED else "生成を中止しました"
+        st.session_state.generation_job = None
+        st.rerun()
+
+    status = st.status(f"記事を生成中...（{job.elapsed:.0f}秒）", expanded=True)
+    if job.progress.get("map_total") and not job.progress.get("partial"):
+        status.markdown(
+            f"📦 アンケートを設問ごとに分けて自由回答を要約中...（{job.progress['map_done']}/{job.progress['map_total']}）"
+        )
+    placeholders = {
+        "titles": status.empty(),
+        "lead": status.empty(),
+        "body": status.empty(),
+    }
+    render_partial_article(placeholders, job.progress.get("partial", {}))
+    if st.button("⏹ 生成を中止", help="ページを移動しても生成は続きます。不要になった場合は中止してください"):
+        runner.cancel(job.id)
+
+
+# 先行評価の対象から記事・データが変わっていれば中止する
+if st.session_state.prefetch_evaluation and st.session_state.prefetch_evaluation["key"] != evaluation_key(
+    st.session_state.survey_data,
+    st.session_state.article_data.get('title_candidates', [''])[0],
+    st.session_state.generated_article
+):
+    cancel_prefetch_evaluation()
+
 
 # ヘッダー
 st.title("📝 記事生成")
@@ -126,7 +331,9 @@ A2: 「友達とのつながり」「情報収集」
 
     # 現在のデータ状態表示
     if st.session_state.survey_data:
-        st.info(f"📌 現在のデータ: {len(st.session_state.survey_data)}文字")
+        # パース結果は内容のハッシュでキャッシュされ、生成・評価・整合性チェックでも共有される
+        survey = parse_survey(st.session_state.survey_data)
+        st.info(f"📌 現在のデータ: {len(st.session_state.survey_data)}文字（{survey.describe()}）")
     else:
         st.warning("⚠️ アンケートデータが未設定です")
 
@@ -143,33 +350,66 @@ with right_col:
 
         st.markdown("---")
 
-        if st.button("🚀 記事を生成", type="primary", use_container_width=True):
-            with st.spinner("記事を生成中..."):
-                try:
-                    # OpenAI APIを呼び出し
-                    response = client.chat.completions.create(
-                        model="gpt-4o-mini",
-                        messages=[
-                            {"role": "system", "content": get_writer_prompt()},
-                            {"role": "user", "content": f"以下のアンケート結果から記事を作成してください。JSON形式で出力してください。\n\n{st.session_state.survey_data}"}
-                        ],
-                        temperature=0.7,
-                        response_format={"type": "json_object"}
-                    )
-
-                    # レスポンスをパース
-                    result = response.choices[0].message.content
-                    article_data = json.loads(result)
-
-                    # セッション状態に保存
-                    st.session_state.article_data = article_data
-                    st.session_state.generated_article = article_data.get("article_body", "")
-
-                    st.success("✅ 記事生成が完了しました！")
-                    st.rerun()
+        stream_mode = st.toggle(
+            "⚡ ストリーミング表示",
+            value=True,
+            help="生成中の記事を届いた順にタイトル案・リード文・本文の順で表示します"
+        )
+        bypass_cache = st.checkbox(
+            "🔁 キャッシュを使わずに生成",
+            value=False,
+            help="同じデータ・プロンプトの生成結果が保存されていても、新しく生成し直します"
+        )
+        st.session_state.prefetch_mode = st.toggle(
+            "🔮 生成後すぐに評価を始める（先行評価）",
+            value=st.session_state.prefetch_mode,
+            help="記事の生成が終わった時点でバックグラウンドで評価を始め、評価ページを開いたときに結果を表示します。"
+                 "評価ページを開く前に記事が変更された場合は自動で中止します"
+        )
 
-                except Exception as e:
-                    st.error(f"❌ エラーが発生しました: {str(e)}")
+        compact = compact_survey(st.session_state.survey_data)
+        if compact.changed:
+            st.caption(
+                f"🧹 似た自由回答をまとめて送信します（回答 {compact.answers:,}件 → {compact.quotes:,}行、"
+                f"約{compact.original_tokens:,} → {compact.compact_tokens:,}トークン）"
+            )
+        if needs_map_reduce(compact.text):
+            st.info(
+                f"📦 アンケートが大きいため（約{compact.compact_tokens:,}トークン）、"
+                "設問ごとに自由回答を並列で要約してから記事を生成します"
+            )
+
+        runner = get_job_runner()
+        generation_job = runner.get(st.session_state.generation_job)
+
+        if st.button(
+            "🚀 記事を生成",
+            type="primary",
+            use_container_width=True,
+            disabled=bool(generation_job and generation_job.active)
+        ):
+            cancel_prefetch_evaluation()
+            st.session_state.generation_job = runner.submit(
+                "generate",
+                generate_article_job,
+                st.session_state.survey_data,
+                stream_mode,
+                bypass_cache,
+                label="記事生成"
+            )
+            st.session_state.generation_error = ""
+            st.rerun()
+
+        if st.session_state.generation_job:
+            show_generation_progress()
+
+        if st.session_state.generation_error:
+            st.error(f"❌ エラーが発生しました: {st.session_state.generation_error}")
+
+        st.caption(
+            format_cache_stats(get_response_cache().stats())
+            + " ・ " + format_flight_stats(request_flights.stats())
+        )
 
 # 生成結果の表示
 if st.session_state.article_data:
@@ -178,6 +418,22 @@ if st.session_state.article_data:
 
     article_data = st.session_state.article_data
 
+    if st.session_state.prefetch_evaluation:
+        st.caption("🔮 評価をバックグラウンドで先行して実行しています。評価ページで結果を確認できます")
+
+    # 生成時間の表示
+    metrics = st.session_state.generation_metrics
+    if metrics:
+        metric_labels = [
+            ("map", "自由回答の要約"),
+            ("ttft", "最初のトークン"),
+            ("time_to_first_title", "最初のタイトル"),
+            ("total", "生成完了"),
+        ]
+        st.caption(" / ".join(
+            f"{label}: {metrics[key]:.1f}秒" for key, label in metric_labels if key in metrics
+        ))
+
     # タイトル候補
     if "title_candidates" in article_data:
         st.markdown("**📌 タイトル候補**")
@@ -204,6 +460,34 @@ if st.session_state.article_data:
             st.markdown(article_data["article_body"])
         st.markdown("---")
 
+    # グラフ（描画結果は内容のハッシュでキャッシュされ、再実行では描き直さない）
+    charts = build_charts(parse_survey(st.session_state.survey_data), st.session_state.chart_kinds)
+    if charts:
+        st.markdown("**📊 グラフ**")
+        kind_labels = {"auto": "自動", **CHART_KINDS}
+        for chart in charts:
+            chart_col, kind_col = st.columns([4, 1])
+            with kind_col:
+                current = st.session_state.chart_kinds.get(str(chart.question), "auto")
+                selected = st.selectbox(
+                    f"Q{chart.question}の種類",
+                    list(kind_labels),
+                    index=list(kind_labels).index(current),
+                    format_func=kind_labels.get,
+                    key=f"chart_kind_{chart.question}"
+                )
+                if selected != current:
+                    kinds = {k: v for k, v in st.session_state.chart_kinds.items() if k != str(chart.question)}
+                    if selected != "auto":
+                        kinds[str(chart.question)] = selected
+                    st.session_state.chart_kinds = kinds
+                    st.rerun()
+            with chart_col:
+                st.image(chart_svg(chart), caption=chart.caption)
+        cache_stats = get_chart_cache().stats()
+        st.caption(f"グラフの描画: {cache_stats['renders']}回 ・ キャッシュから {cache_stats['hits']}回（このプロセスの累計）")
+        st.markdown("---")
+
     # 構成
     if "structure" in article_data:
         st.markdown("**📋 記事構成**")
@@ -215,3 +499,6 @@ if st.session_state.article_data:
     st.success("✅ 記事草稿が生成されました！次は「記事評価」ページで品質をチェックしましょう。")
     if st.button("次へ：記事評価ページ →", type="primary", use_container_width=True):
         st.switch_page("pages/2_⭐_記事評価.py")
+
+# この実行で変わった値を保存（次の実行を待たずに、再読み込みや再起動の前に書き込む）
+save_session(st.session_state)
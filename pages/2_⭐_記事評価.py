@@ -2,12 +2,22 @@
 記事評価ページ - AI編集者評価機能
 生成された記事を8軸で評価し、改善提案を提示
 """
-import os
-import json
+import html
 import streamlit as st
-from openai import OpenAI
 from dotenv import load_dotenv
-from prompts import get_evaluator_prompt
+from session_store import sync_session, save_session, new_session_id
+from telemetry import set_page, start_metrics_server
+from llm_gateway import has_api_key, request_flights
+from response_cache import get_response_cache, format_cache_stats
+from single_flight import format_flight_stats
+from integrity import check_integrity
+from article_analyzer import analyze_article
+from lint_engine import lint_article, context_snippet
+from evaluation import (
+    SCORE_LABELS, EVAL_MODES, evaluate_article, evaluation_key, evaluation_settings, store_section_results
+)
+from edit_ops import is_applicable_proposal, apply_proposals
+from job_runner import get_job_runner, JOB_POLL_INTERVAL, DONE, FAILED, CANCELLED
 
 # 環境変数読み込み
 load_dotenv()
@@ -19,16 +29,19 @@ st.set_page_config(
     layout="wide"
 )
 
-# OpenAI クライアント初期化
-@st.cache_resource
-def get_openai_client():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        st.error("⚠️ OPENAI_API_KEYが設定されていません。.envファイルを確認してください。")
-        st.stop()
-    return OpenAI(api_key=api_key)
+# セッションの永続化（URLの ?sid= をキーに、再読み込みやサーバー再起動の後も作業内容を復元）
+if "sid" not in st.query_params:
+    st.query_params["sid"] = st.session_state.get("session_id") or new_session_id()
+sync_session(st.session_state, st.query_params["sid"])
+
+# LLM呼び出しの計測（ページ名を付けて記録し、/metrics を公開）
+set_page("evaluate")
+start_metrics_server()
 
-client = get_openai_client()
+# APIキー確認（クライアントはLLMゲートウェイで共有）
+if not has_api_key():
+    st.error("⚠️ OPENAI_API_KEYが設定されていません。.envファイルを確認してください。")
+    st.stop()
 
 
 # セッション状態の初期化
@@ -44,6 +57,99 @@ if "article_data" not in st.session_state:
 if "evaluation_result" not in st.session_state:
     st.session_state.evaluation_result = {}
 
+if "section_eval_cache" not in st.session_state:
+    st.session_state.section_eval_cache = {}
+
+# 実行中の評価ジョブ（スクリプトが再実行されても処理はバックグラウンドで続く）
+if "evaluation_job" not in st.session_state:
+    st.session_state.evaluation_job = None
+
+if "evaluation_error" not in st.session_state:
+    st.session_state.evaluation_error = ""
+
+if "prefetch_evaluation" not in st.session_state:
+    st.session_state.prefetch_evaluation = None
+
+# 改善提案ごとの反映状況 {提案番号: (状態, メッセージ)}
+if "proposal_status" not in st.session_state:
+    st.session_state.proposal_status = {}
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def show_evaluation_progress():
+    """評価ジョブの進捗を表示し、完了したら結果を取り込む"""
+    runner = get_job_runner()
+    job = runner.get(st.session_state.evaluation_job)
+    if job is None:
+        st.session_state.evaluation_job = None
+        st.rerun()
+
+    if job.status == DONE:
+        # セッション状態に保存
+        if job.kind == "prefetch":
+            job.result["prefetched"] = True
+        # 差分評価で新しく評価したセクションの結果はこのスレッドでキャッシュに取り込む
+        store_section_results(st.session_state.section_eval_cache, job.result)
+        st.session_state.evaluation_result = job.result
+        st.session_state.proposal_status = {}
+        st.session_state.evaluation_job = None
+        # フラグメントの再実行ではページ先頭の同期が走らないため、ここで保存する
+        save_session(st.session_state)
+        st.rerun()
+    if job.status in (FAILED, CANCELLED):
+        st.session_state.evaluation_error = job.error if job.status == FAILED else "評価を中止しました"
+        st.session_state.evaluation_job = None
+        st.rerun()
+
+    progress = job.progress
+    if progress.get("mode") == "incremental":
+        st.status(
+            f"変更されたセクションを評価中...（{progress.get('sections_done', 0)}/{progress.get('sections_total', '?')}）",
+            expanded=False
+        )
+    elif progress.get("mode") != "parallel":
+        st.status(f"AI編集者が評価中...（{job.elapsed:.0f}秒）", expanded=False)
+    else:
+        # 軸ごとのスコア枠を用意し、完了した軸から埋める
+        status = st.status(f"AI編集者が評価中...（{job.elapsed:.0f}秒）", expanded=True)
+        metric_cols = status.columns(2)
+        scores = progress.get("scores", {})
+        for i, (key, label) in enumerate(SCORE_LABELS.items()):
+            if key in scores:
+                value, elapsed = scores[key]
+                metric_cols[i % 2].metric(
+                    label, f"{value}/5", help="ローカル検査" if elapsed is None else f"{elapsed:.1f}秒"
+                )
+            else:
+                metric_cols[i % 2].metric(label, "評価中…")
+    if st.button("⏹ 評価を中止", help="ページを移動しても評価は続きます。不要になった場合は中止してください"):
+        runner.cancel(job.id)
+
+
+def apply_evaluation_proposals(indices):
+    """改善提案をLLMを使わずに記事へ反映する（改善ページの版管理にも記録）"""
+    proposals = st.session_state.evaluation_result.get("proposals", [])
+    targets = [proposals[i] for i in indices]
+    result = apply_proposals(st.session_state.generated_article, targets)
+
+    applied = {id(p) for p in result.applied}
+    failed = {id(p): reason for p, reason in result.failed}
+    for i, proposal in zip(indices, targets):
+        if id(proposal) in applied:
+            st.session_state.proposal_status[i] = ("applied", "")
+        else:
+            st.session_state.proposal_status[i] = ("failed", failed.get(id(proposal), ""))
+
+    if result.applied:
+        st.session_state.generated_article = result.article
+        st.session_state.current_article = result.article
+        if st.session_state.article_data:
+            st.session_state.article_data["article_body"] = result.article
+        if "article_store" in st.session_state:
+            st.session_state.article_store.commit(result.article, f"提案を反映（{len(result.applied)}件）")
+            st.session_state.article_store_source = result.article
+    st.rerun()
+
 
 # ヘッダー
 st.title("⭐ 記事評価")
@@ -123,6 +229,7 @@ if not st.session_state.generated_article:
                 st.warning("⚠️ 記事本文を入力してください")
 
     if not st.session_state.generated_article:
+        save_session(st.session_state)
         st.stop()
 
 # メインコンテンツを2カラムに分割
@@ -157,42 +264,165 @@ with left_col:
 with right_col:
     st.subheader("🔍 品質評価")
 
-    if st.button("🚀 記事を評価", type="primary", use_container_width=True):
-        with st.spinner("AI編集者が評価中..."):
-            try:
-                # 評価用のコンテキスト作成
-                context = f"""
-【アンケートデータ】
-{st.session_state.survey_data}
-
-【生成された記事】
-タイトル: {article_data.get('title_candidates', [''])[0]}
-{st.session_state.generated_article}
-"""
-
-                # OpenAI APIを呼び出し
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": get_evaluator_prompt()},
-                        {"role": "user", "content": f"以下の記事を評価してください。JSON形式で出力してください。\n\n{context}"}
-                    ],
-                    temperature=0.3,
-                    response_format={"type": "json_object"}
-                )
-
-                # レスポンスをパース
-                result = response.choices[0].message.content
-                evaluation_result = json.loads(result)
+    # データ整合性のローカル検査（数ミリ秒で完了するため毎回実行）
+    integrity_report = None
+    if st.session_state.survey_data:
+        local_integrity = st.toggle(
+            "🔢 データ整合性をローカルで検査",
+            value=True,
+            help="記事中の数値をアンケートデータと機械的に照合します。オンの場合、LLMにはアンケートデータを送らず、残りの軸だけを評価させます"
+        )
+        if local_integrity:
+            integrity_report = check_integrity(
+                st.session_state.survey_data,
+                st.session_state.generated_article
+            )
+            with st.expander(
+                f"🔢 データ整合性（ローカル検査）: {integrity_report.score}/5"
+                f" ・ 不一致 {len(integrity_report.mismatches)}件"
+                f" ・ 未確認 {len(integrity_report.unverified)}件",
+                expanded=bool(integrity_report.mismatches)
+            ):
+                if not integrity_report.findings:
+                    st.caption("記事中に照合できる数値が見つかりませんでした")
+                for finding in integrity_report.findings:
+                    if finding.status == "mismatch":
+                        st.error(f"「{finding.text}」: {finding.message}")
+                    elif finding.status == "unverified":
+                        st.warning(f"「{finding.text}」: {finding.message}")
+                    else:
+                        st.caption(f"✅「{finding.text}」: {finding.message}")
+
+    # わかりやすさ・SEO基礎のローカル判定（記事の構造から機械的に判定するため毎回実行）
+    analysis = None
+    local_analysis = st.toggle(
+        "📐 わかりやすさ・SEO基礎をローカルで判定",
+        value=True,
+        help="文・段落の長さ、漢字の割合、タイトルの長さ、見出しの階層から機械的に判定します。オンの場合、LLMには残りの軸だけを評価させます"
+    )
+    if local_analysis:
+        analysis = analyze_article(
+            article_data.get('title_candidates', [''])[0],
+            st.session_state.generated_article
+        )
+        metrics = analysis.metrics
+        with st.expander(
+            f"📐 わかりやすさ {analysis.readability}/5 ・ SEO基礎 {analysis.seo_basics}/5（ローカル判定）",
+            expanded=min(analysis.scores.values()) < 4
+        ):
+            st.caption(
+                f"文 {metrics['sentences']}件（平均 {metrics.get('sentence_mean', 0)}字・最長 {metrics.get('sentence_max', 0)}字）"
+                f" ・ 段落 {metrics['paragraphs']}件（平均 {metrics['paragraph_mean']}字）"
+                f" ・ 漢字 {metrics.get('kanji_ratio', 0):.0%}"
+                f" ・ タイトル {metrics['title_length']}字 ・ 見出し {metrics['headings']}件"
+            )
+            if not analysis.findings:
+                st.caption("✅ 指摘はありません")
+            for finding in analysis.findings:
+                label = SCORE_LABELS.get(finding.axis, finding.axis)
+                excerpt = f"「{finding.text}」: " if finding.text else ""
+                st.warning(f"[{label}] {excerpt}{finding.message}")
+
+    # 禁止表現のローカル校正（LLMを待たずに即時表示）
+    lint_matches = lint_article(st.session_state.generated_article)
+    with st.expander(
+        f"📝 表現チェック（ローカル）: {len(lint_matches)}件",
+        expanded=bool(lint_matches)
+    ):
+        if not lint_matches:
+            st.caption("大人語・広告調・SNS口調・感情表現は見つかりませんでした")
+        for match in lint_matches:
+            suggestion = f"→「{html.escape(match.suggestion)}」" if match.suggestion else "→ 削除を検討"
+            # 抜粋は記事の原文のため、HTMLとして解釈されないようエスケープする
+            st.markdown(
+                f"**[{html.escape(match.category)}]** 「{html.escape(match.text)}」{suggestion}  \n"
+                f"{html.escape(context_snippet(st.session_state.generated_article, match))}  \n"
+                f"<small>{html.escape(match.message)}</small>",
+                unsafe_allow_html=True
+            )
+
+    bypass_cache = st.checkbox(
+        "🔁 キャッシュを使わずに評価",
+        value=False,
+        help="同じ記事・データの評価結果が保存されていても、新しく評価し直します"
+    )
+
+    eval_mode = st.radio(
+        "評価モード",
+        list(EVAL_MODES),
+        format_func=EVAL_MODES.get,
+        horizontal=True,
+        help="並列評価：評価軸をグループに分けて同時に評価し、終わった軸から順に表示します\n\n"
+             "変更箇所だけ再評価：見出し単位のセクションごとに評価結果を保存し、編集されたセクションだけを評価し直します"
+    )
+
+    runner = get_job_runner()
+    local_axes = list(analysis.scores) if analysis else []
+    if integrity_report:
+        local_axes.append("data_integrity")
+
+    # 記事生成ページで始めた先行評価を引き継ぐ（記事か評価の設定が先行評価と異なれば中止）
+    prefetch = st.session_state.prefetch_evaluation
+    if prefetch:
+        current_key = evaluation_key(
+            st.session_state.survey_data,
+            article_data.get('title_candidates', [''])[0],
+            st.session_state.generated_article
+        )
+        matches = (prefetch["key"] == current_key
+                   and prefetch["settings"] == evaluation_settings(eval_mode, local_axes, bypass_cache))
+        adopted = st.session_state.evaluation_job == prefetch["job"]
+        if matches and (adopted or not st.session_state.evaluation_job):
+            # 以降の進捗表示と結果の取り込みは通常の評価と同じ（設定が変わった場合に備えて完了まで記録を残す）
+            st.session_state.evaluation_job = prefetch["job"]
+            prefetch_job = runner.get(prefetch["job"])
+            if not (prefetch_job and prefetch_job.active):
+                st.session_state.prefetch_evaluation = None
+        else:
+            runner.cancel(prefetch["job"])
+            if adopted:
+                st.session_state.evaluation_job = None
+                st.caption("評価の設定が変わったため、記事生成後に始めた先行評価を中止しました")
+            st.session_state.prefetch_evaluation = None
+
+    evaluation_job = runner.get(st.session_state.evaluation_job)
+
+    if st.button(
+        "🚀 記事を評価",
+        type="primary",
+        use_container_width=True,
+        disabled=bool(evaluation_job and evaluation_job.active)
+    ):
+        local_scores = dict(analysis.scores) if analysis else {}
+        if integrity_report:
+            local_scores["data_integrity"] = integrity_report.score
+        st.session_state.evaluation_job = runner.submit(
+            "evaluate",
+            evaluate_article,
+            eval_mode,
+            st.session_state.survey_data,
+            article_data.get('title_candidates', [''])[0],
+            st.session_state.generated_article,
+            dict(st.session_state.section_eval_cache),
+            local_scores,
+            integrity_report.to_dict() if integrity_report else None,
+            bypass_cache=bypass_cache,
+            analysis=analysis.to_dict() if analysis else None,
+            label="記事評価"
+        )
+        st.session_state.evaluation_error = ""
+        st.rerun()
 
-                # セッション状態に保存
-                st.session_state.evaluation_result = evaluation_result
+    if st.session_state.evaluation_job:
+        show_evaluation_progress()
 
-                st.success("✅ 評価が完了しました！")
-                st.rerun()
+    if st.session_state.evaluation_error:
+        st.error(f"❌ エラーが発生しました: {st.session_state.evaluation_error}")
 
-            except Exception as e:
-                st.error(f"❌ エラーが発生しました: {str(e)}")
+    st.caption(
+        format_cache_stats(get_response_cache().stats())
+        + " ・ " + format_flight_stats(request_flights.stats())
+    )
 
 # 評価結果の表示
 if st.session_state.evaluation_result:
@@ -201,21 +431,23 @@ if st.session_state.evaluation_result:
 
     evaluation = st.session_state.evaluation_result
 
+    if evaluation.get("prefetched"):
+        st.caption("🔮 記事生成の直後に先行して評価した結果です")
+    if "timings" in evaluation:
+        st.caption(f"⏱ 評価にかかった時間: {evaluation['timings']['wall_time']:.1f}秒")
+    if "incremental" in evaluation:
+        incremental = evaluation["incremental"]
+        st.caption(
+            f"🧩 {incremental['sections']}ブロック中 {incremental['rescored']}ブロックを再評価"
+            f"（{incremental['reused']}ブロックは前回の結果を再利用）"
+        )
+
     # スコア表示
     if "scores" in evaluation:
         st.markdown("### 📈 8軸スコア")
 
         scores = evaluation["scores"]
-        score_labels = {
-            "naturalness_teen": "10代自然さ",
-            "readability": "わかりやすさ",
-            "structure": "記事構成",
-            "bias_assertion": "偏り・断定",
-            "ethics_safety": "倫理・配慮",
-            "seo_basics": "SEO基礎",
-            "brand_fit": "ブランド整合",
-            "data_integrity": "データ整合性"
-        }
+        score_labels = SCORE_LABELS
 
         # スコアを2列で表示
         score_col1, score_col2 = st.columns(2)
@@ -266,6 +498,23 @@ if st.session_state.evaluation_result:
     if "proposals" in evaluation and evaluation["proposals"]:
         st.markdown("### 💡 具体的な改善提案")
 
+        proposal_status = st.session_state.proposal_status
+        pending = [
+            i for i, proposal in enumerate(evaluation["proposals"])
+            if is_applicable_proposal(proposal) and proposal_status.get(i, ("",))[0] != "applied"
+        ]
+        if st.button(
+            f"⚡ すべての提案を記事に反映（{len(pending)}件）",
+            disabled=not pending,
+            help="修正前の表現を記事中から探して修正後に置き換えます。AIへの再問い合わせは行いません"
+        ):
+            apply_evaluation_proposals(pending)
+
+        if proposal_status:
+            applied_count = sum(1 for state, _ in proposal_status.values() if state == "applied")
+            failed_count = sum(1 for state, _ in proposal_status.values() if state == "failed")
+            st.caption(f"✅ 反映済み {applied_count}件 ・ ⚠️ 反映できなかった提案 {failed_count}件")
+
         for i, proposal in enumerate(evaluation["proposals"], 1):
             with st.expander(f"提案 {i}: {proposal.get('category', '改善案')}", expanded=True):
                 if "before" in proposal and "after" in proposal:
@@ -273,6 +522,15 @@ if st.session_state.evaluation_result:
                     st.markdown(f"**修正後:** {proposal['after']}")
                     if "reason" in proposal:
                         st.info(f"💡 理由: {proposal['reason']}")
+
+                    state, message = proposal_status.get(i - 1, ("", ""))
+                    if state == "applied":
+                        st.success("✅ 記事に反映しました")
+                    elif is_applicable_proposal(proposal):
+                        if state == "failed":
+                            st.warning(f"⚠️ 反映できませんでした: {message}")
+                        if st.button("✅ この提案を反映", key=f"apply_proposal_{i}"):
+                            apply_evaluation_proposals([i - 1])
                 elif "issue" in proposal:
                     st.markdown(f"**問題点:** {proposal['issue']}")
                     if "suggestion" in proposal:
@@ -283,3 +541,6 @@ if st.session_state.evaluation_result:
     st.success("✅ 評価が完了しました！次は「記事改善」ページで対話しながら記事をブラッシュアップしましょう。")
     if st.button("次へ：記事改善ページ →", type="primary", use_container_width=True):
         st.switch_page("pages/3_✏️_記事改善.py")
+
+# この実行で変わった値を保存（次の実行を待たずに、再読み込みや再起動の前に書き込む）
+save_session(st.session_state)
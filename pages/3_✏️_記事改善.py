@@ -2,11 +2,23 @@
 記事改善ページ - 編集者チャット機能
 対話形式で記事をブラッシュアップ
 """
-import os
+import time
 import streamlit as st
-from openai import OpenAI
 from dotenv import load_dotenv
-from prompts import get_system_prompt
+from session_store import sync_session, save_session, new_session_id, get_session_store
+from telemetry import set_page, start_metrics_server
+from prompts import get_system_prompt, get_edit_ops_prompt
+from llm_gateway import stream_text, has_api_key
+from chat_context import ChatContextManager
+from survey_compact import compact_survey
+from survey_parser import parse_survey
+from chart_engine import build_charts, insert_charts, bundle_zip, chart_path, png_available
+from json_stream import IncrementalJSONParser
+from edit_ops import parse_edit_response, apply_operations, describe_operation
+from article_store import ArticleStore
+from job_runner import get_job_runner, JOB_POLL_INTERVAL, DONE, FAILED, CANCELLED
+from evaluation import evaluation_key
+from diff_engine import diff_text, diff_stats, render_diff_html
 
 # 環境変数読み込み
 load_dotenv()
@@ -18,16 +30,19 @@ st.set_page_config(
     layout="wide"
 )
 
-# OpenAI クライアント初期化
-@st.cache_resource
-def get_openai_client():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        st.error("⚠️ OPENAI_API_KEYが設定されていません。.envファイルを確認してください。")
-        st.stop()
-    return OpenAI(api_key=api_key)
+# セッションの永続化（URLの ?sid= をキーに、再読み込みやサーバー再起動の後も作業内容を復元）
+if "sid" not in st.query_params:
+    st.query_params["sid"] = st.session_state.get("session_id") or new_session_id()
+sync_session(st.session_state, st.query_params["sid"])
+
+# LLM呼び出しの計測（ページ名を付けて記録し、/metrics を公開）
+set_page("improve")
+start_metrics_server()
 
-client = get_openai_client()
+# APIキー確認（クライアントはLLMゲートウェイで共有）
+if not has_api_key():
+    st.error("⚠️ OPENAI_API_KEYが設定されていません。.envファイルを確認してください。")
+    st.stop()
 
 
 # セッション状態の初期化
@@ -49,6 +64,146 @@ if "improvement_messages" not in st.session_state:
 if "current_article" not in st.session_state:
     st.session_state.current_article = st.session_state.generated_article
 
+if "context_stats" not in st.session_state:
+    st.session_state.context_stats = None
+
+if "chart_kinds" not in st.session_state:
+    st.session_state.chart_kinds = {}
+
+# 実行中の返答ジョブ（スクリプトが再実行されても処理はバックグラウンドで続く）
+if "chat_job" not in st.session_state:
+    st.session_state.chat_job = None
+
+if "chat_error" not in st.session_state:
+    st.session_state.chat_error = ""
+
+# 先行評価の対象から記事が変わっていれば中止する
+if st.session_state.get("prefetch_evaluation"):
+    prefetch = st.session_state.prefetch_evaluation
+    if prefetch["key"] != evaluation_key(
+        st.session_state.survey_data,
+        st.session_state.article_data.get('title_candidates', [''])[0],
+        st.session_state.generated_article
+    ):
+        get_job_runner().cancel(prefetch["job"])
+        st.session_state.prefetch_evaluation = None
+
+# 記事の版管理（他のページや直接編集による変更も版として記録する）
+if "article_store" not in st.session_state:
+    st.session_state.article_store = ArticleStore(st.session_state.generated_article)
+    st.session_state.article_store_source = st.session_state.generated_article
+
+article_store = st.session_state.article_store
+if st.session_state.article_store_source != st.session_state.generated_article:
+    article_store.commit(st.session_state.generated_article, "記事の差し替え")
+    st.session_state.article_store_source = st.session_state.generated_article
+    st.session_state.current_article = article_store.text
+if st.session_state.current_article != article_store.text:
+    article_store.commit(st.session_state.current_article, "記事の更新")
+
+
+def chat_reply_job(job, messages, edit_mode):
+    """AI編集者の返答をストリーミングで受け取る（バックグラウンドで実行）"""
+    full_response = ""
+    parser = IncrementalJSONParser()
+
+    stream = stream_text(
+        model="gpt-4o-mini",
+        messages=messages,
+        temperature=0.7,
+        response_format={"type": "json_object"} if edit_mode else None
+    )
+    try:
+        for delta in stream:
+            job.check_cancelled()
+            full_response += delta
+            if edit_mode:
+                partial = parser.feed(delta)
+                job.report(
+                    text=full_response,
+                    message=partial.get("message", ""),
+                    operations=len(partial.get("operations", []))
+                )
+            else:
+                job.report(text=full_response, message=full_response)
+    finally:
+        # 中止・エラー時もHTTP接続を閉じて生成を打ち切る
+        stream.close()
+    return {"response": full_response, "edit_mode": edit_mode}
+
+
+def finish_chat_reply(job):
+    """完了した返答を履歴に追加し、編集操作を現在の記事に反映する"""
+    full_response = job.result["response"]
+    if job.result["edit_mode"]:
+        # 編集操作を検証して現在の記事に反映
+        edit_message, operations = parse_edit_response(full_response)
+        result = apply_operations(st.session_state.current_article, operations)
+        if result.applied:
+            article_store.commit(result.article, job.label)
+            st.session_state.current_article = article_store.text
+
+        lines = [edit_message]
+        if result.applied:
+            lines.append("\n**✅ 記事に反映した変更:**")
+            lines.extend(f"- {describe_operation(op)}" for op in result.applied)
+        if result.failed:
+            lines.append("\n**⚠️ 反映できなかった変更:**")
+            lines.extend(f"- {describe_operation(op)}（{reason}）" for op, reason in result.failed)
+        full_response = "\n".join(lines)
+
+    # アシスタントメッセージを履歴に追加
+    st.session_state.improvement_messages.append({
+        "role": "assistant",
+        "content": full_response
+    })
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def show_chat_progress():
+    """返答ジョブの進捗を表示し、完了したら結果を取り込む"""
+    runner = get_job_runner()
+    job = runner.get(st.session_state.chat_job)
+    if job is None:
+        st.session_state.chat_job = None
+        st.rerun()
+
+    if job.status == DONE:
+        try:
+            finish_chat_reply(job)
+        except Exception as e:
+            st.session_state.chat_error = str(e)
+        st.session_state.chat_job = None
+        # フラグメントの再実行ではページ先頭の同期が走らないため、ここで保存する
+        save_session(st.session_state)
+        st.rerun()
+    if job.status == FAILED:
+        st.session_state.chat_error = job.error
+        st.session_state.chat_job = None
+        st.rerun()
+    if job.status == CANCELLED:
+        # 途中まで受け取った返答を残す
+        partial_text = job.progress.get("message", "")
+        if partial_text:
+            st.session_state.improvement_messages.append({
+                "role": "assistant",
+                "content": partial_text + "\n\n*（生成を停止しました）*"
+            })
+        st.session_state.chat_job = None
+        save_session(st.session_state)
+        st.rerun()
+
+    with st.chat_message("assistant"):
+        progress = job.progress
+        if not progress.get("text"):
+            st.markdown("💭 考え中...")
+        elif "operations" in progress:
+            st.markdown(f"{progress['message']}▌\n\n*（編集操作 {progress['operations']}件を受信中）*")
+        else:
+            st.markdown(progress["message"] + "▌")
+        if st.button("⏹ 生成を停止", key="stop_streaming"):
+            runner.cancel(job.id)
+
 
 # ヘッダー
 st.title("✏️ 記事改善")
@@ -119,6 +274,7 @@ if not st.session_state.generated_article:
                 st.warning("⚠️ 記事本文を入力してください")
 
     if not st.session_state.generated_article:
+        save_session(st.session_state)
         st.stop()
 
 # サイドバー：現在の記事と評価結果
@@ -136,6 +292,43 @@ with st.sidebar:
     with st.expander("全文を表示", expanded=False):
         st.markdown(st.session_state.current_article)
 
+    # 版の管理
+    st.subheader("🕘 版の管理")
+    undo_col, redo_col = st.columns(2)
+    with undo_col:
+        if st.button("↩️ 元に戻す", disabled=not article_store.can_undo(), use_container_width=True):
+            st.session_state.current_article = article_store.undo()
+            st.rerun()
+    with redo_col:
+        if st.button("↪️ やり直す", disabled=not article_store.can_redo(), use_container_width=True):
+            st.session_state.current_article = article_store.redo()
+            st.rerun()
+
+    if len(article_store.versions) > 1:
+        selected_version = st.selectbox(
+            "版を選択",
+            [v.id for v in reversed(article_store.versions)],
+            index=len(article_store.versions) - 1 - article_store.current_id,
+            format_func=lambda vid: (
+                f"v{vid} {article_store.versions[vid].label}"
+                + ("（表示中）" if vid == article_store.current_id else "")
+            )
+        )
+        if st.button(
+            "📌 この版に移動",
+            disabled=selected_version == article_store.current_id,
+            help="過去の版に移動してから編集すると、別案として枝分かれします",
+            use_container_width=True
+        ):
+            st.session_state.current_article = article_store.jump(selected_version)
+            st.rerun()
+
+    usage = article_store.memory_usage()
+    st.caption(
+        f"💾 {usage['versions']}版を約{usage['approx_bytes'] / 1024:.0f}KBで保持"
+        f"（全文コピーなら約{usage['full_copy_chars'] * 2 / 1024:.0f}KB）"
+    )
+
     st.markdown("---")
 
     # 評価結果のサマリー
@@ -158,7 +351,10 @@ with st.sidebar:
     # チャットリセット
     if st.button("🔄 チャットをリセット", use_container_width=True):
         st.session_state.improvement_messages = []
-        st.session_state.current_article = st.session_state.generated_article
+        get_session_store().clear_chat_archive(st.session_state.session_id)
+        st.session_state.archived_message_count = 0
+        article_store.commit(st.session_state.generated_article, "リセット")
+        st.session_state.current_article = article_store.text
         st.rerun()
 
     # 記事を編集
@@ -170,9 +366,15 @@ with st.sidebar:
     st.markdown("---")
     st.subheader("💾 記事を保存")
 
-    download_content = f"""# {st.session_state.article_data.get('title_candidates', ['記事タイトル'])[0]}
+    # グラフは記事中で各設問の結果を引用した段落の後に挿入する（描画結果はキャッシュを再利用）
+    charts = build_charts(parse_survey(st.session_state.survey_data), st.session_state.chart_kinds)
 
-{st.session_state.current_article}
+    def export_markdown(**chart_options):
+        article = insert_charts(st.session_state.current_article, charts, **chart_options) if charts \
+            else st.session_state.current_article
+        return f"""# {st.session_state.article_data.get('title_candidates', ['記事タイトル'])[0]}
+
+{article}
 
 ---
 生成日: {st.session_state.get('generation_date', 'N/A')}
@@ -180,17 +382,58 @@ YAE (Young AI Editor) で生成
 """
 
     st.download_button(
-        label="📥 Markdown形式でダウンロード",
-        data=download_content,
+        label="📥 Markdown形式でダウンロード" + ("（グラフ埋め込み）" if charts else ""),
+        data=export_markdown(),
         file_name="article.md",
         mime="text/markdown",
         use_container_width=True
     )
 
+    if charts:
+        st.download_button(
+            label="🗂️ 記事とグラフ画像をまとめてダウンロード（ZIP）",
+            data=bundle_zip(export_markdown(image_ref=chart_path), charts),
+            file_name="article_with_charts.zip",
+            mime="application/zip",
+            use_container_width=True,
+            help="WordPressのメディアにアップロードできるSVG" + ("・PNG" if png_available() else "") + "の画像を同梱します"
+        )
+
+
+# メインエリア：変更箇所のハイライト
+if article_store.can_undo():
+    with st.expander("🔍 変更箇所を表示", expanded=False):
+        compare_target = st.radio(
+            "比較対象",
+            ["直前の版", "初版"],
+            horizontal=True,
+            help="現在の版との差分を、追加は緑・削除は赤で表示します"
+        )
+        base_id = article_store.current.parent if compare_target == "直前の版" else 0
+        diff_start = time.perf_counter()
+        diff_ops = diff_text(article_store.text_of(base_id), article_store.text)
+        diff_ms = (time.perf_counter() - diff_start) * 1000
+        counts = diff_stats(diff_ops)
+        st.caption(
+            f"v{base_id} {article_store.versions[base_id].label} → 現在の版: "
+            f"+{counts['inserted']:,}文字 / -{counts['deleted']:,}文字（差分計算 {diff_ms:.1f}ms）"
+        )
+        if counts["inserted"] or counts["deleted"]:
+            st.markdown(render_diff_html(diff_ops), unsafe_allow_html=True)
+        else:
+            st.info("変更はありません")
 
 # メインエリア：チャット画面
 st.subheader("💬 AI編集者とチャット")
 
+if st.session_state.context_stats:
+    stats = st.session_state.context_stats
+    st.caption(
+        f"📏 直近のプロンプト: 約{stats.prompt_tokens:,}トークン"
+        f"（共通部分 {stats.prefix_tokens:,} ・ 直近の会話 {stats.recent_messages}件"
+        f" ・ 要約した会話 {stats.summarized_messages}件）"
+    )
+
 # 初回メッセージ
 if len(st.session_state.improvement_messages) == 0:
     with st.chat_message("assistant"):
@@ -216,84 +459,60 @@ if len(st.session_state.improvement_messages) == 0:
 """
         st.markdown(initial_message)
 
+# メモリの上限を超えてディスクへ退避した古い会話
+if st.session_state.get("archived_message_count"):
+    with st.expander(f"🗄 以前の会話 {st.session_state.archived_message_count}件（ディスクに退避済み）"):
+        for message in get_session_store().archived_messages(st.session_state.session_id):
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
+
 # チャット履歴の表示
 for message in st.session_state.improvement_messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
-# ユーザー入力
-if prompt := st.chat_input("改善の指示を入力（例: タイトルをもっとキャッチーにして）"):
-
-    # ユーザーメッセージを追加
-    st.session_state.improvement_messages.append({"role": "user", "content": prompt})
-
-    with st.chat_message("user"):
-        st.markdown(prompt)
-
-    # AI編集者のレスポンス生成
-    with st.chat_message("assistant"):
-        message_placeholder = st.empty()
-
-        # コンテキスト作成
-        context_message = f"""
-【参考情報】
-
-アンケートデータ:
-{st.session_state.survey_data}
+# 編集モード：記事全文ではなく変更箇所だけを受け取り、手元で記事に反映する
+edit_mode = st.toggle(
+    "🛠 編集モード（変更箇所だけを記事に反映）",
+    value=True,
+    help="オンの場合、AI編集者は修正箇所だけを編集操作として返し、現在の記事に自動で反映します。"
+         "オフの場合は通常のチャットで提案・相談を行います"
+)
 
-現在の記事:
-{st.session_state.current_article}
+runner = get_job_runner()
+chat_job = runner.get(st.session_state.chat_job)
 
-評価結果:
-{st.session_state.evaluation_result.get('summary', {})}
-"""
+# 生成中の返答（ページを移動しても生成はバックグラウンドで続く）
+if st.session_state.chat_job:
+    show_chat_progress()
 
-        # OpenAI APIを呼び出し
-        try:
-            # メッセージ構築
-            messages = [
-                {"role": "system", "content": get_system_prompt()}
-            ]
-
-            # 最初のメッセージにコンテキストを追加
-            if len(st.session_state.improvement_messages) == 1:
-                messages.append({
-                    "role": "user",
-                    "content": context_message + "\n\n" + prompt
-                })
-            else:
-                # チャット履歴を追加
-                for msg in st.session_state.improvement_messages:
-                    messages.append({
-                        "role": msg["role"],
-                        "content": msg["content"]
-                    })
-
-            # レスポンス取得
-            message_placeholder.markdown("💭 考え中...")
-
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                temperature=0.7,
-                stream=False
-            )
+if st.session_state.chat_error:
+    st.error(f"❌ エラーが発生しました: {st.session_state.chat_error}")
 
-            full_response = response.choices[0].message.content
-            message_placeholder.markdown(full_response)
+# ユーザー入力
+if prompt := st.chat_input(
+    "改善の指示を入力（例: タイトルをもっとキャッチーにして）",
+    disabled=bool(chat_job and chat_job.active)
+):
 
-            # アシスタントメッセージを履歴に追加
-            st.session_state.improvement_messages.append({
-                "role": "assistant",
-                "content": full_response
-            })
+    # ユーザーメッセージを追加
+    st.session_state.improvement_messages.append({"role": "user", "content": prompt})
 
-            # 記事が更新された場合は current_article を更新
-            # (実際には、AIの回答から記事部分を抽出する必要がありますが、
-            #  ここでは簡易的に全レスポンスを記録)
+    # メッセージ構築：前置き（プロンプト・アンケート・最新記事）は毎ターン同じ位置に置き、
+    # 会話履歴はトークン予算内に収まるよう古いものから要約する
+    context_manager = ChatContextManager(get_edit_ops_prompt() if edit_mode else get_system_prompt())
+    messages, context_stats = context_manager.build(
+        compact_survey(st.session_state.survey_data).text,
+        st.session_state.current_article,
+        st.session_state.evaluation_result.get('summary', {}),
+        st.session_state.improvement_messages[:-1],
+        prompt
+    )
+    st.session_state.context_stats = context_stats
 
-        except Exception as e:
-            st.error(f"❌ エラーが発生しました: {str(e)}")
+    st.session_state.chat_job = runner.submit("chat", chat_reply_job, messages, edit_mode, label=prompt[:20])
+    st.session_state.chat_error = ""
+    st.rerun()
 
 
 # フッター情報
@@ -304,3 +523,6 @@ st.info("""
 - 「見出しを変えて」ではなく「見出しをもっとわかりやすく、10代に刺さる表現にして」
 - 修正後の記事は左サイドバーからダウンロードできます
 """)
+
+# この実行で変わった値を保存（次の実行を待たずに、再読み込みや再起動の前に書き込む）
+save_session(st.session_state)
@@ -0,0 +1,194 @@
+"""
+運用ダッシュボードページ - LLM呼び出しの計測結果
+レイテンシ（p50/p95）とトークン数の推移、ページ・モデル別の内訳、推定料金を表示
+"""
+import time
+from datetime import datetime
+import streamlit as st
+from dotenv import load_dotenv
+from session_store import sync_session, new_session_id
+from telemetry import (
+    PAGE_LABELS, set_page, start_metrics_server, get_telemetry, load_log_records,
+    summarize_calls, bucket_calls,
+)
+
+# 環境変数読み込み
+load_dotenv()
+
+# ページ設定
+st.set_page_config(
+    page_title="運用ダッシュボード - YAE",
+    page_icon="📈",
+    layout="wide"
+)
+
+# セッションの永続化（URLの ?sid= をキーに、再読み込みやサーバー再起動の後も作業内容を復元）
+if "sid" not in st.query_params:
+    st.query_params["sid"] = st.session_state.get("session_id") or new_session_id()
+sync_session(st.session_state, st.query_params["sid"])
+
+# LLM呼び出しの計測（ページ名を付けて記録し、/metrics を公開）
+set_page("dashboard")
+metrics_url = start_metrics_server()
+
+# 集計期間: (表示名, 秒, グラフの区切り秒)
+PERIODS = {
+    "15m": ("直近15分", 15 * 60, 30),
+    "1h": ("直近1時間", 60 * 60, 60),
+    "6h": ("直近6時間", 6 * 60 * 60, 5 * 60),
+    "24h": ("直近24時間", 24 * 60 * 60, 15 * 60),
+    "7d": ("直近7日", 7 * 24 * 60 * 60, 60 * 60),
+}
+SOURCES = {
+    "log": "📄 ログファイル（全プロセス）",
+    "memory": "🧠 このプロセスのメモリ",
+}
+STATUS_LABELS = {
+    "ok": "成功",
+    "error": "エラー",
+    "cache_hit": "キャッシュ",
+    "coalesced": "合流",
+    "cancelled": "中止",
+}
+
+
+def load_records(source: str, since: float) -> list:
+    if source == "memory":
+        return [r for r in get_telemetry().recent() if r["started"] >= since]
+    return load_log_records(since)
+
+
+def summary_row(name: str, records: list) -> dict:
+    """内訳表の1行"""
+    summary = summarize_calls(records)
+    return {
+        "対象": name,
+        "呼び出し": summary["calls"],
+        "p50 (秒)": round(summary["p50"], 2),
+        "p95 (秒)": round(summary["p95"], 2),
+        "初回トークン p50 (秒)": round(summary["ttft_p50"], 2),
+        "エラー": summary["errors"],
+        "リトライ": summary["retries"],
+        "キャッシュ": summary["cache_hits"],
+        "合流": summary["coalesced"],
+        "入力トークン": summary["prompt_tokens"],
+        "出力トークン": summary["completion_tokens"],
+        "推定料金 ($)": round(summary["cost"], 4),
+    }
+
+
+# ヘッダー
+st.title("📈 運用ダッシュボード")
+st.caption("LLM呼び出しのレイテンシ・トークン数・エラーをページとモデル別に集計します")
+if metrics_url:
+    st.caption(f"Prometheus: `{metrics_url}`")
+
+col1, col2, col3 = st.columns([2, 2, 1])
+with col1:
+    period = st.selectbox("期間", list(PERIODS), index=1, format_func=lambda key: PERIODS[key][0])
+with col2:
+    source = st.radio("データ", list(SOURCES), format_func=SOURCES.get, horizontal=True)
+with col3:
+    auto_refresh = st.toggle("自動更新", value=False)
+
+st.markdown("---")
+
+
+@st.fragment(run_every=5 if auto_refresh else None)
+def show_dashboard():
+    """集計結果を表示（自動更新時はこの部分だけを定期的に再実行）"""
+    _, seconds, bucket_seconds = PERIODS[period]
+    records = load_records(source, time.time() - seconds)
+    if not records:
+        st.info("この期間のLLM呼び出しはまだありません")
+        return
+
+    pages = sorted({r["page"] for r in records})
+    models = sorted({r["model"] for r in records})
+    col1, col2 = st.columns(2)
+    with col1:
+        selected_pages = st.multiselect("ページ", pages, default=pages,
+                                        format_func=lambda page: PAGE_LABELS.get(page, page))
+    with col2:
+        selected_models = st.multiselect("モデル", models, default=models)
+    records = [r for r in records if r["page"] in selected_pages and r["model"] in selected_models]
+    if not records:
+        st.info("条件に合う呼び出しがありません")
+        return
+
+    summary = summarize_calls(records)
+    col1, col2, col3, col4, col5, col6 = st.columns(6)
+    col1.metric("呼び出し", summary["calls"])
+    col2.metric("p50", f"{summary['p50']:.2f}秒")
+    col3.metric("p95", f"{summary['p95']:.2f}秒")
+    col4.metric("エラー率", f"{summary['errors'] / summary['calls']:.1%}")
+    col5.metric("キャッシュ・合流", f"{(summary['cache_hits'] + summary['coalesced']) / summary['calls']:.1%}")
+    col6.metric("推定料金", f"${summary['cost']:.4f}")
+
+    buckets = bucket_calls(records, bucket_seconds)
+    times = [datetime.fromtimestamp(b["time"]) for b in buckets]
+
+    st.subheader("⏱ レイテンシの推移")
+    st.caption("上流を呼んだ呼び出しのみ（キャッシュ・合流は除く）")
+    st.line_chart(
+        {"時刻": times, "p50": [b["p50"] for b in buckets], "p95": [b["p95"] for b in buckets]},
+        x="時刻", y=["p50", "p95"], y_label="秒",
+    )
+
+    st.subheader("🔢 トークン数の推移")
+    st.area_chart(
+        {
+            "時刻": times,
+            "入力": [b["prompt_tokens"] - b["cached_tokens"] for b in buckets],
+            "入力（キャッシュ）": [b["cached_tokens"] for b in buckets],
+            "出力": [b["completion_tokens"] for b in buckets],
+        },
+        x="時刻", y=["入力", "入力（キャッシュ）", "出力"], y_label="トークン",
+    )
+
+    st.subheader("📋 ページ・モデル別の内訳")
+    groups = {}
+    for record in records:
+        name = f"{PAGE_LABELS.get(record['page'], record['page'])} / {record['model']}"
+        groups.setdefault(name, []).append(record)
+    st.dataframe([summary_row(name, group) for name, group in sorted(groups.items())],
+                 hide_index=True, use_container_width=True)
+
+    errors = [r for r in records if r["status"] == "error"]
+    if errors:
+        with st.expander(f"⚠️ エラー（{len(errors)}件）"):
+            st.dataframe(
+                [
+                    {
+                        "時刻": datetime.fromtimestamp(r["started"]).strftime("%m/%d %H:%M:%S"),
+                        "ページ": PAGE_LABELS.get(r["page"], r["page"]),
+                        "モデル": r["model"],
+                        "エラー": r["error"],
+                        "リトライ": r["retries"],
+                        "経過 (秒)": round(r["latency"], 2),
+                    }
+                    for r in reversed(errors[-100:])
+                ],
+                hide_index=True, use_container_width=True,
+            )
+
+    with st.expander("🕒 直近の呼び出し"):
+        st.dataframe(
+            [
+                {
+                    "時刻": datetime.fromtimestamp(r["started"]).strftime("%m/%d %H:%M:%S"),
+                    "ページ": PAGE_LABELS.get(r["page"], r["page"]),
+                    "モデル": r["model"],
+                    "種類": r["kind"],
+                    "結果": STATUS_LABELS.get(r["status"], r["status"]),
+                    "経過 (秒)": round(r["latency"], 2),
+                    "入力": r["prompt_tokens"],
+                    "出力": r["completion_tokens"],
+                }
+                for r in reversed(records[-50:])
+            ],
+            hide_index=True, use_container_width=True,
+        )
+
+
+show_dashboard()
@@ -121,6 +121,50 @@ def get_system_prompt() -> str:
     return SYSTEM_PROMPT
 
 
+# 編集モード用プロンプト（記事への差分適用）
+EDIT_OPS_PROMPT = """
+あなたは「AI編集者（Young AI Editor / YAE）」として、ライターの指示どおりに記事を修正する。
+媒体はワカモノリサーチ（旧・放課後NEWS）、対象読者は10代（主に高校生）、文体は自然で読みやすい「です・ます調」。
+大人語・広告調・SNS的な砕けた言い回しは使わない。数値は入力されたアンケートデータのものだけを使う。
+
+---
+
+【出力ルール】
+- 記事全文は出力しない。変更箇所だけを、以下の編集操作の配列で返す。
+- find / heading には、参考情報の「現在の記事（最新版）」から**一字一句そのまま**コピーした文字列を使う。
+- find は記事中で1箇所に特定できる長さにする（短すぎる語句は避け、文単位で指定する）。
+- 変更が不要・指示が曖昧な場合は operations を空にし、message で確認の質問を返す。
+
+---
+
+【編集操作】
+- replace：find の文字列を replace に置き換える（見出し・文・語句の修正）
+- insert_after_heading：heading の見出しのセクション末尾に text を追加する
+- delete_paragraph：find を含む段落を削除する
+
+---
+
+【出力形式】
+以下のJSON形式で出力してください：
+
+```json
+{
+  "message": "どこをどう直したかの短い説明（編集者として、です・ます調で）",
+  "operations": [
+    {"op": "replace", "find": "修正前の文", "replace": "修正後の文"},
+    {"op": "insert_after_heading", "heading": "## 見出し", "text": "追加する段落"},
+    {"op": "delete_paragraph", "find": "削除する段落に含まれる文"}
+  ]
+}
+```
+"""
+
+
+def get_edit_ops_prompt() -> str:
+    """編集モードのシステムプロンプトを取得"""
+    return EDIT_OPS_PROMPT
+
+
 # ライター用プロンプト（記事生成）
 WRITER_PROMPT = """
 あなたは「AIライター」として動作する。
@@ -191,6 +235,14 @@ def get_writer_prompt() -> str:
     return WRITER_PROMPT
 
 
+def build_writer_messages(survey_data: str) -> list:
+    """記事生成用のメッセージを作成"""
+    return [
+        {"role": "system", "content": get_writer_prompt()},
+        {"role": "user", "content": f"以下のアンケート結果から記事を作成してください。JSON形式で出力してください。\n\n{survey_data}"}
+    ]
+
+
 # 評価者用プロンプト（記事評価）
 EVALUATOR_PROMPT = """
 あなたは「AI編集者（評価専門）」として動作する。
@@ -251,6 +303,7 @@ EVALUATOR_PROMPT = """
 【評価のポイント】
 - 良い点は明確に言語化して褒める
 - 改善点は具体的な修正案とともに提示
+- proposals の before は記事中の文をそのまま引用する（提案はそのまま記事に反映されるため、「〜」で途中を省略しない）
 - データの正確性を必ず確認
 - 感情表現（「残念ながら」「切ない」など）の有無をチェック
 """
@@ -259,3 +312,149 @@ EVALUATOR_PROMPT = """
 def get_evaluator_prompt() -> str:
     """AI評価者のシステムプロンプトを取得"""
     return EVALUATOR_PROMPT
+
+
+def build_evaluator_messages(survey_data: str, title: str, article: str, local_axes=()) -> list:
+    """記事評価用のメッセージを作成
+
+    local_axes に含まれる軸はローカルで判定するため、LLMには評価を求めない。
+    データ整合性をローカルで判定する場合はアンケートデータ自体を送らない。
+    """
+    survey_section = "" if "data_integrity" in local_axes else f"""
+【アンケートデータ】
+{survey_data}
+"""
+    context = f"""{survey_section}
+【生成された記事】
+タイトル: {title}
+{article}
+"""
+    note = ""
+    if local_axes:
+        note = f"\n\n※ {', '.join(local_axes)} はシステム側で判定済みのため、評価・言及は不要です（scoresからも省略してください）。"
+    return [
+        {"role": "system", "content": get_evaluator_prompt()},
+        {"role": "user", "content": f"以下の記事を評価してください。JSON形式で出力してください。{note}\n\n{context}"}
+    ]
+
+
+# 評価軸の説明（軸ごとの並列評価で使用）
+AXIS_DESCRIPTIONS = {
+    "naturalness_teen": "10代自然さ：若者が違和感なく読める自然な語感か",
+    "readability": "わかりやすさ：主語が明確で、文が長すぎず、1段落1テーマか",
+    "structure": "記事構成：導入・結果・分析・まとめの流れが自然か",
+    "bias_assertion": "偏り・断定：断定や過度な一般化がなく、控えめな表現を使っているか。感情表現（「残念ながら」「切ない」など）がないか",
+    "ethics_safety": "倫理・配慮：センシティブな表現や個人情報への配慮ができているか",
+    "seo_basics": "SEO基礎：タイトル長・見出し構造が適切か",
+    "brand_fit": "ブランド整合：ワカモノリサーチの記事として自然か",
+    "data_integrity": "データ整合性：記事内数値がアンケートデータと正確に一致しているか",
+}
+
+# 並列評価の軸グループ
+AXIS_GROUPS = {
+    "tone": ["naturalness_teen", "brand_fit"],
+    "bias_ethics": ["bias_assertion", "ethics_safety"],
+    "structure_seo": ["readability", "structure", "seo_basics"],
+    "data": ["data_integrity"],
+}
+
+AXIS_EVALUATOR_PROMPT = """
+あなたは「AI編集者（評価専門）」として動作する。
+目的は、10代向けアンケート記事を指定された評価軸だけで評価し、具体的な改善提案を行うこと。
+媒体はワカモノリサーチ（旧・放課後NEWS）、対象読者は10代（主に高校生）、文体は自然で読みやすい「です・ます調」。
+
+---
+
+【今回の評価軸（0〜5点）】
+{axes}
+
+---
+
+【出力形式】
+以下のJSON形式で出力してください（scoresには今回の評価軸のみを含める）：
+
+```json
+{{
+  "scores": {{{score_keys}}},
+  "strengths": ["強み"],
+  "weaknesses": ["改善点"],
+  "proposals": [
+    {{
+      "category": "カテゴリ",
+      "before": "修正前の表現（記事中の文をそのまま引用）",
+      "after": "修正後の表現",
+      "reason": "理由"
+    }}
+  ]
+}}
+```
+
+---
+
+【評価のポイント】
+- 今回の評価軸に関係する点だけを指摘する
+- 良い点は明確に言語化して褒める
+- 改善点は具体的な修正案とともに提示
+"""
+
+
+def build_axis_evaluator_messages(axes, survey_data: str, title: str, article: str,
+                                  label: str = "生成された記事") -> list:
+    """指定した評価軸だけを評価するメッセージを作成（データ整合性を含む場合のみアンケートを送る）
+
+    label で評価対象（記事全体・セクション・構成）を示す。
+    """
+    system_prompt = AXIS_EVALUATOR_PROMPT.format(
+        axes="\n".join(f"{i}. {AXIS_DESCRIPTIONS[axis]}" for i, axis in enumerate(axes, 1)),
+        score_keys=", ".join(f'"{axis}": 4' for axis in axes),
+    )
+    survey_section = f"""
+【アンケートデータ】
+{survey_data}
+""" if "data_integrity" in axes else ""
+    context = f"""{survey_section}
+【{label}】
+タイトル: {title}
+{article}
+"""
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"以下の記事を評価してください。JSON形式で出力してください。\n\n{context}"}
+    ]
+
+
+# アンケート要約用プロンプト（大規模アンケートの分割要約）
+SURVEY_MAP_PROMPT = """
+あなたは「アンケート集計アシスタント」として動作する。
+目的は、10代向けアンケートの自由回答を、記事の執筆に使える形に短くまとめること。
+
+---
+
+【要約のルール】
+- 設問（### Qn: …）ごとに、その設問の自由回答をまとめる
+- 似た回答はまとめ、多い順に傾向を1〜3文で説明する
+- 記事で引用できるよう、代表的な回答を原文のまま「」付きで3〜5件残す（言い換えない）
+- 代表的な回答には、同じ趣旨の回答のおおよその件数を添える
+- 回答にない内容や数値を加えない
+
+---
+
+【出力形式】
+以下のJSON形式で出力してください：
+
+```json
+{
+  "summaries": {
+    "Q1": "傾向の説明\\n・「代表的な回答」（同様の回答 約12件）\\n・「代表的な回答」（同様の回答 約5件）"
+  }
+}
+```
+"""
+
+
+def build_survey_map_messages(chunk: str) -> list:
+    """アンケートの一部（設問見出しと自由回答）を要約するメッセージを作成"""
+    return [
+        {"role": "system", "content": SURVEY_MAP_PROMPT},
+        {"role": "user", "content": f"以下のアンケートの自由回答を設問ごとに要約してください。JSON形式で出力してください。\n\n{chunk}"}
+    ]
@@ -0,0 +1,160 @@
+"""
+LLMレスポンスのディスクキャッシュ
+モデル・プロンプト・入力・サンプリング設定のハッシュをキーに応答を保存する
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+CACHE_DIR = Path(os.getenv("YAE_CACHE_DIR", ".cache/responses"))
+MAX_BYTES = int(os.getenv("YAE_CACHE_MAX_MB", "200")) * 1024 * 1024
+DEFAULT_TTL = float(os.getenv("YAE_CACHE_TTL_HOURS", "168")) * 3600
+
+
+def make_cache_key(model: str, messages, **params) -> str:
+    """リクエスト内容からキャッシュキー（SHA-256）を作成"""
+    payload = {
+        "model": model,
+        "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+        "params": params,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """サイズ上限付きLRU・TTL対応のコンテンツアドレス型キャッシュ
+
+    エントリは `<dir>/<key先頭2文字>/<key>.json` に保存し、
+    最終アクセス時刻はファイルのmtimeで管理する。
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES, ttl=DEFAULT_TTL):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = {}
+        self._load_index()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _load_index(self):
+        """既存エントリのサイズとアクセス時刻を読み込む"""
+        self._index = {}
+        if not self.directory.exists():
+            return
+        for path in self.directory.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            self._index[path.stem] = [stat.st_size, stat.st_mtime]
+
+    def get(self, key: str):
+        """キャッシュされた応答を取得（なければNone）"""
+        path = self._path(key)
+        with self._lock:
+            try:
+                entry = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                self.misses += 1
+                self._index.pop(key, None)
+                return None
+
+            if time.time() - entry["created"] > entry.get("ttl", self.ttl):
+                self.misses += 1
+                self._remove(key)
+                return None
+
+            # LRU用にアクセス時刻を更新
+            now = time.time()
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+            if key in self._index:
+                self._index[key][1] = now
+            self.hits += 1
+            return entry["content"]
+
+    def set(self, key: str, content: str, ttl: float = None):
+        """応答を保存し、上限を超えたら古いものから削除"""
+        path = self._path(key)
+        data = json.dumps(
+            {"created": time.time(), "ttl": ttl or self.ttl, "content": content},
+            ensure_ascii=False,
+        ).encode("utf-8")
+
+        with self._lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+            self._index[key] = [len(data), time.time()]
+            self._evict()
+
+    def _remove(self, key: str):
+        self._index.pop(key, None)
+        try:
+            self._path(key).unlink()
+        except OSError:
+            pass
+
+    def _evict(self):
+        total = sum(size for size, _ in self._index.values())
+        if total <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(self._index.items(), key=lambda item: item[1][1]):
+            self._remove(key)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        """全エントリを削除"""
+        with self._lock:
+            for key in list(self._index):
+                self._remove(key)
+
+    def stats(self) -> dict:
+        """ヒット率と使用容量"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._index),
+                "bytes": sum(size for size, _ in self._index.values()),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """プロセス全体で共有するキャッシュを取得"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+
+def format_cache_stats(stats: dict) -> str:
+    """UI表示用の統計文字列"""
+    return (
+        f"キャッシュ: ヒット率 {stats['hit_rate']:.0%}"
+        f"（{stats['hits']}/{stats['hits'] + stats['misses']}）"
+        f" ・ {stats['entries']}件 / {stats['bytes'] / 1024 / 1024:.1f}MB"
+    )
@@ -0,0 +1,281 @@
+"""
+セッションの永続化
+アンケート・記事・評価結果・チャット履歴をSQLite（WALモード）に保存し、
+ブラウザの再読み込みやサーバーの再起動、別プロセスへの振り分け後もセッションIDで復元する。
+書き込みはまとめて後から行い（ライトビハインド）、長くなったチャット履歴は古いものからディスクへ退避する。
+"""
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+
+SESSION_DB = Path(os.getenv("YAE_SESSION_DB", ".cache/sessions.db"))
+# 書き込みをまとめる間隔（秒）
+FLUSH_INTERVAL = float(os.getenv("YAE_SESSION_FLUSH_SECONDS", "1.0"))
+# 1セッションのメモリ上に残すチャット履歴の上限（文字数）
+MAX_CHAT_CHARS = int(os.getenv("YAE_SESSION_MAX_CHAT_CHARS", "20000"))
+# 上限を超えても必ずメモリ上に残す直近の会話数
+MIN_KEPT_MESSAGES = 6
+# 最後の更新からこの日数を過ぎたセッションは削除する
+SESSION_TTL_DAYS = float(os.getenv("YAE_SESSION_TTL_DAYS", "30"))
+# 書き込み済みの値として覚えておく (セッション, キー) の数（超えたら古いものから忘れ、次回は書き込み直す）
+MAX_TRACKED_VALUES = 4096
+
+# 永続化する session_state のキー
+PERSISTED_KEYS = (
+    "survey_data",
+    "generated_article",
+    "article_data",
+    "evaluation_result",
+    "improvement_messages",
+    "current_article",
+    "chart_kinds",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_values (
+    session_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (session_id, key)
+);
+CREATE TABLE IF NOT EXISTS chat_archive (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+);
+"""
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class SessionStore:
+    """セッションの値をSQLiteに保存する
+
+    save() は書き込みを溜めるだけで、バックグラウンドのスレッドが一定間隔でまとめて書き込む。
+    同じキーへの連続した書き込みは最後の値だけが書かれる。SQLiteはWALモードで開くため、
+    同じDBファイルを複数のStreamlitプロセスから同時に読み書きできる。
+    """
+
+    def __init__(self, path=SESSION_DB, flush_interval: float = FLUSH_INTERVAL,
+                 max_chat_chars: int = MAX_CHAT_CHARS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self.max_chat_chars = max_chat_chars
+        self._local = threading.local()
+        self._pending = {}
+        self._saved = OrderedDict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        self.prune()
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="yae-session-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def _connect(self) -> sqlite3.Connection:
+        """スレッドごとの接続（sqlite3の接続はスレッド間で共有しない）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def load(self, session_id: str) -> dict:
+        """セッションの値をすべて読み込む（未反映の書き込みも含む）"""
+        self.flush()
+        rows = self._connect().execute(
+            "SELECT key, value FROM session_values WHERE session_id = ?", (session_id,)
+        ).fetchall()
+        values = {}
+        with self._lock:
+            for key, value in rows:
+                values[key] = json.loads(value)
+                self._remember(session_id, key, _digest(value))
+        return values
+
+    def _remember(self, session_id: str, key: str, digest: str):
+        """書き込み済みの値のハッシュを記録する（_lock を取得して呼ぶ）"""
+        self._saved[(session_id, key)] = digest
+        self._saved.move_to_end((session_id, key))
+        while len(self._saved) > MAX_TRACKED_VALUES:
+            self._saved.popitem(last=False)
+
+    def save(self, session_id: str, values: dict) -> int:
+        """変更された値だけを書き込み待ちにする。書き込み待ちにした件数を返す"""
+        queued = 0
+        with self._lock:
+            for key, value in values.items():
+                serialized = json.dumps(value, ensure_ascii=False)
+                digest = _digest(serialized)
+                if self._saved.get((session_id, key)) == digest:
+                    continue
+                self._remember(session_id, key, digest)
+                self._pending[(session_id, key)] = serialized
+                queued += 1
+        if queued:
+            self._wakeup.set()
+        return queued
+
+    def flush(self):
+        """書き込み待ちの値をまとめて1トランザクションで書き込む"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT INTO session_values (session_id, key, value, updated) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT(session_id, key) DO UPDATE SET value = excluded.value, updated = excluded.updated",
+                    [(session_id, key, value, now) for (session_id, key), value in pending.items()]
+                )
+        except sqlite3.Error:
+            # 書き込めなかった値は、その後に来た新しい値を優先して書き込み待ちに戻す
+            with self._lock:
+                self._pending = {**pending, **self._pending}
+            raise
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait()
+            # 間隔内の書き込みをまとめる
+            time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                # ロック待ちの期限切れなどは次の周期で再試行する
+                self._wakeup.set()
+
+    def spill_chat(self, session_id: str, messages: list) -> list:
+        """チャット履歴が上限を超えた分を古いものからディスクへ退避し、メモリに残す履歴を返す"""
+        total = sum(len(m.get("content", "")) for m in messages)
+        if total <= self.max_chat_chars or len(messages) <= MIN_KEPT_MESSAGES:
+            return messages
+
+        cut = 0
+        while total > self.max_chat_chars and len(messages) - cut > MIN_KEPT_MESSAGES:
+            total -= len(messages[cut].get("content", ""))
+            cut += 1
+
+        # 退避はメモリから消す前に確実に書き込む
+        with self._connect() as conn:
+            start = conn.execute(
+                "SELECT COALESCE(MAX(seq), -1) + 1 FROM chat_archive WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            conn.executemany(
+                "INSERT INTO chat_archive (session_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                [(session_id, start + i, m["role"], m.get("content", "")) for i, m in enumerate(messages[:cut])]
+            )
+        return messages[cut:]
+
+    def archived_messages(self, session_id: str) -> list:
+        """ディスクへ退避したチャット履歴（古い順）"""
+        rows = self._connect().execute(
+            "SELECT role, content FROM chat_archive WHERE session_id = ? ORDER BY seq", (session_id,)
+        ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def archived_count(self, session_id: str) -> int:
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM chat_archive WHERE session_id = ?", (session_id,)
+        ).fetchone()[0]
+
+    def clear_chat_archive(self, session_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM chat_archive WHERE session_id = ?", (session_id,))
+
+    def prune(self, ttl_days: float = SESSION_TTL_DAYS):
+        """長期間更新のないセッションを削除する"""
+        cutoff = time.time() - ttl_days * 86400
+        with self._connect() as conn:
+            stale = [row[0] for row in conn.execute(
+                "SELECT session_id FROM session_values GROUP BY session_id HAVING MAX(updated) < ?", (cutoff,)
+            )]
+            conn.executemany("DELETE FROM session_values WHERE session_id = ?", [(s,) for s in stale])
+            conn.executemany("DELETE FROM chat_archive WHERE session_id = ?", [(s,) for s in stale])
+        stale = set(stale)
+        with self._lock:
+            for saved_key in [k for k in self._saved if k[0] in stale]:
+                del self._saved[saved_key]
+
+    def close(self):
+        """未反映の書き込みを書き出して終了する"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self.flush()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """プロセス全体で共有するセッションストアを取得"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore()
+    return _store
+
+
+def sync_session(state, session_id: str, keys=PERSISTED_KEYS):
+    """session_state とストアを同期する（各ページの先頭で毎回呼ぶ）
+
+    このプロセスでまだ復元していないセッションなら保存済みの値を読み込み、
+    そうでなければ前回の実行までに変わった値を書き込み待ちにする。
+    """
+    store = get_session_store()
+    if state.get("session_id") != session_id:
+        for key, value in store.load(session_id).items():
+            if key in keys:
+                state[key] = value
+        state["session_id"] = session_id
+        state["archived_message_count"] = store.archived_count(session_id)
+        return
+    save_session(state, keys)
+
+
+def save_session(state, keys=PERSISTED_KEYS):
+    """変わった値を書き込み待ちにする（ページの末尾・st.stop() の前・フラグメントで値を変えた直後に呼ぶ）"""
+    session_id = state.get("session_id")
+    if not session_id:
+        return
+    store = get_session_store()
+    if "improvement_messages" in state:
+        kept = store.spill_chat(session_id, state["improvement_messages"])
+        if len(kept) != len(state["improvement_messages"]):
+            state["archived_message_count"] = state.get("archived_message_count", 0) + (
+                len(state["improvement_messages"]) - len(kept)
+            )
+            state["improvement_messages"] = kept
+    store.save(session_id, {key: state[key] for key in keys if key in state})
@@ -0,0 +1,152 @@
+"""
+同一リクエストの合流（シングルフライト）
+同じ内容のLLM呼び出しが同時に来た場合、上流への呼び出しを1回にまとめ、結果を待っている全員に配る。
+ストリーミングは上流を専用スレッドで受信し、受信済みの差分をそれぞれの呼び出し元に順に流す。
+"""
+import contextvars
+import threading
+
+
+class _Flight:
+    """実行中の上流呼び出し1件"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks = []
+        self.result = None
+        self.error = None
+        self.done = False
+        self.cancelled = False
+        self.subscribers = 0
+
+
+class SingleFlight:
+    """キーが同じ同時呼び出しを1回の上流呼び出しに合流させる"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self.calls = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+
+    def _join(self, table: dict, key):
+        """実行中の呼び出しに参加する（なければ作る）。(flight, 先頭か) を返す"""
+        with self._lock:
+            self.calls += 1
+            flight = table.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                table[key] = flight
+                self.upstream_calls += 1
+            else:
+                self.coalesced += 1
+            flight.subscribers += 1
+            return flight, leader
+
+    def do(self, key, fn):
+        """fn() の結果を返す。同じキーで実行中の呼び出しがあればその結果を待って共有する"""
+        flight, leader = self._join(self._calls, key)
+        if leader:
+            try:
+                flight.result = fn()
+            except Exception as e:
+                flight.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                with flight.cond:
+                    flight.done = True
+                    flight.cond.notify_all()
+            return flight.result
+
+        with flight.cond:
+            while not flight.done:
+                flight.cond.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def stream(self, key, open_stream):
+        """open_stream() が返すイテレーターの要素を順に返すジェネレーター
+
+        同じキーで受信中のストリームがあれば、受信済みの要素から順に同じ内容を返す。
+        全員が close() すると上流のストリームも閉じる（上流が止まっている場合は、次の受信か読み込みの期限切れで閉じる）。
+        """
+        flight, leader = self._join(self._streams, key)
+        if leader:
+            context = contextvars.copy_context()
+            threading.Thread(
+                target=context.run, args=(self._pump, key, flight, open_stream), name="yae-single-flight",
+                daemon=True
+            ).start()
+
+        index = 0
+        try:
+            while True:
+                with flight.cond:
+                    while index >= len(flight.chunks) and not flight.done:
+                        flight.cond.wait()
+                    pending = flight.chunks[index:]
+                    index = len(flight.chunks)
+                    finished = flight.done
+                for chunk in pending:
+                    yield chunk
+                if finished:
+                    break
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            with self._lock:
+                flight.subscribers -= 1
+                if flight.subscribers == 0 and not flight.done:
+                    # 誰も受信していないストリームは打ち切り、以降の呼び出しは新しく始める
+                    with flight.cond:
+                        flight.cancelled = True
+                    if self._streams.get(key) is flight:
+                        del self._streams[key]
+
+    def _pump(self, key, flight: _Flight, open_stream):
+        """上流のストリームを受信して共有バッファに積む"""
+        stream = None
+        try:
+            stream = open_stream()
+            with flight.cond:
+                if flight.cancelled:
+                    return
+            for chunk in stream:
+                with flight.cond:
+                    if flight.cancelled:
+                        break
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+        except Exception as e:
+            # 打ち切り後の接続エラーは受信者がいないため記録しない
+            if not flight.cancelled:
+                flight.error = e
+        finally:
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+            with self._lock:
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "upstream_calls": self.upstream_calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls) + len(self._streams),
+            }
+
+
+def format_flight_stats(stats: dict) -> str:
+    """UI表示用の統計文字列"""
+    return f"同時リクエストの合流: {stats['coalesced']}件を共有（上流 {stats['upstream_calls']}回）"
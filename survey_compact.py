@@ -0,0 +1,179 @@
+"""
+自由回答の近似重複まとめ
+「### 自由回答（…）：」の回答を文字n-gramのMinHash・LSHで言い回しの近いものごとにまとめ、
+代表的な回答（原文のまま）と件数だけを残したコンパクトなアンケートを作る。
+記事生成・評価のプロンプトを小さくするためのローカルの前処理で、LLMは呼ばない
+"""
+import functools
+import math
+import os
+import random
+import re
+import zlib
+from dataclasses import dataclass, field
+
+from chat_context import estimate_text_tokens
+from survey_parser import normalize, parse_survey
+
+
+# これ以上似ている回答（推定ジャカード係数）を同じまとまりにする
+SIMILARITY_THRESHOLD = float(os.getenv("YAE_CLUSTER_SIMILARITY", "0.5"))
+# 1つの自由回答欄に残す代表的な回答の目安（これ以下の回答数の欄はそのまま送る）
+MAX_QUOTES = int(os.getenv("YAE_CLUSTER_MAX_QUOTES", "15"))
+# 欄の回答のうちこの割合以上を占めるまとまりは、MAX_QUOTES を超えても必ず代表の回答を残す
+MIN_CLUSTER_SHARE = float(os.getenv("YAE_CLUSTER_MIN_SHARE", "0.02"))
+
+# 短い日本語の回答が多いため文字2-gramで比べる
+SHINGLE_SIZE = 2
+NUM_PERM = 64
+# 16バンド×4行（類似度 約0.5 以上の組が高い確率で同じバケットに入る）
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0x5EED)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+# 代表の回答を選ぶときに比べる回答数の上限
+MEDOID_SAMPLE = 30
+
+# 似ているかの判定では無視する記号・語尾（「〜だから」で終わる回答が多く、語尾だけで似てしまうため）
+IGNORED_CHARS_RE = re.compile(r"[「」『』、。,.!?！？・\s…ー〜~]")
+IGNORED_SUFFIX_RE = re.compile(r"(だから|から|ので|です|だ)$")
+COMPACT_NOTE = "※ 自由回答は似た言い回しの回答をまとめ、代表的な回答（原文）と件数を記載"
+
+
+@dataclass
+class AnswerCluster:
+    """言い回しの近い回答のまとまり（representative は原文の行）"""
+    representative: str
+    answers: list = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        return len(self.answers)
+
+
+@dataclass
+class CompactSurvey:
+    """自由回答をまとめたアンケート"""
+    text: str
+    original_tokens: int
+    compact_tokens: int
+    answers: int = 0
+    quotes: int = 0
+
+    @property
+    def changed(self) -> bool:
+        return self.quotes < self.answers
+
+
+def shingles(answer: str) -> set:
+    """回答を比較用の文字n-gramの集合にする"""
+    text = IGNORED_CHARS_RE.sub("", normalize(answer)).lower()
+    text = IGNORED_SUFFIX_RE.sub("", text) or text
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+@functools.lru_cache(maxsize=65536)
+def minhash(answer: str) -> tuple:
+    """回答のMinHash署名（NUM_PERM個のハッシュの最小値）"""
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in shingles(answer)]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def similarity(sig_a: tuple, sig_b: tuple) -> float:
+    """署名から推定したジャカード係数"""
+    return sum(x == y for x, y in zip(sig_a, sig_b)) / NUM_PERM
+
+
+def cluster_answers(answers: list, threshold: float = SIMILARITY_THRESHOLD) -> list:
+    """回答をまとまりに分け、件数の多い順（同数なら先に出た順）に返す"""
+    signatures = [minhash(answer) for answer in answers]
+    parent = list(range(len(answers)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # 同じバンドの値を持つ回答だけを候補にし、署名の類似度で確かめてからまとめる
+    for band in range(BANDS):
+        buckets = {}
+        for i, signature in enumerate(signatures):
+            buckets.setdefault(signature[band * ROWS:(band + 1) * ROWS], []).append(i)
+        for members in buckets.values():
+            leader = members[0]
+            for i in members[1:]:
+                root_leader, root = find(leader), find(i)
+                if root_leader != root and similarity(signatures[leader], signatures[i]) >= threshold:
+                    parent[max(root_leader, root)] = min(root_leader, root)
+
+    groups = {}
+    for i in range(len(answers)):
+        groups.setdefault(find(i), []).append(i)
+
+    clusters = []
+    for members in groups.values():
+        # 代表はまとまりの中で他の回答に最も似ている回答（同点なら先に出たもの）
+        sample = members[:MEDOID_SAMPLE]
+        best = max(sample, key=lambda i: (sum(similarity(signatures[i], signatures[j]) for j in sample), -i))
+        clusters.append((members[0], AnswerCluster(answers[best], [answers[i] for i in members])))
+    clusters.sort(key=lambda item: (-item[1].size, item[0]))
+    return [cluster for _, cluster in clusters]
+
+
+def compact_lines(bullets: list) -> list:
+    """自由回答欄1つ分の行を、代表的な回答と件数の行にする
+
+    一定の割合以上を占めるまとまりはすべて代表の回答を残し、残りの枠を件数の多い順に埋める。
+    それ以外は件数だけを「少数意見」としてまとめ、最大でも何件のまとまりかを書き添える。
+    """
+    if len(bullets) <= MAX_QUOTES:
+        return bullets
+    clusters = cluster_answers(bullets)
+    min_size = max(2, math.ceil(MIN_CLUSTER_SHARE * len(bullets)))
+    kept = max(MAX_QUOTES, sum(cluster.size >= min_size for cluster in clusters))
+    lines = [
+        cluster.representative if cluster.size == 1 else f"{cluster.representative}（似た回答を含め{cluster.size}件）"
+        for cluster in clusters[:kept]
+    ]
+    rest = clusters[kept:]
+    if rest:
+        largest = rest[0].size
+        detail = "いずれも1件ずつ" if largest == 1 else f"{len(rest)}種類・いずれも{largest}件以下"
+        lines.append(f"・ほかに少数意見 {sum(cluster.size for cluster in rest)}件（{detail}）")
+    return lines
+
+
+@functools.lru_cache(maxsize=32)
+def compact_survey(survey_data: str) -> CompactSurvey:
+    """自由回答欄ごとに似た回答をまとめたアンケートを返す（自由回答欄以外の行はそのまま）"""
+    lines = survey_data.splitlines()
+    output = []
+    position = 0
+    answers = 0
+    quotes = 0
+    for section in parse_survey(survey_data).free_text:
+        bullets = [line.strip() for line in lines[section.start:section.end] if line.strip()]
+        compacted = compact_lines(bullets)
+        answers += len(bullets)
+        quotes += len(compacted)
+        output.extend(lines[position:section.start])
+        output.extend(compacted)
+        position = section.end
+    output.extend(lines[position:])
+
+    original_tokens = estimate_text_tokens(survey_data)
+    text = "\n".join(output).rstrip() + f"\n\n{COMPACT_NOTE}\n"
+    compact_tokens = estimate_text_tokens(text)
+    if quotes >= answers or compact_tokens >= original_tokens:
+        text, compact_tokens, quotes = survey_data, original_tokens, answers
+    return CompactSurvey(
+        text=text,
+        original_tokens=original_tokens,
+        compact_tokens=compact_tokens,
+        answers=answers,
+        quotes=quotes,
+    )
@@ -0,0 +1,241 @@
+"""
+アンケートデータのパーサー
+enquete/*.md 形式の平文から調査概要・設問・選択肢と割合・自由回答を取り出し、型付きのモデルにする。
+同じ内容は一度だけパースして内容のハッシュでキャッシュし、記事生成・評価・グラフ・整合性チェックで共有する
+"""
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+
+# 「### Q1: 設問文」「Q1: 設問文」
+QUESTION_RE = re.compile(r"^(?:#+\s*)?Q(\d+)\s*[:：]\s*(.+)$")
+# 「A1: 選択肢 67.1%、選択肢 11.4%」
+ANSWER_RE = re.compile(r"^(?:#+\s*)?A(\d+)\s*[:：]\s*(.+)$")
+# 「選択肢 67.1%」
+OPTION_RE = re.compile(r"^(.+?)\s*(\d+(?:\.\d+)?)\s*%$")
+RESPONDENTS_RE = re.compile(r"有効回答数\s*[:：]\s*(\d[\d,]*)")
+# 「# アンケートデータ抽出：…」
+TITLE_RE = re.compile(r"^#\s+(.+)$")
+OVERVIEW_HEADING_RE = re.compile(r"^#+\s*調査概要")
+# 「- 調査期間: 2025.8.22〜2025.9.6」
+OVERVIEW_FIELD_RE = re.compile(r"^[-・*•]\s*(.+?)\s*[:：]\s*(.+)$")
+# 「### 自由回答（食欲の秋を選んだ理由）：」（正規化後は半角の括弧・コロン）
+FREE_TEXT_RE = re.compile(r"^(?:#+\s*)?自由回答\s*(?:\((.+)\))?\s*:?\s*$")
+BULLET_CHARS = "・-*•"
+
+# パース結果を保持するアンケートの数
+CACHE_SIZE = 32
+
+
+@dataclass
+class SurveyOption:
+    """選択肢と回答割合"""
+    label: str
+    percent: float
+
+
+@dataclass
+class FreeTextSection:
+    """自由回答欄
+
+    answers は行頭の記号を除いた回答の原文。start〜end は元のテキストで回答が並ぶ行の範囲
+    （見出しのない箇条書きは、見出しなしの自由回答欄として扱う）。
+    """
+    title: str
+    question: int = None
+    heading: str = ""
+    answers: list = field(default_factory=list)
+    start: int = 0
+    end: int = 0
+
+
+@dataclass
+class SurveyQuestion:
+    """設問（heading・answer_lines・notes は元のテキストの行）"""
+    number: int
+    text: str
+    options: list = field(default_factory=list)
+    free_text: list = field(default_factory=list)
+    heading: str = ""
+    answer_lines: list = field(default_factory=list)
+    notes: list = field(default_factory=list)
+    line: int = 0
+
+
+@dataclass
+class Survey:
+    """パース済みのアンケート（キャッシュで共有するため、読み取り専用として扱う）"""
+    key: str = ""
+    title: str = ""
+    overview: dict = field(default_factory=dict)
+    respondents: int = None
+    questions: list = field(default_factory=list)
+    free_text: list = field(default_factory=list)
+    line_count: int = 0
+
+    def all_options(self):
+        """全設問の (設問, 選択肢) を順に返す"""
+        for question in self.questions:
+            for option in question.options:
+                yield question, option
+
+    def question(self, number: int):
+        for question in self.questions:
+            if question.number == number:
+                return question
+        return None
+
+    @property
+    def answer_count(self) -> int:
+        """自由回答の件数"""
+        return sum(len(section.answers) for section in self.free_text)
+
+    def describe(self) -> str:
+        """「設問 5問・選択肢 23件・自由回答 37件・有効回答数 845名」"""
+        parts = [
+            f"設問 {len(self.questions)}問",
+            f"選択肢 {sum(len(q.options) for q in self.questions)}件",
+            f"自由回答 {self.answer_count:,}件",
+        ]
+        if self.respondents:
+            parts.append(f"有効回答数 {self.respondents:,}名")
+        return "・".join(parts)
+
+
+def normalize(text: str) -> str:
+    """全角英数字・記号を半角に揃える"""
+    return unicodedata.normalize("NFKC", text)
+
+
+def parse_options(text: str) -> list:
+    """「選択肢 67.1%、選択肢 11.4%」を選択肢のリストに分解"""
+    options = []
+    for part in re.split(r"[、,，/／]", text):
+        match = OPTION_RE.match(part.strip())
+        if match:
+            options.append(SurveyOption(match.group(1).strip(), float(match.group(2))))
+    return options
+
+
+def survey_key(text: str) -> str:
+    """アンケートの内容を識別するハッシュ"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _is_bulleted_item(line: str) -> bool:
+    """「・A1: …」のように箇条書きになった設問・選択肢の行か"""
+    body = line[1:].lstrip()
+    if body[:1] not in ("Q", "A", "Ｑ", "Ａ"):
+        return False
+    body = normalize(body)
+    return bool(QUESTION_RE.match(body) or ANSWER_RE.match(body))
+
+
+def _parse(text: str, key: str) -> Survey:
+    survey = Survey(key=key)
+    questions = {}
+    question = None
+    section = None
+    in_overview = False
+
+    lines = text.splitlines()
+    survey.line_count = len(lines)
+    for index, raw_line in enumerate(lines):
+        stripped = raw_line.strip()
+        if not stripped:
+            continue
+
+        # 自由回答欄の回答（件数が多いため、正規化や他の判定より先に処理する）
+        if (stripped[0] in BULLET_CHARS and (section is not None or question is not None)
+                and not in_overview and stripped.strip("-") and not _is_bulleted_item(stripped)):
+            if section is None:
+                section = FreeTextSection("", question.number, start=index)
+                question.free_text.append(section)
+                survey.free_text.append(section)
+            section.answers.append(stripped[1:].strip())
+            section.end = index + 1
+            continue
+        section = None
+
+        line = stripped if stripped.isascii() else normalize(stripped)
+        if line.startswith("#"):
+            in_overview = bool(OVERVIEW_HEADING_RE.match(line))
+            match = TITLE_RE.match(stripped)
+            if match and not survey.title and question is None:
+                survey.title = match.group(1).strip()
+                continue
+        elif line == "---":
+            in_overview = False
+            continue
+
+        match = FREE_TEXT_RE.match(line)
+        if match:
+            section = FreeTextSection(
+                (match.group(1) or "").strip(), question.number if question else None,
+                heading=stripped, start=index + 1, end=index + 1,
+            )
+            if question is not None:
+                question.free_text.append(section)
+            survey.free_text.append(section)
+            continue
+
+        line = line.lstrip("-・ ").strip()
+        match = RESPONDENTS_RE.search(line)
+        if match and survey.respondents is None:
+            survey.respondents = int(match.group(1).replace(",", ""))
+        if in_overview:
+            match = OVERVIEW_FIELD_RE.match(stripped)
+            if match:
+                survey.overview[match.group(1)] = match.group(2).strip()
+            continue
+
+        match = QUESTION_RE.match(line)
+        if match:
+            number = int(match.group(1))
+            question = SurveyQuestion(number, match.group(2).strip(), heading=stripped, line=index)
+            questions[number] = question
+            survey.questions.append(question)
+            continue
+
+        match = ANSWER_RE.match(line)
+        if match:
+            number = int(match.group(1))
+            target = questions.get(number)
+            if target is None:
+                target = SurveyQuestion(number, "", line=index)
+                questions[number] = target
+                survey.questions.append(target)
+                question = target
+            target.options.extend(parse_options(match.group(2)))
+            target.answer_lines.append(stripped)
+            continue
+
+        if question is not None:
+            question.notes.append(stripped)
+
+    return survey
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def parse_survey(text: str) -> Survey:
+    """アンケートの平文をパースする（同じ内容は一度だけパースし、結果を共有する）"""
+    key = survey_key(text or "")
+    with _cache_lock:
+        survey = _cache.get(key)
+        if survey is not None:
+            _cache.move_to_end(key)
+            return survey
+
+    survey = _parse(text or "", key)
+    with _cache_lock:
+        _cache[key] = survey
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return survey
@@ -0,0 +1,332 @@
+"""
+大規模アンケートの分割要約（map-reduce）
+モデルのコンテキストに収まらない大きなアンケートを設問ブロック（### Qn:）ごとに分け、
+自由回答を並列に要約してから、要約済みの縮約版で記事を生成する。
+設問文と選択肢・割合の行は要約せずそのまま残すため、記事に使う数値は元のデータと一致する。
+"""
+import asyncio
+import contextvars
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+from chat_context import estimate_text_tokens
+from llm_gateway import DEFAULT_MODEL, complete_text, acomplete_text
+from prompts import build_survey_map_messages
+from survey_parser import BULLET_CHARS, parse_survey
+
+
+# これを超えるアンケートは分割して要約してから記事を生成する（トークン数）
+MAP_REDUCE_THRESHOLD = int(os.getenv("YAE_MAP_REDUCE_TOKENS", "12000"))
+# 1回の要約に渡す自由回答の上限（トークン数）
+CHUNK_TOKENS = int(os.getenv("YAE_MAP_CHUNK_TOKENS", "4000"))
+# 同時に要約するチャンク数の上限
+MAP_WORKERS = int(os.getenv("YAE_MAP_WORKERS", "16"))
+MAP_OUTPUT_TOKENS = 800
+# 縮約版が MAP_REDUCE_THRESHOLD に収まるまで要約を繰り返す回数の上限
+MAX_ROUNDS = int(os.getenv("YAE_MAP_MAX_ROUNDS", "3"))
+# 切り詰めるときにも設問ごとに残す要約の長さ（トークン数）
+MIN_SUMMARY_TOKENS = 200
+
+REDUCED_NOTE = "※ 自由回答は設問ごとに要約済み（「」内は回答の原文、件数は同じ趣旨の回答のおおよその数）"
+TRUNCATED_NOTE = "（要約が長いため以下省略）"
+
+
+@dataclass
+class QuestionBlock:
+    """設問1つ分の行（設問と選択肢の行はそのまま残し、自由回答は要約する）"""
+    number: int
+    heading: str
+    answers: list = field(default_factory=list)
+    free_text: list = field(default_factory=list)
+
+
+@dataclass
+class ReducedSurvey:
+    """要約済みのアンケート"""
+    text: str
+    original_tokens: int
+    reduced_tokens: int
+    chunks: int
+    map_time: float = 0.0
+    rounds: int = 1
+
+
+def needs_map_reduce(survey_data: str, threshold: int = MAP_REDUCE_THRESHOLD) -> bool:
+    """分割して要約する必要があるか"""
+    return estimate_text_tokens(survey_data) > threshold
+
+
+def split_blocks(survey_data: str):
+    """(最初の設問より前の部分, 設問ブロックのリスト) に分ける（パース済みのモデルを使う）"""
+    survey = parse_survey(survey_data)
+    if not survey.questions:
+        return survey_data.strip(), []
+
+    lines = survey_data.splitlines()
+    blocks = []
+    for question in survey.questions:
+        free_text = list(question.notes)
+        for section in question.free_text:
+            if section.heading:
+                free_text.append(section.heading)
+            free_text.extend(line.strip() for line in lines[section.start:section.end] if line.strip())
+        heading = question.heading or f"### Q{question.number}:"
+        blocks.append(QuestionBlock(question.number, heading, list(question.answer_lines), free_text))
+    return "\n".join(lines[:survey.questions[0].line]).strip(), blocks
+
+
+def _split_lines(lines: list, max_tokens: int):
+    """行のリストを max_tokens ごとに分ける（途中で分けた場合は直前の小見出しを次の先頭にも付ける）"""
+    part = []
+    size = 0
+    subheading = None
+    for line in lines:
+        tokens = estimate_text_tokens(line)
+        if part and size + tokens > max_tokens:
+            yield part
+            part = [subheading] if subheading and line[0] in BULLET_CHARS else []
+            size = sum(estimate_text_tokens(l) for l in part)
+        if line[0] not in BULLET_CHARS:
+            subheading = line
+        part.append(line)
+        size += tokens
+    if part:
+        yield part
+
+
+def build_chunks(blocks: list, max_tokens: int = CHUNK_TOKENS) -> list:
+    """自由回答を要約の単位にまとめる
+
+    小さな設問はまとめて1回で要約し、大きな設問は行の途中で分ける。
+    各チャンクは (設問番号, 設問見出し, 自由回答の行) のリスト。
+    """
+    chunks = []
+    current = []
+    size = 0
+    for block in blocks:
+        if not block.free_text:
+            continue
+        heading_tokens = estimate_text_tokens(block.heading)
+        for part in _split_lines(block.free_text, max(1, max_tokens - heading_tokens)):
+            tokens = heading_tokens + sum(estimate_text_tokens(line) for line in part)
+            if current and size + tokens > max_tokens:
+                chunks.append(current)
+                current = []
+                size = 0
+            current.append((block.number, block.heading, part))
+            size += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk_text(chunk: list) -> str:
+    return "\n\n".join(heading + "\n" + "\n".join(lines) for _, heading, lines in chunk)
+
+
+def parse_map_result(text: str) -> dict:
+    """要約結果のJSONを {設問番号: 要約} にする（JSONとして読めなければ ValueError）"""
+    data = json.loads(text)
+    summaries = data.get("summaries", data) if isinstance(data, dict) else None
+    if not isinstance(summaries, dict):
+        raise ValueError("要約の形式が想定と異なります")
+    result = {}
+    for key, value in summaries.items():
+        match = re.search(r"\d+", str(key))
+        if match is None:
+            continue
+        if isinstance(value, list):
+            value = "\n".join(str(v) for v in value)
+        if isinstance(value, str) and value.strip():
+            result[int(match.group())] = value.strip()
+    return result
+
+
+def assemble(preamble: str, blocks: list, summaries: dict) -> str:
+    """設問と選択肢の行はそのまま、自由回答は要約に置き換えた縮約版を組み立てる"""
+    parts = [preamble] if preamble else []
+    parts.append(REDUCED_NOTE)
+    used = set()
+    for block in blocks:
+        lines = [block.heading, *block.answers]
+        if block.number in summaries and block.number not in used:
+            used.add(block.number)
+            lines += ["", "自由回答の要約：", *summaries[block.number]]
+        parts.append("\n".join(lines))
+    return "\n\n".join(parts)
+
+
+def collect_summaries(chunks: list, results: list) -> dict:
+    """チャンクごとの要約を {設問番号: 要約のリスト} にまとめる
+
+    要約に含まれなかった設問（要約に失敗したチャンクを含む）は、自由回答の行をそのまま残す。
+    同じ設問の要約はチャンクの順（元の行の順）に並べる。
+    """
+    summaries = {}
+    for chunk, result in zip(chunks, results):
+        seen = set()
+        for number, _, lines in chunk:
+            if number in seen:
+                continue
+            if number in result:
+                seen.add(number)
+                summaries.setdefault(number, []).append(result[number])
+            else:
+                summaries.setdefault(number, []).append("\n".join(lines))
+    return summaries
+
+
+def summary_blocks(blocks: list, summaries: dict) -> list:
+    """要約をもう一度要約するための設問ブロック（要約の各行を自由回答の行として扱う）
+
+    1回で要約しきれた短い設問は対象にしない。
+    """
+    result = []
+    for block in blocks:
+        parts = summaries.get(block.number)
+        if not parts or (len(parts) == 1 and estimate_text_tokens(parts[0]) <= MAP_OUTPUT_TOKENS):
+            continue
+        lines = [line for part in parts for line in part.splitlines() if line.strip()]
+        result.append(QuestionBlock(block.number, block.heading, [], lines))
+    return result
+
+
+def fit_summaries(preamble: str, blocks: list, summaries: dict, max_tokens: int) -> dict:
+    """それでも収まらない場合は、設問ごとの要約を同じ長さの上限で後ろから切り詰める"""
+    if not summaries or estimate_text_tokens(assemble(preamble, blocks, summaries)) <= max_tokens:
+        return summaries
+    fixed = estimate_text_tokens(assemble(preamble, blocks, {}))
+    budget = max(MIN_SUMMARY_TOKENS, (max_tokens - fixed) // len(summaries))
+    fitted = {}
+    for number, parts in summaries.items():
+        lines = []
+        size = estimate_text_tokens(TRUNCATED_NOTE)
+        for line in (line for part in parts for line in part.splitlines()):
+            size += estimate_text_tokens(line)
+            if size > budget:
+                lines.append(TRUNCATED_NOTE)
+                break
+            lines.append(line)
+        fitted[number] = lines
+    return fitted
+
+
+def _next_round(preamble, blocks, summaries, previous_tokens, rounds):
+    """もう一度要約するなら次のチャンク、しないなら None を返す"""
+    tokens = estimate_text_tokens(assemble(preamble, blocks, summaries))
+    if tokens <= MAP_REDUCE_THRESHOLD or rounds >= MAX_ROUNDS or tokens >= previous_tokens:
+        return None, tokens
+    return build_chunks(summary_blocks(blocks, summaries)), tokens
+
+
+def _result(survey_data, preamble, blocks, summaries, chunk_count, rounds, started) -> ReducedSurvey:
+    text = assemble(preamble, blocks, fit_summaries(preamble, blocks, summaries, MAP_REDUCE_THRESHOLD))
+    return ReducedSurvey(
+        text=text,
+        original_tokens=estimate_text_tokens(survey_data),
+        reduced_tokens=estimate_text_tokens(text),
+        chunks=chunk_count,
+        map_time=time.perf_counter() - started,
+        rounds=rounds,
+    )
+
+
+def _map_messages(chunk) -> list:
+    return build_survey_map_messages(chunk_text(chunk))
+
+
+def reduce_survey(survey_data: str, model: str = DEFAULT_MODEL, bypass_cache: bool = False,
+                  on_progress=None) -> ReducedSurvey:
+    """自由回答をチャンクごとに並列で要約し、縮約版のアンケートを返す
+
+    縮約版がまだ MAP_REDUCE_THRESHOLD を超える場合は要約をさらに要約し（最大 MAX_ROUNDS 回）、
+    それでも超える分は設問ごとに切り詰める。
+    on_progress(完了数, チャンク数) は各回の開始時と各チャンクの完了時に呼ばれる
+    （例外を送出すると残りの要約を取り消して中断する）。
+    """
+    started = time.perf_counter()
+    preamble, blocks = split_blocks(survey_data)
+
+    def summarize(chunk):
+        for attempt in range(2):
+            result = complete_text(
+                _map_messages(chunk),
+                model=model,
+                temperature=0.2,
+                response_format={"type": "json_object"},
+                # 読めない応答だった場合は、キャッシュや同時実行中の呼び出しを使わずにやり直す
+                bypass_cache=bypass_cache or attempt > 0,
+                expected_output_tokens=MAP_OUTPUT_TOKENS,
+            )
+            try:
+                return parse_map_result(result)
+            except ValueError:
+                continue
+        return {}
+
+    summaries = {}
+    chunks = build_chunks(blocks)
+    chunk_count = rounds = 0
+    tokens = estimate_text_tokens(survey_data)
+    while chunks:
+        results = [{} for _ in chunks]
+        if on_progress:
+            on_progress(0, len(chunks))
+        with ThreadPoolExecutor(max_workers=min(MAP_WORKERS, len(chunks))) as executor:
+            # 計測用のページ名を引き継ぐため、呼び出し元のコンテキストで実行する
+            futures = {
+                executor.submit(contextvars.copy_context().run, summarize, chunk): i
+                for i, chunk in enumerate(chunks)
+            }
+            try:
+                for done, future in enumerate(as_completed(futures), 1):
+                    results[futures[future]] = future.result()
+                    if on_progress:
+                        on_progress(done, len(chunks))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        summaries = {**summaries, **collect_summaries(chunks, results)}
+        chunk_count += len(chunks)
+        rounds += 1
+        chunks, tokens = _next_round(preamble, blocks, summaries, tokens, rounds)
+    return _result(survey_data, preamble, blocks, summaries, chunk_count, rounds, started)
+
+
+async def areduce_survey(survey_data: str, model: str = DEFAULT_MODEL, bypass_cache: bool = False) -> ReducedSurvey:
+    """reduce_survey() のasyncio版"""
+    started = time.perf_counter()
+    preamble, blocks = split_blocks(survey_data)
+
+    async def summarize(chunk):
+        for attempt in range(2):
+            result = await acomplete_text(
+                _map_messages(chunk),
+                model=model,
+                temperature=0.2,
+                response_format={"type": "json_object"},
+                bypass_cache=bypass_cache or attempt > 0,
+                expected_output_tokens=MAP_OUTPUT_TOKENS,
+            )
+            try:
+                return parse_map_result(result)
+            except ValueError:
+                continue
+        return {}
+
+    summaries = {}
+    chunks = build_chunks(blocks)
+    chunk_count = rounds = 0
+    tokens = estimate_text_tokens(survey_data)
+    while chunks:
+        results = await asyncio.gather(*(summarize(chunk) for chunk in chunks))
+        summaries = {**summaries, **collect_summaries(chunks, results)}
+        chunk_count += len(chunks)
+        rounds += 1
+        chunks, tokens = _next_round(preamble, blocks, summaries, tokens, rounds)
+    return _result(survey_data, preamble, blocks, summaries, chunk_count, rounds, started)
@@ -0,0 +1,334 @@
+"""
+LLM呼び出しの計測
+呼び出しごとのレイテンシ・トークン数・リトライ・エラーをページとモデル別に記録し、
+ローテーションするJSON Linesログと、Prometheusのテキスト形式のエンドポイントに出力する
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+
+LOG_DIR = Path(os.getenv("YAE_TELEMETRY_DIR", "logs"))
+LOG_FILE = "llm_calls.jsonl"
+LOG_MAX_BYTES = int(os.getenv("YAE_TELEMETRY_LOG_MB", "5")) * 1024 * 1024
+LOG_BACKUPS = 5
+# Prometheusのエンドポイント（0で無効）
+METRICS_HOST = os.getenv("YAE_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("YAE_METRICS_PORT", "9464"))
+# ダッシュボード用にメモリに残す直近の呼び出し数
+RECENT_LIMIT = 5000
+
+LATENCY_BUCKETS = (0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+# 100万トークンあたりの料金（USD）: (入力, キャッシュされた入力, 出力)
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+}
+
+# 計測に付けるページ名（Prometheusのラベル値）と表示名
+PAGE_LABELS = {
+    "home": "ホーム",
+    "generate": "記事生成",
+    "evaluate": "記事評価",
+    "improve": "記事改善",
+    "dashboard": "運用ダッシュボード",
+    "batch": "バッチ",
+    "other": "その他",
+}
+
+# 呼び出し元のページ（ジョブやスレッドプールへは contextvars でコピーして引き継ぐ）
+_current_page = contextvars.ContextVar("yae_page", default="other")
+
+
+def set_page(page: str):
+    """以降のLLM呼び出しに付けるページ名を設定する（各ページの先頭で呼ぶ）"""
+    _current_page.set(page)
+    get_telemetry().record_page_run(page)
+
+
+def current_page() -> str:
+    return _current_page.get()
+
+
+def estimate_cost(model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+    """料金の概算（USD）。料金表にないモデルは0"""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        # "gpt-4o-mini-2024-07-18" のような日付付きの名前
+        prices = next((p for name, p in sorted(MODEL_PRICES.items(), key=lambda i: -len(i[0]))
+                       if model.startswith(name)), (0.0, 0.0, 0.0))
+    input_price, cached_price, output_price = prices
+    uncached = max(0, prompt_tokens - cached_tokens)
+    return (uncached * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1_000_000
+
+
+@dataclass
+class CallRecord:
+    """LLM呼び出し1回分の計測値"""
+    model: str
+    kind: str
+    page: str = field(default_factory=current_page)
+    started: float = field(default_factory=time.time)
+    status: str = ""
+    latency: float = 0.0
+    ttft: float = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    retries: int = 0
+    cost: float = 0.0
+    error: str = ""
+    upstream: bool = False
+    _t0: float = field(default_factory=time.perf_counter, repr=False)
+
+    def mark_first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self._t0
+
+    def set_usage(self, usage):
+        """APIの usage（prompt_tokens / completion_tokens / prompt_tokens_details.cached_tokens）を反映"""
+        if usage is None:
+            return
+        self.prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        self.completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.cached_tokens = getattr(details, "cached_tokens", 0) or 0
+
+    def finish(self, status: str, error=None):
+        """計測を終えて記録する
+
+        status は ok / cache_hit / coalesced（実行中の同じ呼び出しの結果を共有）/ cancelled / error。
+        """
+        self.status = status
+        self.error = "" if error is None else type(error).__name__
+        self.latency = time.perf_counter() - self._t0
+        self.cost = estimate_cost(self.model, self.prompt_tokens, self.cached_tokens, self.completion_tokens)
+        get_telemetry().record(self)
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        del data["_t0"]
+        return data
+
+
+class Telemetry:
+    """計測値の集計（Prometheus用のカウンター・ヒストグラムと、直近の呼び出し）"""
+
+    def __init__(self, log_dir=LOG_DIR):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=RECENT_LIMIT)
+        self._counters = {}
+        self._histograms = {}
+        self._log_dir = Path(log_dir)
+        self._logger = None
+
+    def _get_logger(self) -> logging.Logger:
+        if self._logger is None:
+            self._log_dir.mkdir(parents=True, exist_ok=True)
+            logger = logging.getLogger(f"yae.telemetry.{id(self)}")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = RotatingFileHandler(
+                self._log_dir / LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            self._logger = logger
+        return self._logger
+
+    def _inc(self, name: str, labels: tuple, amount: float = 1.0):
+        self._counters[(name, labels)] = self._counters.get((name, labels), 0.0) + amount
+
+    def record(self, record: CallRecord):
+        labels = (("page", record.page), ("model", record.model))
+        with self._lock:
+            self._recent.append(record.to_dict())
+            self._inc("yae_llm_requests_total", labels + (("status", record.status),))
+            self._inc("yae_llm_tokens_total", labels + (("type", "prompt"),), record.prompt_tokens)
+            self._inc("yae_llm_tokens_total", labels + (("type", "completion"),), record.completion_tokens)
+            self._inc("yae_llm_tokens_total", labels + (("type", "cached"),), record.cached_tokens)
+            self._inc("yae_llm_retries_total", labels, record.retries)
+            self._inc("yae_llm_cost_usd_total", labels, record.cost)
+            if record.status in ("ok", "error"):
+                # 上流を呼んだものだけをレイテンシの分布に入れる
+                histogram = self._histograms.setdefault(labels, [0] * len(LATENCY_BUCKETS) + [0.0, 0])
+                for i, bound in enumerate(LATENCY_BUCKETS):
+                    if record.latency <= bound:
+                        histogram[i] += 1
+                histogram[-2] += record.latency
+                histogram[-1] += 1
+        try:
+            self._get_logger().info(json.dumps(record.to_dict(), ensure_ascii=False))
+        except OSError:
+            pass
+
+    def record_page_run(self, page: str):
+        with self._lock:
+            self._inc("yae_page_runs_total", (("page", page),))
+
+    def recent(self) -> list:
+        """このプロセスで記録した直近の呼び出し（古い順）"""
+        with self._lock:
+            return list(self._recent)
+
+    def render_prometheus(self) -> str:
+        """Prometheusのテキスト形式"""
+        def format_labels(labels):
+            escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels]
+            return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}" if labels else ""
+
+        help_texts = {
+            "yae_llm_requests_total": "LLM呼び出し回数",
+            "yae_llm_tokens_total": "トークン数",
+            "yae_llm_retries_total": "リトライ回数",
+            "yae_llm_cost_usd_total": "推定料金（USD）",
+            "yae_page_runs_total": "ページのスクリプト実行回数",
+        }
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+
+        lines = []
+        for name, help_text in help_texts.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (counter_name, labels), value in counters:
+                if counter_name == name:
+                    lines.append(f"{name}{format_labels(labels)} {value:g}")
+
+        lines.append("# HELP yae_llm_latency_seconds LLM呼び出しのレイテンシ（上流を呼んだもの）")
+        lines.append("# TYPE yae_llm_latency_seconds histogram")
+        for labels, histogram in histograms:
+            for bound, count in zip(LATENCY_BUCKETS, histogram):
+                lines.append(f"yae_llm_latency_seconds_bucket{format_labels(labels + (('le', f'{bound:g}'),))} {count}")
+            lines.append(f"yae_llm_latency_seconds_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram[-1]}")
+            lines.append(f"yae_llm_latency_seconds_sum{format_labels(labels)} {histogram[-2]:g}")
+            lines.append(f"yae_llm_latency_seconds_count{format_labels(labels)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+_server = None
+
+
+def get_telemetry() -> Telemetry:
+    """プロセス全体で共有する計測の集計を取得"""
+    global _telemetry
+    if _telemetry is None:
+        with _telemetry_lock:
+            if _telemetry is None:
+                _telemetry = Telemetry()
+    return _telemetry
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = get_telemetry().render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """/metrics を返すHTTPサーバーをバックグラウンドで起動する（プロセスで1回だけ）
+
+    起動したURLを返す。無効な場合やポートが使用中（別プロセスが起動済み）の場合は None。
+    """
+    global _server
+    if port <= 0:
+        return None
+    with _telemetry_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError:
+                _server = False
+            else:
+                threading.Thread(target=_server.serve_forever, name="yae-metrics", daemon=True).start()
+    if not _server:
+        return None
+    return f"http://{host}:{port}/metrics"
+
+
+def load_log_records(since: float = 0.0, log_dir=LOG_DIR) -> list:
+    """ローテーション済みのファイルを含むログから、since（UNIX時刻）以降の呼び出しを古い順に読む"""
+    base = Path(log_dir) / LOG_FILE
+    paths = [base.with_name(f"{LOG_FILE}.{i}") for i in range(LOG_BACKUPS, 0, -1)] + [base]
+    records = []
+    for path in paths:
+        if not path.exists():
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get("started", 0) >= since:
+                    records.append(record)
+    records.sort(key=lambda r: r.get("started", 0))
+    return records
+
+
+def percentile(values, q: float) -> float:
+    """q（0〜1）分位点（線形補間）"""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+# 上流を呼んだ呼び出し（レイテンシの集計対象）
+UPSTREAM_STATUSES = ("ok", "error")
+
+
+def summarize_calls(records) -> dict:
+    """呼び出しの記録をまとめる（レイテンシは上流を呼んだものだけが対象）"""
+    upstream = [r for r in records if r["status"] in UPSTREAM_STATUSES]
+    latencies = [r["latency"] for r in upstream]
+    ttfts = [r["ttft"] for r in upstream if r.get("ttft") is not None]
+    return {
+        "calls": len(records),
+        "upstream": len(upstream),
+        "errors": sum(1 for r in records if r["status"] == "error"),
+        "cache_hits": sum(1 for r in records if r["status"] == "cache_hit"),
+        "coalesced": sum(1 for r in records if r["status"] == "coalesced"),
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "ttft_p50": percentile(ttfts, 0.50),
+        "prompt_tokens": sum(r["prompt_tokens"] for r in records),
+        "completion_tokens": sum(r["completion_tokens"] for r in records),
+        "cached_tokens": sum(r["cached_tokens"] for r in records),
+        "retries": sum(r["retries"] for r in records),
+        "cost": sum(r["cost"] for r in records),
+    }
+
+
+def bucket_calls(records, bucket_seconds: float) -> list:
+    """開始時刻で一定間隔に区切り、区間ごとの集計を古い順に返す（"time" は区間の開始UNIX時刻）"""
+    buckets = {}
+    for record in records:
+        start = record["started"] // bucket_seconds * bucket_seconds
+        buckets.setdefault(start, []).append(record)
+    return [{"time": start, **summarize_calls(group)} for start, group in sorted(buckets.items())]
@@ -0,0 +1,13 @@
+from edit_ops import apply_proposals
+
+
+def test_deletion_proposal_removes_sentence():
+    result = apply_proposals("今日は晴れです。とても暑いです。", [{"before": "とても暑いです。", "after": ""}])
+    assert result.article == "今日は晴れです。"
+    assert len(result.applied) == 1
+    assert not result.failed
+
+
+def test_trailing_punctuation_is_not_duplicated():
+    result = apply_proposals("今日は晴れです。", [{"before": "今日は晴れです", "after": "今日は快晴です。"}])
+    assert result.article == "今日は快晴です。"
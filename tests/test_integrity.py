@@ -0,0 +1,54 @@
+from pathlib import Path
+
+from integrity import check_integrity
+
+SURVEY = (Path(__file__).resolve().parent.parent / "enquete" / "survey_data_autumn.md").read_text(encoding="utf-8")
+
+YES_NO_SURVEY = """## 調査概要
+- 有効回答数: 500名
+
+### Q1: 秋が好きですか？
+A1: はい 80.0%、いいえ 20.0%
+
+### Q2: 秋に旅行しますか？
+A2: はい 35.0%、いいえ 65.0%
+"""
+
+
+def statuses(survey: str, article: str) -> list:
+    return [f.status for f in check_integrity(survey, article).findings]
+
+
+def test_named_option_with_wrong_percent_is_mismatch():
+    assert statuses(SURVEY, "食欲の秋が11.4%でトップでした。") == ["mismatch"]
+
+
+def test_named_option_with_wrong_approximation_is_mismatch():
+    assert statuses(SURVEY, "食欲の秋が約3割でした。") == ["mismatch"]
+
+
+def test_named_option_with_its_own_percent_is_ok():
+    assert statuses(SURVEY, "食欲の秋が67.1%でトップでした。") == ["ok"]
+
+
+def test_complement_is_ok_only_when_written_as_other_than():
+    assert statuses(SURVEY, "食欲の秋以外を選んだ人は約3割でした。") == ["ok"]
+
+
+def test_sum_of_options_named_in_sentence_is_ok():
+    assert statuses(SURVEY, "食欲の秋とスポーツの秋を合わせると78.5%になりました。") == ["ok"]
+
+
+def test_sentence_without_option_name_falls_back_to_any_value():
+    assert statuses(SURVEY, "約7割が食欲を選びました。") == ["ok"]
+
+
+def test_shared_labels_match_any_question():
+    assert statuses(YES_NO_SURVEY, "旅行する人は「はい」が35.0%でした。") == ["ok"]
+    assert statuses(YES_NO_SURVEY, "「はい」が50.0%でした。") == ["mismatch"]
+
+
+def test_respondent_count_is_checked():
+    report = check_integrity(SURVEY, "845名に聞きました。900名ではありません。")
+    assert [f.status for f in report.findings] == ["ok", "mismatch"]
+    assert report.score == 4